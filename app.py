@@ -0,0 +1,691 @@
+# The MQTT controller: configuration, command handling, the connection supervisor and the asyncio tasks.
+# main.py only calls main(); this module and controller.py ship as .mpy (tools/build_mpy.py).
+from wifi_manager import WifiManager, LAST_NETWORK_KEY
+from controller import (device_topic, DEFAULT_POLL_RATES, validate_poll_rates, PollScheduler, MachineSlot,
+    validate_machine, validate_machines, get_command_id, command_slave, Outbox, CommandQueue, VEND_COMMANDS,
+    MACHINE_COMMANDS, MQTTSocket, RECONNECT_MAX_ATTEMPTS, RECONNECT_STABLE_S, backoff_delay)
+import config_store
+import machine
+import time
+import ujson as json
+from umqtt.simple import MQTTClient
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+# --- ส่วนโค้ดเดิมที่ไม่ต้องแก้ไข (จาก main.py เดิม) ---
+def resetWIFI():
+    # One write to config.bin: forget every network, back to version 2
+    config_store.update({"version": 2}, remove=("wifi", "wifi_config", LAST_NETWORK_KEY))
+
+def get_device_serial_number():
+    try:
+        import machine
+        import ubinascii
+        return ubinascii.hexlify(machine.unique_id()).decode('utf-8').upper()
+    except :
+        return "UNKNOWN_SERIAL"
+
+# MQTT Settings
+MQTT_BROKER = "34.124.162.209"
+MQTT_PORT = 1883
+MQTT_KEEPALIVE = 60 # วินาที, ping ทุกครึ่งหนึ่งของค่านี้
+MQTT_CLIENT_ID = get_device_serial_number()
+STATUS_TOPIC = device_topic(MQTT_CLIENT_ID, "status")
+COMMAND_TOPIC = device_topic(MQTT_CLIENT_ID, "commands")
+COMMAND_RESPONSE_TOPIC = device_topic(MQTT_CLIENT_ID, "command_response")
+MODBUS_STATS_TOPIC = device_topic(MQTT_CLIENT_ID, "modbus_stats")
+
+# OTA: manifest of file hashes, see tools/make_manifest.py
+OTA_MANIFEST_URL = 'https://raw.githubusercontent.com/SuperBoss221/wash_mqtt/refs/heads/main/manifest.json'
+
+# Task intervals
+COMMAND_POLL_MS = 20
+HEARTBEAT_INTERVAL = 2 # วินาที
+MODBUS_STATS_INTERVAL = 300 # วินาที, ส่งสถิติ RS-485 (timeout, CRC, exception) ทุกช่วงนี้
+
+led = machine.Pin(2, machine.Pin.OUT, value=0)
+debounce_delay = 1000
+timer_direction = 0
+
+import wash
+
+# Global MQTT client instance
+client = None
+
+# --- Status payload format: "json" (default) or "binary" (status_codec) ---
+def read_status_format():
+    value = config_store.get('status_format')
+    return value if value in ('json', 'binary') else 'json'
+
+def write_status_format(value):
+    config_store.update({'status_format': value})
+
+status_format = read_status_format()
+
+# --- Adaptive status polling: fast around state changes, slow while a machine sits idle (controller.PollScheduler) ---
+def read_poll_rates():
+    try:
+        return validate_poll_rates(config_store.get('poll_rates') or {})
+    except (ValueError, TypeError, AttributeError):
+        return dict(DEFAULT_POLL_RATES)
+
+def write_poll_rates(rates):
+    # poll_rates is updated in place, store a copy so the next change is seen as one
+    config_store.update({'poll_rates': dict(rates)})
+
+# Shared by every machine on the bus, set over MQTT with the poll_rates command
+poll_rates = read_poll_rates()
+# Set whenever a poll becomes due early (vend command, new rates)
+poll_wake = asyncio.Event()
+# The status task lets go of the CPU while it waits for a slave; held around every bus transaction so
+# a command never puts a frame on the wire in the middle of a poll
+bus_lock = asyncio.Lock()
+
+# --- Machines on the RS-485 bus ---
+# config_store "machines": [{"slave": 1, "type": "wash"}, {"slave": 2, "type": "dryer"}, ...]
+# Without it the controller drives the single machine of wash.py on the legacy topics.
+
+def new_slot(device, multi):
+    return MachineSlot(device, multi, MQTT_CLIENT_ID, PollScheduler(poll_rates, poll_wake))
+
+def write_machines(machines):
+    # An empty list goes back to the single wash.py machine
+    if machines:
+        config_store.update({'machines': machines})
+    else:
+        config_store.update(remove=('machines',))
+
+def load_machines():
+    """ One slot per valid "machines" entry; bad entries are skipped, and with none left the single
+        wash.py machine runs on the legacy topics so a bad config never stops the controller """
+    entries = config_store.get('machines')
+    slots = []
+    if entries:
+        from register_map import MODELS, Machine
+        if not isinstance(entries, list):
+            print(f"Ignoring machines config, expected a list: {entries}")
+            entries = ()
+        for entry in entries:
+            try:
+                entry = validate_machine(entry, [slot.slave for slot in slots], wash.DEVICE_TYPE)
+            except ValueError as e:
+                print(f"Skipping machines entry: {e}")
+                continue
+            slots.append(new_slot(Machine(MODELS[entry["type"]], wash.modbus_client, entry["slave"]), True))
+        if not slots:
+            print("No usable machines entry, polling the single wash.py machine")
+    return slots or [new_slot(wash.device, False)]
+
+machine_slots = load_machines()
+machines_by_slave = {slot.slave: slot for slot in machine_slots}
+MULTI_MACHINE = machine_slots[0].multi
+MACHINE_COMMAND_TOPIC = device_topic(MQTT_CLIENT_ID, "commands", "+")
+
+def find_slot(data_json):
+    """ The machine a command is addressed to, or None if the slave id is unknown """
+    slave = command_slave(data_json)
+    if slave is None:
+        return machine_slots[0] if not MULTI_MACHINE else None
+    try:
+        return machines_by_slave.get(int(slave))
+    except (ValueError, TypeError):
+        return None
+
+# --- Modbus retry policy (attempts, per-attempt timeout, backoff), set over MQTT with modbus_retry ---
+def load_modbus_retry():
+    try:
+        wash.modbus_client.set_retry_policy(**(config_store.get('modbus_retry') or {}))
+    except (ValueError, TypeError):
+        pass
+
+def write_modbus_retry():
+    config_store.update({'modbus_retry': wash.modbus_client.retry_policy()})
+
+load_modbus_retry()
+
+def modbus_stats_payload():
+    modbus_client = wash.modbus_client
+    return {
+        "client_id": MQTT_CLIENT_ID,
+        "uptime_ms": time.ticks_ms(),
+        "stats": modbus_client.stats,
+        "exception_codes": {str(code): count for code, count in modbus_client.exception_codes.items()},
+        "retry": modbus_client.retry_policy(),
+    }
+
+# --- Outbound buffer: command responses survive outages and are republished with QoS1 (controller.Outbox) ---
+outbox = Outbox()
+
+def send_response(response_data, vend=False, topic=COMMAND_RESPONSE_TOPIC):
+    """ Publish a command response with QoS1, or park it in the outbox while offline """
+    payload = json.dumps(response_data)
+    if not mqtt_ready.is_set():
+        outbox.add(topic, payload, vend)
+        return
+    try:
+        # Anything still parked goes first so responses keep their order
+        outbox.flush(client)
+        client.publish(topic, payload.encode(), qos=1)
+    except OSError:
+        outbox.add(topic, payload, vend)
+        raise
+
+# --- Command queue: vend-critical commands go ahead of status and maintenance (controller.CommandQueue) ---
+command_queue = CommandQueue()
+
+def sub_cb(topic, msg):
+    try:
+        data_json = json.loads(msg.decode())
+        if not isinstance(data_json, dict) or 'command' not in data_json:
+            return
+        if not isinstance(data_json['command'], dict):
+            print(f"Ignoring malformed command: {data_json['command']}")
+            return
+        if topic != COMMAND_TOPIC and command_slave(data_json) is None:
+            # washing_machine/<id>/<slave>/commands
+            data_json['slave'] = int(topic.split(b'/')[2])
+        dropped = command_queue.put(data_json)
+        if dropped is not None:
+            response_data = {"status": "error", "version": 3.2, "message": f"Command queue full, {dropped} dropped. Try again."}
+            send_response(response_data)
+    except ValueError:
+        print(f"Failed to parse JSON from MQTT message")
+    except Exception as e:
+        print(f"Error in sub_cb: {e}")
+
+def interpret_command(data_json, queued_ms=None):
+    global client, status_format
+
+    if 'command' in data_json:
+        cmd = data_json['command']
+        response_data = {}
+        vend = False
+        command_id = None
+        slot = None
+        topic = COMMAND_RESPONSE_TOPIC
+
+        try:
+            # Anything but an object here is answered with an error, never raised out of the worker
+            if not isinstance(cmd, dict):
+                raise ValueError(f"command must be an object, got {cmd}")
+            vend = cmd.get('key') in VEND_COMMANDS
+            command_id = get_command_id(data_json)
+            slot = find_slot(data_json)
+            if slot and cmd.get('key') in MACHINE_COMMANDS:
+                topic = slot.response_topic
+            if cmd['key'].startswith('update_'):
+                import ota # โหลดเฉพาะตอนสั่งอัปเดต
+            if cmd['key'] in MACHINE_COMMANDS and slot is None:
+                response_data = {"status": "error", "version": 3.2, "message": f"Unknown slave {command_slave(data_json)}. Known: {list(machines_by_slave)}"}
+            # --- ส่วนที่นำกลับมาและปรับปรุงสำหรับการอัปเดตโค้ด ---
+            elif cmd['key'] == 'update_code' and 'url' in cmd and 'file_name' in cmd:
+                print(f"Updating code from {cmd['url']} to {cmd['file_name']}")
+                ok, message = ota.download_to_file(cmd['url'], cmd['file_name'], cmd.get('sha256'))
+                if ok:
+                    response_data = {"status": "success", "message": f"{message}. Rebooting..."}
+                    send_response(response_data)
+                    time.sleep(5)
+                    machine.reset()
+                    return True # ออกจากฟังก์ชันหลังจากสั่งรีเซ็ต
+                else:
+                    response_data = {"status": "error", "message": message}
+
+            elif cmd['key'] == 'update_wash' and 'value' in cmd:
+                print(f"Updating wash.py from {cmd['value']}")
+                ok, message = ota.download_to_file(cmd['value'], 'wash.py', cmd.get('sha256'))
+                if ok:
+                    response_data = {"status": "success", "message": f"{message}. Rebooting..."}
+                    send_response(response_data)
+                    time.sleep(5)
+                    machine.reset()
+                    return True
+
+                else:
+                    response_data = {"status": "error", "message": message}
+
+            elif cmd['key'] == 'update_main' and 'value' in cmd:
+                print(f"Updating main.py from {cmd['value']}")
+                ok, message = ota.download_to_file(cmd['value'], 'main.py', cmd.get('sha256'))
+                if ok:
+                    response_data = {"status": "success", "message": f"{message}. Rebooting..."}
+                    send_response(response_data)
+                    time.sleep(5)
+                    machine.reset()
+                    return True
+                else:
+                    response_data = {"status": "error", "message": message}
+
+            elif cmd['key'] == 'update_version':
+                print("Updating all versions...")
+                summary = ota.update_from_manifest(cmd.get('manifest', OTA_MANIFEST_URL), wash.DEVICE_TYPE)
+                transfer = f"{summary['bytes_received']} bytes received, {summary['bytes_written']} written"
+                if summary['failed']:
+                    # Only reboot into a complete file set; the running code stays in memory until the next update_version
+                    installed = ', '.join(summary['updated']) or 'none'
+                    response_data = {"status": "error", "version": 3.2, "message": f"Firmware update failed: {', '.join(summary['failed'])}. Installed: {installed}, not attempted: {', '.join(summary['pending']) or 'none'} ({transfer}). Not rebooting.", "ota": summary}
+                elif not summary['updated']:
+                    response_data = {"status": "success", "version": 3.2, "message": "Firmware already up to date.", "ota": summary}
+                else:
+                    response_data = {"status": "success","version": 3.2, "message": f"Firmware update initiated. Updated: {', '.join(summary['updated'])} ({transfer}). Rebooting...", "ota": summary}
+                    send_response(response_data)
+                    led.value(0)
+                    time.sleep(5)
+                    machine.reset()
+                    return True # ออกจากฟังก์ชันหลังจากสั่งรีเซ็ต
+            # --- จบส่วนอัปเดตโค้ด ---
+
+            elif cmd['key'] == 'reset_error':
+                result = slot.device.reset_error()
+                response_data = {"status": "success", "version": 3.2,"message": "Error reset initiated.", "modbus_response": result}
+                send_response(response_data, False, topic)
+                led.value(0)
+                machine.reset()
+                return True
+            elif cmd['key'] == 'reset_wifi':
+                resetWIFI()
+                response_data = {"status": "success", "version": 3.2,"message": "WiFi reset initiated."}
+                send_response(response_data)
+                time.sleep(5)
+                led.value(0)
+                machine.reset()
+                return True
+            elif cmd['key'] == 'get_status':
+                wash_status = slot.device.get_machine_status()
+                status_payload = {"version": 3.2, "cmd": "get_status", "ip": str(WiFIManager.get_address()[0]), "client_id": get_device_serial_number(), "status": wash_status}
+                if slot.multi:
+                    status_payload["slave"] = slot.slave
+                client.publish(slot.status_topic, json.dumps(status_payload).encode())
+                response_data = {"status": "success", "version": 3.2,"message": "Status published."}
+            elif cmd['key'] == 'status_keyframe' and 'value' in cmd:
+                for each in machine_slots:
+                    each.publisher.keyframe_interval = int(cmd['value'])
+                    each.publisher.force_keyframe()
+                response_data = {"status": "success", "version": 3.2,"message": f"Status keyframe interval set to {int(cmd['value'])}s."}
+            elif cmd['key'] == 'status_format' and cmd.get('value') in ('json', 'binary'):
+                status_format = cmd['value']
+                write_status_format(status_format)
+                for each in machine_slots:
+                    each.publisher.force_keyframe()
+                response_data = {"status": "success", "version": 3.2,"message": f"Status format set to {status_format}."}
+            elif cmd['key'] == 'poll_rates':
+                # {"key": "poll_rates", "value": {"fast": 1, "active": 5, "idle": 30, "hold": 15}}, value omitted = query
+                response_data = {"status": "success", "version": 3.2, "message": "Poll rates.", "poll_rates": poll_rates}
+                if isinstance(cmd.get('value'), dict):
+                    try:
+                        poll_rates.update(validate_poll_rates(cmd['value'], poll_rates))
+                        write_poll_rates(poll_rates)
+                        poll_wake.set()
+                        response_data = {"status": "success", "version": 3.2, "message": "Poll rates updated.", "poll_rates": poll_rates}
+                    except (ValueError, TypeError) as e:
+                        response_data = {"status": "error", "version": 3.2, "message": f"Invalid poll rates: {e}", "poll_rates": poll_rates}
+            elif cmd['key'] == 'modbus_retry':
+                # {"key": "modbus_retry", "value": {"attempts": 3, "timeout_ms": 500, "backoff_ms": 20}}, value omitted = query
+                response_data = {"status": "success", "version": 3.2, "message": "Modbus retry policy.", "retry": wash.modbus_client.retry_policy()}
+                if isinstance(cmd.get('value'), dict):
+                    try:
+                        wash.modbus_client.set_retry_policy(**cmd['value'])
+                        write_modbus_retry()
+                        response_data = {"status": "success", "version": 3.2, "message": "Modbus retry policy updated.", "retry": wash.modbus_client.retry_policy()}
+                    except (ValueError, TypeError) as e:
+                        response_data = {"status": "error", "version": 3.2, "message": f"Invalid retry policy: {e}", "retry": wash.modbus_client.retry_policy()}
+            elif cmd['key'] == 'machines':
+                # {"key": "machines", "value": [{"slave": 1, "type": "wash"}, {"slave": 2, "type": "dryer"}]}, [] = single machine,
+                # value omitted = query. The list is read at boot, so a change applies after a reboot
+                running = [{"slave": each.slave, "type": each.device_type} for each in machine_slots]
+                response_data = {"status": "success", "version": 3.2, "message": "Machines.", "machines": config_store.get('machines') or [], "running": running}
+                if 'value' in cmd:
+                    try:
+                        machines = validate_machines(cmd['value'], wash.DEVICE_TYPE)
+                        write_machines(machines)
+                        response_data = {"status": "success", "version": 3.2, "message": "Machines saved, reboot to apply.", "machines": machines, "running": running}
+                    except ValueError as e:
+                        response_data = {"status": "error", "version": 3.2, "message": f"Invalid machines: {e}", "machines": config_store.get('machines') or [], "running": running}
+            elif cmd['key'] == 'modbus_stats':
+                response_data = {"status": "success", "version": 3.2, "message": "Modbus stats.", "modbus_stats": modbus_stats_payload()}
+                if cmd.get('value') == 'reset':
+                    wash.modbus_client.reset_stats()
+            elif cmd['key'] == 'menu' and 'value' in cmd:
+                result = slot.device.select_program(int(cmd['value']))
+                response_data = {"status": "success","version": 3.2, "message": f"Program {cmd['value']} selected.", "modbus_response": result}
+            elif cmd['key'] == 'coins' and 'value' in cmd:
+                result = slot.device.add_coins(int(cmd['value']))
+                response_data = {"status": "success", "version": 3.2,"message": f"Added {cmd['value']} coins.", "modbus_response": result}
+            elif cmd['key'] == 'start':
+                result = slot.device.start_operation()
+                response_data = {"status": "success", "version": 3.2,"message": "Start command sent.", "modbus_response": result}
+            elif cmd['key'] == 'stop':
+                result = slot.device.stop_operation()
+                response_data = {"status": "success", "message": "Stop command sent.", "modbus_response": result}
+            elif cmd['key'] == 'transaction' and 'steps' in cmd:
+                modbus_response = slot.device.run_transaction(cmd['steps'])
+                response_data = {"status": modbus_response['status'], "version": 3.2,"message": "Transaction sent.", "modbus_response": modbus_response}
+            elif cmd['key'] == 'command' and 'address' in cmd and 'value' in cmd:
+                result = slot.device.send_command(int(cmd['address']), int(cmd['value']))
+                response_data = {"status": "success", "version": 3.2,"message": "Custom command sent.", "modbus_response": result}
+            elif cmd['key'] == 'reboot':
+                response_data = {"status": "success","version": 3.2, "message": "Device rebooting."}
+                send_response(response_data)
+                time.sleep(5)
+                machine.reset()
+            else:
+                response_data = {"status": "error", "version": 3.2,"message": "Unknown or incomplete command."}
+
+        except Exception as e:
+            print(f"Error processing command: {e}")
+            response_data = {"status": "error","version": 3.2, "message": f"Error processing command: {e}"}
+        finally:
+            if queued_ms is not None:
+                response_data["queued_ms"] = queued_ms
+            if command_id is not None:
+                response_data["id"] = command_id
+            if slot and slot.multi and topic == slot.response_topic:
+                response_data["slave"] = slot.slave
+            send_response(response_data, vend, topic)
+            if vend and slot:
+                slot.scheduler.kick()
+
+
+# --- ส่วนการเชื่อมต่อและกู้คืน (Robust Connection & Recovery) ---
+
+def connect_and_subscribe():
+    global client
+    if client:
+        try:
+            client.disconnect()
+            print("Disconnected existing MQTT client.")
+        except Exception as e:
+            print(f"Error disconnecting old client: {e}")
+
+    try:
+        client = MQTTClient(MQTT_CLIENT_ID, MQTT_BROKER, port=MQTT_PORT, keepalive=MQTT_KEEPALIVE)
+        client.set_callback(sub_cb)
+        # Persistent session + QoS1 subscription: the broker holds commands sent while we are offline
+        client.connect(clean_session=False)
+        client.sock = MQTTSocket(client.sock)
+        client.subscribe(COMMAND_TOPIC, qos=1)
+        if MULTI_MACHINE:
+            client.subscribe(MACHINE_COMMAND_TOPIC, qos=1)
+        # สถานะแรกหลังเชื่อมต่อใหม่ต้องเป็นแบบเต็ม
+        for slot in machine_slots:
+            slot.publisher.force_keyframe()
+        print(f"Connected to MQTT broker {MQTT_BROKER} and subscribed to {COMMAND_TOPIC.decode()}")
+        return client
+    except OSError as e:
+        print(f"Failed to connect to MQTT broker: {e}")
+        return None
+    except Exception as e:
+        print(f"An unexpected error occurred during MQTT connection: {e}")
+        return None
+
+# --- WIFI Connection ---
+WiFIManager = WifiManager()
+
+def connect_wifi_robustly():
+    print('Attempting to connect to WiFi...')
+    led.value(1)
+
+    WiFIManager.connect() # WifiManager.connect() จะพยายามต่อเอง หรือเข้า AP
+
+    if WiFIManager.is_connected():
+        print('Connected to WiFi!')
+        led.value(0)
+        if str(WiFIManager.get_address()[0]) == '0.0.0.0':
+            print('Error: Got 0.0.0.0 IP address. Rebooting device...')
+            led.value(0)
+            time.sleep(3)
+            machine.reset()
+    else:
+        print("Wi-Fi connection failed and portal didn't resolve. Rebooting...")
+        led.value(0)
+        time.sleep(3)
+        machine.reset()
+
+# --- Connection supervisor: reconnect in place with jittered exponential backoff, reboot only as a last resort ---
+def reconnect_once():
+    """ WiFi first if it dropped, then MQTT. Returns True when both are up """
+    global client
+    if not WiFIManager.reconnect():
+        print("WiFi reconnect failed.")
+        return False
+    client = connect_and_subscribe()
+    return client is not None
+
+def give_up():
+    print(f"Still offline after {RECONNECT_MAX_ATTEMPTS} attempts. Rebooting device to try fresh...")
+    led.value(0)
+    time.sleep(3)
+    machine.reset()
+
+def announce_online():
+    status_payload = {
+                "version": 3.2,
+                "app": "wash",
+                "device_type": "wash",
+                "ip": str(WiFIManager.get_address()[0]),
+                "client_id": get_device_serial_number(),
+                "status": "success",
+                "message":"online",
+                "boot_ms": time.ticks_ms(),
+                "wifi_ms": WiFIManager.time_to_ip_ms,
+                "wifi_path": WiFIManager.connect_path
+    }
+    if MULTI_MACHINE:
+        status_payload["machines"] = [[slot.slave, slot.device_type] for slot in machine_slots]
+    client.publish(COMMAND_RESPONSE_TOPIC, json.dumps(status_payload).encode())
+
+def connect_mqtt_at_boot():
+    # เชื่อมต่อ MQTT หลัง Wi-Fi เชื่อมต่อแล้ว
+    attempt = 0
+    while not reconnect_once():
+        attempt += 1
+        if attempt >= RECONNECT_MAX_ATTEMPTS:
+            give_up()
+        delay = backoff_delay(attempt)
+        print(f"MQTT connection failed. Retrying in {delay:.1f} seconds... ({attempt}/{RECONNECT_MAX_ATTEMPTS})")
+        time.sleep(delay)
+    announce_online()
+    try:
+        outbox.flush(client)
+    except OSError as e:
+        # Entries stay queued; the first failing task hands over to the supervisor
+        print(f"Outbox flush failed: {e}")
+    mqtt_ready.set()
+
+# Set while the MQTT link is up; commands and status wait on it
+mqtt_ready = asyncio.Event()
+reconnect_needed = asyncio.Event()
+
+def connection_lost(error):
+    """ Called by any task whose MQTT call failed; the supervisor takes it from there """
+    if mqtt_ready.is_set():
+        print(f"Network connection error (MQTT/WiFi): {error}. Attempting to recover...")
+        mqtt_ready.clear()
+        reconnect_needed.set()
+
+async def supervisor_loop():
+    # Failed attempts since the link was last stable. A reconnect that drops again within
+    # RECONNECT_STABLE_S counts as failed too, so a flapping broker still backs off and ends in give_up()
+    attempt = 0
+    online_since = time.ticks_ms()
+    while True:
+        await reconnect_needed.wait()
+        reconnect_needed.clear()
+        if time.ticks_diff(time.ticks_ms(), online_since) >= RECONNECT_STABLE_S * 1000:
+            attempt = 0
+        else:
+            # Dropped again soon after the last reconnect
+            attempt += 1
+        while True:
+            if attempt:
+                if attempt >= RECONNECT_MAX_ATTEMPTS:
+                    give_up()
+                delay = backoff_delay(attempt)
+                print(f"Reconnecting in {delay:.1f} seconds... ({attempt}/{RECONNECT_MAX_ATTEMPTS})")
+                await asyncio.sleep(delay)
+            try:
+                # Blocks the event loop: WiFi join_saved() (up to 4 s + 10 s per saved profile, plus a scan)
+                # and the MQTT connect. Nothing else can run offline anyway, status and commands wait on mqtt_ready
+                if reconnect_once():
+                    announce_online()
+                    outbox.flush(client)
+                    break
+                print("Reconnect failed.")
+            except OSError as e:
+                print(f"Network connection error (MQTT/WiFi): {e}. Attempting to recover...")
+            attempt += 1
+        online_since = time.ticks_ms()
+        mqtt_ready.set()
+
+# --- Async runtime: status polling, command intake/worker, keepalive and LED run as separate tasks ---
+
+async def publish_status(slot):
+    """ Poll one machine and publish if anything changed. Returns the raw status registers or None.
+        The other tasks run while it waits for the slave; hold bus_lock around it """
+    if status_format == 'binary':
+        import status_codec
+        registers = await slot.device.read_status_registers_async()
+        if slot.publisher.block_changed(registers):
+            client.publish(slot.status_topic, status_codec.encode_status(slot.device_type, slot.device_id, time.time(), slot.device.model["status_start"], registers))
+        return registers
+    wash_status = await slot.device.get_machine_status_async()
+    status_payload = {
+        "version": 3.2,
+        "app": slot.app,
+        "device_type": slot.json_device_type,
+        "error_status": False,
+        "ip": str(WiFIManager.get_address()[0]),
+        "client_id": get_device_serial_number(),
+    }
+    if slot.multi:
+        status_payload["slave"] = slot.slave
+    status_payload = slot.publisher.build(wash_status, status_payload)
+    if status_payload:
+        client.publish(slot.status_topic, json.dumps(status_payload).encode())
+    return wash_status.get("raw_data")
+
+def next_due_slot(after):
+    """ The machine whose poll is most overdue; ties go to the one after `after` so the bus is shared fairly """
+    count = len(machine_slots)
+    best = None
+    for i in range(count):
+        slot = machine_slots[(after + 1 + i) % count]
+        if best is None or time.ticks_diff(slot.scheduler.due, best.scheduler.due) < 0:
+            best = slot
+    return best
+
+async def wait_poll(seconds):
+    """ Sleep until the next poll is due, or until a command makes one due early """
+    poll_wake.clear()
+    try:
+        await asyncio.wait_for(poll_wake.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+async def status_loop():
+    first = True
+    last_index = -1
+    while True:
+        await mqtt_ready.wait()
+        slot = next_due_slot(last_index)
+        wait_ms = time.ticks_diff(slot.scheduler.due, time.ticks_ms())
+        if wait_ms > 0:
+            await wait_poll(wait_ms / 1000)
+            continue
+        last_index = machine_slots.index(slot)
+        registers = None
+        try:
+            async with bus_lock:
+                registers = await publish_status(slot)
+        except OSError as e:
+            connection_lost(e)
+        if first:
+            first = False
+            # ticks_ms() counts from reset on the device, so this is reset -> first status publish
+            print(f"Boot to first status publish: {time.ticks_ms()} ms")
+        slot.scheduler.schedule(registers)
+        # Give queued commands the bus between two polls
+        await asyncio.sleep(0)
+
+async def command_loop():
+    # check_msg() returns immediately when nothing is pending
+    while True:
+        await mqtt_ready.wait()
+        try:
+            client.check_msg()
+        except OSError as e:
+            connection_lost(e)
+        await asyncio.sleep(COMMAND_POLL_MS / 1000)
+
+async def command_worker():
+    while True:
+        item = command_queue.get()
+        if item is None:
+            command_queue.event.clear()
+            await command_queue.event.wait()
+            continue
+        await mqtt_ready.wait()
+        try:
+            # Commands still drive the bus synchronously (one write each, no retry after a lost
+            # response), so they only need the lock to wait for a poll in progress
+            async with bus_lock:
+                interpret_command(item[0], item[1])
+        except OSError as e:
+            connection_lost(e)
+        except Exception as e:
+            # One bad command must not take the other tasks (and the device) down with it
+            print(f"Error in command worker: {e}")
+            try:
+                send_response({"status": "error", "version": 3.2, "message": f"Error processing command: {e}"})
+            except OSError as e:
+                connection_lost(e)
+        # Let command_loop pull in anything newer before the next queued command runs
+        await asyncio.sleep(0)
+
+async def keepalive_loop():
+    while True:
+        await asyncio.sleep(MQTT_KEEPALIVE // 2)
+        if not mqtt_ready.is_set():
+            continue
+        try:
+            client.ping()
+        except OSError as e:
+            connection_lost(e)
+
+async def modbus_stats_loop():
+    while True:
+        await asyncio.sleep(MODBUS_STATS_INTERVAL)
+        if not mqtt_ready.is_set():
+            continue
+        try:
+            client.publish(MODBUS_STATS_TOPIC, json.dumps(modbus_stats_payload()).encode())
+        except OSError as e:
+            connection_lost(e)
+
+async def heartbeat_loop():
+    while True:
+        led.value(1)
+        await asyncio.sleep(0.05)
+        led.value(0)
+        await asyncio.sleep(HEARTBEAT_INTERVAL - 0.05)
+
+async def run():
+    # Network errors are handled in place by the supervisor; gather() re-raises anything else
+    await asyncio.gather(supervisor_loop(), status_loop(), command_loop(), command_worker(), keepalive_loop(), modbus_stats_loop(), heartbeat_loop())
+
+def main():
+    """ Boot: WiFi (or the captive portal), MQTT, then the event loop until something unrecoverable happens """
+    connect_wifi_robustly()
+    connect_mqtt_at_boot()
+    try:
+        asyncio.run(run())
+    except Exception as e:
+        print(f"An unexpected error occurred in main loop: {e}. Initiating a controlled reboot...")
+        led.value(0)
+        time.sleep(5)
+        machine.reset()
+
+    led.value(0)
+    time.sleep(5)
+    machine.reset()
@@ -0,0 +1,140 @@
+# Every persisted setting in one small file, read once at boot and cached in memory.
+#
+#   config.bin = <4sII magic, payload length, crc32(payload)> + JSON payload
+#
+# Writes go to config.bin.tmp and are renamed over config.bin, so a power cut leaves either the
+# old or the new file; a torn or corrupt file fails its checksum and the .tmp copy is tried next.
+#
+# Keys: wifi {ssid: password}, wifi_config, last_network, version, status_format, poll_rates,
+#       modbus_retry, machines
+import os
+import struct
+try:
+    import ujson as json
+except ImportError:
+    import json
+try:
+    import binascii
+except ImportError:
+    import ubinascii as binascii
+
+CONFIG_FILE = 'config.bin'
+CONFIG_MAGIC = b'WCF1'
+CONFIG_HEADER = '<4sII'
+CONFIG_HEADER_SIZE = 12
+
+# Files this store replaces: (file, key). Imported once when config.bin does not exist yet, then removed
+LEGACY_FILES = (
+    ('wifi.dat', 'wifi'),
+    ('config.json', 'wifi_config'),
+    ('version.json', 'version'),
+)
+
+_config = None
+
+
+def _read(filename):
+    """ The dict stored in filename, or None if it is missing, torn or corrupt """
+    try:
+        with open(filename, 'rb') as f:
+            header = f.read(CONFIG_HEADER_SIZE)
+            if len(header) != CONFIG_HEADER_SIZE:
+                return None
+            magic, length, crc = struct.unpack(CONFIG_HEADER, header)
+            payload = f.read(length)
+    except OSError:
+        return None
+    if magic != CONFIG_MAGIC or len(payload) != length or binascii.crc32(payload) & 0xFFFFFFFF != crc:
+        return None
+    try:
+        config = json.loads(payload)
+    except ValueError:
+        return None
+    return config if isinstance(config, dict) else None
+
+
+def _read_legacy(filename, key):
+    with open(filename) as f:
+        text = f.read()
+    if key == 'wifi':
+        profiles = {}
+        for line in text.split('\n'):
+            line = line.strip()
+            if line:
+                # The old format cannot tell which ';' separates the fields; passwords contain them more often than SSIDs
+                ssid, _, password = line.partition(';')
+                profiles[ssid] = password
+        return profiles
+    if key == 'version':
+        return json.loads(text).get('version')
+    return json.loads(text)
+
+
+def _migrate():
+    config = {}
+    found = []
+    for filename, key in LEGACY_FILES:
+        try:
+            config[key] = _read_legacy(filename, key)
+            found.append(filename)
+        except OSError:
+            pass
+        except (ValueError, AttributeError) as error:
+            print(f"Skipping unreadable {filename}: {error}")
+            found.append(filename)
+    # Written even when empty so later boots never probe for the legacy files again
+    _write(config)
+    for filename in found:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+    if found:
+        print(f"Moved {', '.join(found)} into {CONFIG_FILE}")
+    return config
+
+
+def _write(config):
+    payload = json.dumps(config).encode('utf-8')
+    tmp = CONFIG_FILE + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(struct.pack(CONFIG_HEADER, CONFIG_MAGIC, len(payload), binascii.crc32(payload) & 0xFFFFFFFF))
+        f.write(payload)
+    os.rename(tmp, CONFIG_FILE)
+
+
+def load():
+    """ The cached config dict; the first call reads flash. Treat it as read-only, change it with update() """
+    global _config
+    if _config is None:
+        config = _read(CONFIG_FILE)
+        if config is None:
+            # Power cut between writing the .tmp and the rename
+            config = _read(CONFIG_FILE + '.tmp')
+            if config is not None:
+                os.rename(CONFIG_FILE + '.tmp', CONFIG_FILE)
+        if config is None:
+            config = _migrate()
+        _config = config
+    return _config
+
+
+def get(key, default=None):
+    return load().get(key, default)
+
+
+def update(values=None, remove=()):
+    """ Set and/or delete keys in one write. Flash is only written when something actually changed """
+    config = load()
+    changed = False
+    for key, value in (values or {}).items():
+        if key not in config or config[key] != value:
+            config[key] = value
+            changed = True
+    for key in remove:
+        if key in config:
+            del config[key]
+            changed = True
+    if changed:
+        _write(config)
+    return changed
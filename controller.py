@@ -0,0 +1,427 @@
+# Building blocks of the MQTT controller in app.py: change-only status publishing, the adaptive poll
+# scheduler, machine slots, the response outbox, the command queue and the MQTT socket wrapper.
+# Nothing here touches the network or the bus at import, and the module ships as .mpy (tools/build_mpy.py).
+import time
+import ujson as json
+import os
+import random
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+def check_file_exists(filename):
+    try:
+        os.stat(filename)
+        return True
+    except OSError:
+        return False
+
+def device_topic(client_id, name, slave=None):
+    """ washing_machine/<client_id>/<name>, or washing_machine/<client_id>/<slave>/<name> for one machine on the bus """
+    if slave is None:
+        return f"washing_machine/{client_id}/{name}".encode()
+    return f"washing_machine/{client_id}/{slave}/{name}".encode()
+
+# --- Change-only status publishing ---
+STATUS_KEYFRAME_INTERVAL = 300 # วินาที, ส่งสถานะเต็มอย่างน้อยทุกช่วงนี้
+
+class StatusDeltaPublisher:
+    """ Keeps the last published status and turns each poll into a full keyframe, a delta of the
+        changed fields, or nothing at all when the machine state is unchanged. """
+
+    def __init__(self, keyframe_interval=STATUS_KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.last_status = None
+        self.last_keyframe = 0
+        self.seq = 0
+
+    def force_keyframe(self):
+        self.last_status = None
+
+    def build(self, status, base_payload):
+        """ Returns the payload dict to publish, or None if nothing changed """
+        now = time.ticks_ms()
+        last = self.last_status
+        if last is None or time.ticks_diff(now, self.last_keyframe) >= self.keyframe_interval * 1000:
+            payload = dict(base_payload)
+            payload["type"] = "keyframe"
+            payload["status"] = status
+            self.last_keyframe = now
+        else:
+            changed = {}
+            for key, value in status.items():
+                if key == "raw_data":
+                    continue
+                if last.get(key) != value:
+                    changed[key] = value
+            raw, last_raw = status.get("raw_data"), last.get("raw_data")
+            if raw and last_raw and len(raw) == len(last_raw):
+                raw_changed = {}
+                for i in range(len(raw)):
+                    if raw[i] != last_raw[i]:
+                        raw_changed[str(i)] = raw[i]
+                if raw_changed:
+                    changed["raw_data"] = raw_changed
+            elif raw != last_raw:
+                changed["raw_data"] = raw
+            if not changed:
+                return None
+            payload = {"version": base_payload.get("version"), "client_id": base_payload.get("client_id"), "type": "delta", "status": changed}
+        self.seq += 1
+        payload["seq"] = self.seq
+        # wash.get_machine_status() reuses its dict and raw_data list, keep a snapshot
+        snapshot = dict(status)
+        if status.get("raw_data") is not None:
+            snapshot["raw_data"] = list(status["raw_data"])
+        self.last_status = snapshot
+        return payload
+
+    def block_changed(self, registers):
+        """ Change-only check for the binary format: True when the register block differs or a keyframe is due """
+        now = time.ticks_ms()
+        block = list(registers) if registers else None
+        if self.last_status is None or time.ticks_diff(now, self.last_keyframe) >= self.keyframe_interval * 1000:
+            self.last_keyframe = now
+        elif self.last_status.get("raw_data") == block:
+            return False
+        self.seq += 1
+        self.last_status = {"raw_data": block}
+        return True
+
+# --- Adaptive status polling: fast around state changes, slow while a machine sits idle ---
+STATUS_POLL_INTERVAL = 5 # วินาที, ช่วง poll ปกติระหว่างเครื่องทำงาน (ดู PollScheduler)
+# Register offsets inside the status block (same layout on wash and dryer)
+REG_RUN_STATUS = 0
+REG_DOOR_STATUS = 1
+REG_REMAIN_HOUR = 3
+REG_REMAIN_SEC = 5
+# run status, door, program, step, coins required, current coins: any change is a transition
+TRANSITION_REGISTERS = (0, 1, 8, 9, 10, 11)
+RUN_ACTIVE = (3, 4) # Autorun, Manual
+DOOR_LOCKING = 5
+# วินาที: fast หลังมีการเปลี่ยนแปลง, active ระหว่างเครื่องทำงาน, idle ตอนว่าง, hold = ค้าง fast ไว้นานเท่าไร
+DEFAULT_POLL_RATES = {"fast": 1, "active": STATUS_POLL_INTERVAL, "idle": 30, "hold": 15}
+MIN_POLL_INTERVAL = 0.2
+# วินาที: เครื่องที่ไม่ตอบ poll ห่างขึ้นเท่าตัวจาก "active" ทุกครั้งที่ล้มเหลว จนถึงค่านี้
+FAILED_POLL_MAX_INTERVAL = 60
+
+def validate_poll_rates(rates, base=None):
+    """ Merge rates (any of fast/active/idle/hold) into base. Raises ValueError on unknown keys or bad values """
+    new_rates = dict(base or DEFAULT_POLL_RATES)
+    for key, value in rates.items():
+        if key not in DEFAULT_POLL_RATES:
+            raise ValueError(f"Unknown poll rate {key}")
+        new_rates[key] = float(value)
+    for key in ("fast", "active", "idle"):
+        if new_rates[key] < MIN_POLL_INTERVAL:
+            raise ValueError(f"{key} must be at least {MIN_POLL_INTERVAL}s")
+    if not new_rates["fast"] <= new_rates["active"] <= new_rates["idle"]:
+        raise ValueError("Poll rates must satisfy fast <= active <= idle")
+    return new_rates
+
+class PollScheduler:
+    """ Tracks when one machine is next due for a status poll, from its last register block.
+        rates is the poll rates dict shared by every machine (updated in place), wake the event
+        that tells the status loop a poll became due early. """
+
+    def __init__(self, rates, wake):
+        self.rates = rates
+        self.wake = wake
+        self.last = None
+        self.fast_until = time.ticks_ms()
+        self.due = time.ticks_ms()
+        self.failures = 0
+
+    def kick(self):
+        """ A vend command just went out: poll now and stay fast for a while """
+        now = time.ticks_ms()
+        self.fast_until = time.ticks_add(now, int(self.rates["hold"] * 1000))
+        self.due = now
+        self.wake.set()
+
+    def next_interval(self, registers):
+        rates = self.rates
+        now = time.ticks_ms()
+        if registers is None or len(registers) <= REG_REMAIN_SEC:
+            # Modbus failed: back off while it keeps failing so a dead slave does not hold up the bus
+            self.last = None
+            self.failures += 1
+            interval = rates["active"] * (1 << min(self.failures - 1, 8))
+            return max(rates["active"], min(interval, FAILED_POLL_MAX_INTERVAL))
+        self.failures = 0
+        last = self.last
+        if last is not None:
+            for i in TRANSITION_REGISTERS:
+                if i < len(registers) and registers[i] != last[i]:
+                    self.fast_until = time.ticks_add(now, int(rates["hold"] * 1000))
+                    break
+        self.last = list(registers)
+        if registers[REG_DOOR_STATUS] == DOOR_LOCKING or time.ticks_diff(self.fast_until, now) > 0:
+            return rates["fast"]
+        if registers[REG_RUN_STATUS] in RUN_ACTIVE:
+            remain = registers[REG_REMAIN_HOUR] * 3600 + registers[REG_REMAIN_HOUR + 1] * 60 + registers[REG_REMAIN_SEC]
+            # Near the end of a program the machine changes state soon
+            if remain and remain <= rates["active"] * 2:
+                return rates["fast"]
+            return rates["active"]
+        return rates["idle"]
+
+    def schedule(self, registers):
+        self.due = time.ticks_add(time.ticks_ms(), int(self.next_interval(registers) * 1000))
+
+# --- Machines on the RS-485 bus ---
+# config_store "machines": [{"slave": 1, "type": "wash"}, {"slave": 2, "type": "dryer"}, ...]
+# Without it the controller drives the single machine of wash.py on the legacy topics.
+MAX_SLAVE_ADDRESS = 247
+
+class MachineSlot:
+    """ One polled machine: its register-map driver, topics, change-only publisher and poll schedule """
+
+    def __init__(self, device, multi, client_id, scheduler):
+        self.device = device
+        self.slave = device.slave_address
+        self.multi = multi
+        self.device_type = device.model["device_type"]
+        if multi:
+            self.status_topic = device_topic(client_id, "status", self.slave)
+            self.response_topic = device_topic(client_id, "command_response", self.slave)
+            self.device_id = f"{client_id}/{self.slave}"
+            self.app = device.model["app"]
+            self.json_device_type = self.device_type
+        else:
+            self.status_topic = device_topic(client_id, "status")
+            self.response_topic = device_topic(client_id, "command_response")
+            self.device_id = client_id
+            # The legacy JSON status always said "wash", dryers included; backends still expect it
+            self.app = "wash"
+            self.json_device_type = "wash"
+        self.publisher = StatusDeltaPublisher()
+        self.scheduler = scheduler
+
+def validate_machine(entry, known=(), default_type="wash"):
+    """ One "machines" entry -> {"slave": int, "type": model name}. Raises ValueError when it is unusable """
+    from register_map import MODELS
+    if not isinstance(entry, dict):
+        raise ValueError(f"{entry} is not an object")
+    try:
+        slave = int(entry["slave"])
+    except (KeyError, ValueError, TypeError):
+        raise ValueError(f"{entry} has no valid slave")
+    if not 1 <= slave <= MAX_SLAVE_ADDRESS:
+        raise ValueError(f"slave {slave} is outside 1-{MAX_SLAVE_ADDRESS}")
+    if slave in known:
+        raise ValueError(f"slave {slave} is listed twice")
+    device_type = entry.get("type", default_type)
+    if device_type not in MODELS:
+        raise ValueError(f"slave {slave} has unknown type {device_type}, expected one of {list(MODELS)}")
+    return {"slave": slave, "type": device_type}
+
+def validate_machines(entries, default_type="wash"):
+    """ A whole "machines" list from the machines command. Unlike app.load_machines one bad entry rejects it all """
+    if not isinstance(entries, list):
+        raise ValueError(f"expected a list, got {entries}")
+    machines = []
+    for entry in entries:
+        machines.append(validate_machine(entry, [each["slave"] for each in machines], default_type))
+    return machines
+
+# --- Command routing ---
+def get_command_id(data_json):
+    cmd = data_json.get('command')
+    return cmd.get('id', data_json.get('id')) if isinstance(cmd, dict) else None
+
+def command_slave(data_json):
+    cmd = data_json.get('command')
+    slave = cmd.get('slave') if isinstance(cmd, dict) else None
+    if slave is None:
+        slave = data_json.get('slave')
+    return slave
+
+# --- Outbound buffer: command responses survive outages and are republished with QoS1 ---
+OUTBOX_SIZE = 32
+# Spill queued responses to flash so vend results also survive a reboot. Only written while offline.
+OUTBOX_FILE = 'outbox.dat'
+
+class Outbox:
+    """ Bounded FIFO of unsent [topic, payload, vend] entries, mirrored to OUTBOX_FILE when not empty """
+
+    def __init__(self, size=OUTBOX_SIZE, spill_file=OUTBOX_FILE):
+        self.size = size
+        self.spill_file = spill_file
+        self.entries = []
+        if spill_file:
+            try:
+                with open(spill_file) as f:
+                    for line in f:
+                        self.entries.append(json.loads(line))
+            except (OSError, ValueError):
+                pass
+
+    def _save(self):
+        if not self.spill_file:
+            return
+        try:
+            if self.entries:
+                with open(self.spill_file, 'w') as f:
+                    for entry in self.entries:
+                        f.write(json.dumps(entry))
+                        f.write('\n')
+            elif check_file_exists(self.spill_file):
+                os.remove(self.spill_file)
+        except OSError as e:
+            print(f"Outbox spill failed: {e}")
+
+    def add(self, topic, payload, vend=False):
+        if len(self.entries) >= self.size:
+            # Make room by dropping the oldest non-vend response first
+            drop = 0
+            for i in range(len(self.entries)):
+                if not self.entries[i][2]:
+                    drop = i
+                    break
+            self.entries.pop(drop)
+        self.entries.append([topic.decode() if isinstance(topic, bytes) else topic, payload, vend])
+        self._save()
+
+    def flush(self, client):
+        """ Republish everything queued with QoS1, oldest first. Raises OSError if the link drops midway """
+        if not self.entries:
+            return
+        try:
+            while self.entries:
+                topic, payload, _ = self.entries[0]
+                client.publish(topic.encode(), payload.encode(), qos=1)
+                self.entries.pop(0)
+        finally:
+            self._save()
+
+# --- Command queue: vend-critical commands go ahead of status and maintenance ---
+COMMAND_QUEUE_SIZE = 8
+PRIORITY_VEND = 0
+PRIORITY_NORMAL = 1
+VEND_COMMANDS = ('coins', 'start', 'stop', 'menu', 'transaction')
+# A newer copy of these replaces the queued one instead of queueing twice
+COLLAPSIBLE_COMMANDS = ('get_status', 'status_keyframe', 'status_format', 'poll_rates', 'modbus_stats', 'modbus_retry', 'machines')
+RECENT_COMMAND_IDS = 32
+# Commands addressed to one machine, routed by slave id
+MACHINE_COMMANDS = ('reset_error', 'get_status', 'menu', 'coins', 'start', 'stop', 'transaction', 'command')
+
+class CommandQueue:
+    """ Bounded two-level priority queue of MQTT commands with enqueue -> dequeue latency tracing """
+
+    def __init__(self, size=COMMAND_QUEUE_SIZE):
+        self.size = size
+        self.queues = ([], []) # one FIFO per priority, entries are [key, data_json, enqueued_at]
+        self.event = asyncio.Event()
+        self.dropped = 0
+        self.max_wait_ms = [0, 0]
+        # ids of recently accepted commands, so a redelivered QoS1 command never vends twice
+        self.recent_ids = []
+
+    def __len__(self):
+        return len(self.queues[0]) + len(self.queues[1])
+
+    def put(self, data_json):
+        """ Returns the key of the command dropped to make room (the new one or an evicted
+            low-priority one), or None when nothing was dropped """
+        cmd = data_json.get('command')
+        key = cmd.get('key') if isinstance(cmd, dict) else None
+        command_id = get_command_id(data_json)
+        if command_id is not None and command_id in self.recent_ids:
+            print(f"Duplicate command {key} id {command_id} ignored")
+            return None
+        priority = PRIORITY_VEND if key in VEND_COMMANDS else PRIORITY_NORMAL
+        queue = self.queues[priority]
+        if key in COLLAPSIBLE_COMMANDS:
+            slave = command_slave(data_json)
+            for entry in queue:
+                if entry[0] == key and command_slave(entry[1]) == slave:
+                    # The replaced copy never runs, so a resend of it must not count as a duplicate
+                    self._forget(entry[1])
+                    entry[1] = data_json
+                    self._remember(command_id)
+                    return None
+        if len(self) >= self.size:
+            # Backpressure: a vend command may evict the newest low-priority entry, anything else is refused
+            self.dropped += 1
+            if priority != PRIORITY_VEND or not self.queues[PRIORITY_NORMAL]:
+                return key
+            evicted = self.queues[PRIORITY_NORMAL].pop()
+            self._forget(evicted[1])
+            dropped = evicted[0]
+        else:
+            dropped = None
+        queue.append([key, data_json, time.ticks_ms()])
+        # Only commands that will actually run are remembered, a refused one may be sent again
+        self._remember(command_id)
+        self.event.set()
+        return dropped
+
+    def _remember(self, command_id):
+        if command_id is not None:
+            self.recent_ids.append(command_id)
+            if len(self.recent_ids) > RECENT_COMMAND_IDS:
+                self.recent_ids.pop(0)
+
+    def _forget(self, data_json):
+        command_id = get_command_id(data_json)
+        if command_id is not None and command_id in self.recent_ids:
+            self.recent_ids.remove(command_id)
+
+    def get(self):
+        """ Returns (data_json, waited_ms) of the most urgent command, or None when empty """
+        for priority in (PRIORITY_VEND, PRIORITY_NORMAL):
+            queue = self.queues[priority]
+            if queue:
+                key, data_json, enqueued_at = queue.pop(0)
+                waited_ms = time.ticks_diff(time.ticks_ms(), enqueued_at)
+                if waited_ms > self.max_wait_ms[priority]:
+                    self.max_wait_ms[priority] = waited_ms
+                print(f"Command {key} (priority {priority}) waited {waited_ms} ms")
+                return data_json, waited_ms
+        return None
+
+# --- MQTT link ---
+MQTT_SOCKET_TIMEOUT = 10 # วินาที, รอ PUBACK/SUBACK/PINGRESP นานสุดเท่านี้ก่อนถือว่าการเชื่อมต่อหลุด
+
+class MQTTSocket:
+    """ umqtt.simple puts its socket back into blocking mode (no timeout) after every read, so a PUBACK
+        lost on a half-open link would block the whole event loop forever. Keeps MQTT_SOCKET_TIMEOUT
+        in place instead, and a stalled read or write raises OSError like any other link failure. """
+
+    def __init__(self, sock, timeout=MQTT_SOCKET_TIMEOUT):
+        self.sock = sock
+        self.timeout = timeout
+        sock.settimeout(timeout)
+
+    def setblocking(self, flag):
+        if flag:
+            self.sock.settimeout(self.timeout)
+        else:
+            self.sock.setblocking(False)
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(self.timeout if timeout is None else timeout)
+
+    def read(self, n):
+        return self.sock.read(n)
+
+    def write(self, data, length=None):
+        if length is None:
+            return self.sock.write(data)
+        return self.sock.write(data, length)
+
+    def close(self):
+        self.sock.close()
+
+# --- Reconnect backoff ---
+RECONNECT_BASE_DELAY = 2 # วินาที
+RECONNECT_MAX_DELAY = 300 # วินาที
+RECONNECT_MAX_ATTEMPTS = 20
+RECONNECT_STABLE_S = 60 # วินาที, ออนไลน์ต่อเนื่องนานเท่านี้จึงนับ backoff ใหม่
+
+def backoff_delay(attempt):
+    """ Exponential backoff with jitter in [cap/2, cap) so a fleet reconnecting together spreads out """
+    cap = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * (1 << min(attempt, 16)))
+    return cap / 2 + cap * random.getrandbits(16) / 131072
@@ -0,0 +1,471 @@
+import array
+import machine
+import struct
+import time
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+RS485_TX_PIN = 17
+RS485_RX_PIN = 16
+
+# การตั้งค่า Modbus RTU (ตามเอกสาร)
+MODBUS_BAUDRATE = 9600
+MODBUS_DATA_BITS = 8
+MODBUS_STOP_BITS = 1
+MODBUS_PARITY = None # None Parity check
+MODBUS_SLAVE_ADDRESS = 1 # Station number: 1-247, สมมติเป็น 1
+
+# How long to wait for the first byte of a response (per attempt)
+RESPONSE_TIMEOUT_MS = 500
+# Retry policy: attempts per request, pause before the first retry (doubles on each further retry)
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF_MS = 20
+# Exception codes that mean the slave did not act on the request and it is safe to resend:
+# 5 acknowledge (still processing), 6 slave device busy
+RETRYABLE_EXCEPTIONS = (5, 6)
+# The UART driver hands received bytes over in bursts, so allow this much on top of t3.5 before
+# treating line silence as end of frame
+RX_FIFO_SLACK_US = 2000
+
+
+def frame_timing(baudrate=MODBUS_BAUDRATE, data_bits=MODBUS_DATA_BITS, stop_bits=MODBUS_STOP_BITS, parity=MODBUS_PARITY):
+    """ Returns (char_us, t15_us, t35_us) for the serial line, per the Modbus RTU spec:
+        fixed 750us / 1750us above 19200 baud """
+    bits = 1 + data_bits + stop_bits + (0 if parity is None else 1)
+    char_us = (bits * 1000000 + baudrate - 1) // baudrate
+    if baudrate > 19200:
+        return char_us, 750, 1750
+    return char_us, (char_us * 3 + 1) // 2, (char_us * 7 + 1) // 2
+
+# Modbus RTU CRC16 (poly 0xA001 reflected, init 0xFFFF), table driven.
+CRC_INIT = 0xFFFF
+
+
+def _build_crc_table():
+    table = array.array('H', range(256))
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table[i] = crc
+    return table
+
+# 256 x uint16 = 512 bytes, built once at import
+_CRC_TABLE = _build_crc_table()
+
+
+def update(crc, chunk):
+    """ Feed a chunk (bytes/bytearray/memoryview) into a running CRC and return the new CRC """
+    table = _CRC_TABLE
+    for byte in chunk:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def crc16(data):
+    """ CRC16 of a whole frame as an int """
+    return update(CRC_INIT, data)
+
+
+def calculate_crc16(data):
+    """ CRC16 of a whole frame as 2 bytes, little endian (wire order) """
+    return update(CRC_INIT, data).to_bytes(2, 'little')
+
+
+# --- Streaming RTU frame decoder ---
+
+# Largest RTU ADU: slave(1) + PDU(253) + CRC(2)
+MAX_ADU_SIZE = 256
+MAX_READ_REGISTERS = 125
+MAX_WRITE_REGISTERS = 123
+# Bytes pulled from the UART per readinto()
+RX_CHUNK_SIZE = 64
+
+# Decoder states
+STATE_ADDR = 0
+STATE_FUNC = 1
+STATE_LEN = 2
+STATE_PAYLOAD = 3
+STATE_CRC = 4
+STATE_DONE = 5
+
+# Reasons the decoder stopped
+FRAME_OK = 'ok'
+FRAME_EXCEPTION = 'exception'
+FRAME_TIMEOUT = 'timeout'
+FRAME_TRUNCATED = 'truncated'
+FRAME_CRC_MISMATCH = 'crc_mismatch'
+FRAME_UNEXPECTED = 'unexpected'
+FRAME_OVERRUN = 'overrun'
+
+
+class FrameDecoder:
+    """ Decodes one Modbus RTU response (FC03, FC10 or exception) byte by byte into a preallocated buffer.
+        feed() returns None while the frame is incomplete and one of the FRAME_* reasons once it stops. """
+
+    def __init__(self, size=MAX_ADU_SIZE):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.reset(0, 0)
+
+    def reset(self, slave_address, function_code):
+        self.slave_address = slave_address
+        self.function_code = function_code
+        self.state = STATE_ADDR
+        self.length = 0 # bytes stored in buf
+        self.expected = 0 # full frame length incl. CRC, once known
+        self.crc = CRC_INIT
+        self.exception_code = 0
+        self.reason = None
+
+    def feed(self, chunk):
+        if self.state == STATE_DONE:
+            return self.reason
+        buf = self.buf
+        size = len(buf)
+        table = _CRC_TABLE
+        state = self.state
+        n = self.length
+        expected = self.expected
+        crc = self.crc
+        reason = None
+        for byte in chunk:
+            if n >= size:
+                reason = FRAME_OVERRUN
+                break
+            buf[n] = byte
+            n += 1
+            if state == STATE_CRC:
+                if n == expected:
+                    if crc != buf[n - 2] | (buf[n - 1] << 8):
+                        reason = FRAME_CRC_MISMATCH
+                    elif buf[1] & 0x80:
+                        self.exception_code = buf[2]
+                        reason = FRAME_EXCEPTION
+                    else:
+                        reason = FRAME_OK
+                    break
+                continue
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+            if state == STATE_ADDR:
+                if byte != self.slave_address:
+                    reason = FRAME_UNEXPECTED
+                    break
+                state = STATE_FUNC
+            elif state == STATE_FUNC:
+                if byte == self.function_code | 0x80:
+                    # Exception: slave + func + exception code + CRC
+                    expected = 5
+                    state = STATE_PAYLOAD
+                elif byte != self.function_code:
+                    reason = FRAME_UNEXPECTED
+                    break
+                elif byte == 0x03:
+                    state = STATE_LEN
+                elif byte == 0x10:
+                    # Echo of start address + quantity
+                    expected = 8
+                    state = STATE_PAYLOAD
+                else:
+                    reason = FRAME_UNEXPECTED
+                    break
+            elif state == STATE_LEN:
+                expected = n + byte + 2
+                if expected > size:
+                    reason = FRAME_OVERRUN
+                    break
+                state = STATE_PAYLOAD if byte else STATE_CRC
+            elif n == expected - 2: # STATE_PAYLOAD
+                state = STATE_CRC
+        self.length = n
+        self.expected = expected
+        self.crc = crc
+        if reason is None:
+            self.state = state
+        else:
+            self.state = STATE_DONE
+            self.reason = reason
+        return reason
+
+    def stop(self):
+        """ Called when the line went quiet before the frame completed """
+        if self.state != STATE_DONE:
+            self.state = STATE_DONE
+            self.reason = FRAME_TRUNCATED if self.length else FRAME_TIMEOUT
+        return self.reason
+
+    def frame(self):
+        return self.mv[:self.length]
+
+    def payload(self):
+        """ FC03: register data, FC10: start address + quantity, exception: exception code """
+        if self.buf[1] == 0x03:
+            return self.mv[3:self.length - 2]
+        return self.mv[2:self.length - 2]
+
+
+class ModbusRTUClient:
+    def __init__(self, uart_id=MODBUS_SLAVE_ADDRESS, tx_pin=RS485_TX_PIN, rx_pin=RS485_RX_PIN):
+        self.uart = machine.UART(uart_id,baudrate=MODBUS_BAUDRATE, tx=tx_pin, rx=rx_pin,bits=MODBUS_DATA_BITS, stop=MODBUS_STOP_BITS,parity=MODBUS_PARITY)
+        self.slave_address = MODBUS_SLAVE_ADDRESS
+        self.decoder = FrameDecoder()
+        # Preallocated request and receive buffers, reused for every transaction
+        self._tx = bytearray(MAX_ADU_SIZE)
+        self._tx_mv = memoryview(self._tx)
+        self._rx = bytearray(RX_CHUNK_SIZE)
+        self._rx_mv = memoryview(self._rx)
+        self._register_arrays = {}
+        self.last_reason = None
+        self.attempts = RETRY_ATTEMPTS
+        self.response_timeout_ms = RESPONSE_TIMEOUT_MS
+        self.backoff_ms = RETRY_BACKOFF_MS
+        self.reset_stats()
+        self.char_us, self.t15_us, self.t35_us = frame_timing()
+        self.eof_silence_us = self.t35_us + RX_FIFO_SLACK_US
+        # Older ports have no UART.flush(), fall back to sleeping for the frame's airtime
+        self._can_flush = hasattr(self.uart, 'flush')
+        self._bus_idle_at = time.ticks_us()
+        # When the response being read was armed and when its last byte came in (_expect_response)
+        self._rx_started = self._last_rx = self._bus_idle_at
+        time.sleep_ms(100) # รอให้ UART พร้อม
+
+    def set_retry_policy(self, attempts=None, timeout_ms=None, backoff_ms=None):
+        """ Change any of the retry settings. Raises ValueError on out-of-range values """
+        if attempts is not None and not 1 <= int(attempts) <= 10:
+            raise ValueError("attempts must be 1-10")
+        if timeout_ms is not None and not 20 <= int(timeout_ms) <= 5000:
+            raise ValueError("timeout_ms must be 20-5000")
+        if backoff_ms is not None and not 0 <= int(backoff_ms) <= 2000:
+            raise ValueError("backoff_ms must be 0-2000")
+        if attempts is not None:
+            self.attempts = int(attempts)
+        if timeout_ms is not None:
+            self.response_timeout_ms = int(timeout_ms)
+        if backoff_ms is not None:
+            self.backoff_ms = int(backoff_ms)
+
+    def retry_policy(self):
+        return {"attempts": self.attempts, "timeout_ms": self.response_timeout_ms, "backoff_ms": self.backoff_ms}
+
+    def reset_stats(self):
+        """ Counters per request (requests, retries, failures) and per attempt (one per FRAME_* reason) """
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, FRAME_OK: 0, FRAME_EXCEPTION: 0, FRAME_TIMEOUT: 0,
+                      FRAME_TRUNCATED: 0, FRAME_CRC_MISMATCH: 0, FRAME_UNEXPECTED: 0, FRAME_OVERRUN: 0}
+        self.exception_codes = {}
+
+    def _transmit(self, adu):
+        """ Write a request once the bus has been silent for t3.5 and return when it has left the wire """
+        wait_us = self.t35_us - time.ticks_diff(time.ticks_us(), self._bus_idle_at)
+        if wait_us > 0:
+            time.sleep_us(wait_us)
+        self.uart.write(adu)
+        if self._can_flush:
+            self.uart.flush()
+        else:
+            time.sleep_us(len(adu) * self.char_us)
+        self._bus_idle_at = time.ticks_us()
+
+    def _send_modbus_request(self, slave_address, function_code, start_address, quantity_or_value, values=None):
+        """ Build the ADU in the preallocated TX buffer and send it """
+        tx = self._tx
+        if function_code == 0x03: # Read Holding Registers
+            if not 1 <= quantity_or_value <= MAX_READ_REGISTERS:
+                raise ValueError("Register count out of range for FC03")
+            struct.pack_into('>BBHH', tx, 0, slave_address, 0x03, start_address, quantity_or_value)
+            n = 6
+        elif function_code == 0x10: # Write Multiple Registers (quantity_or_value คือจำนวน registers)
+            if not 1 <= quantity_or_value <= MAX_WRITE_REGISTERS:
+                raise ValueError("Register count out of range for FC10")
+            struct.pack_into('>BBHHB', tx, 0, slave_address, 0x10, start_address, quantity_or_value, quantity_or_value * 2)
+            n = 7
+            for value in values:
+                struct.pack_into('>H', tx, n, value & 0xFFFF)
+                n += 2
+        else:
+            raise ValueError("Unsupported function code for _send_modbus_request")
+
+        crc = update(CRC_INIT, self._tx_mv[:n])
+        tx[n] = crc & 0xFF
+        tx[n + 1] = crc >> 8
+        self._transmit(self._tx_mv[:n + 2])
+
+    def _expect_response(self, function_code, slave_address=None):
+        """ Arm the decoder and the timers for the response to the request just sent """
+        self.decoder.reset(self.slave_address if slave_address is None else slave_address, function_code)
+        self._rx_started = self._last_rx = time.ticks_us()
+
+    def _read_modbus_response(self):
+        """ Feed whatever the UART holds to the decoder, without waiting. Returns the FRAME_* reason once it
+            completes a frame, the line goes silent for t3.5 mid-frame or no response starts within
+            RESPONSE_TIMEOUT_MS, None while the response is still due. The frame itself is left in self.decoder. """
+        decoder = self.decoder
+        uart = self.uart
+        reason = None
+        while True:
+            n = uart.any()
+            if not n:
+                break
+            n = uart.readinto(self._rx, n if n < RX_CHUNK_SIZE else RX_CHUNK_SIZE)
+            reason = decoder.feed(self._rx_mv[:n])
+            self._last_rx = time.ticks_us()
+            if reason is not None:
+                break
+        if reason is None:
+            # Silence is only measured once the UART's RX buffer is empty, so time spent in other
+            # asyncio tasks between two calls cannot cut a frame short
+            if decoder.length:
+                if time.ticks_diff(time.ticks_us(), self._last_rx) <= self.eof_silence_us:
+                    return None
+            elif time.ticks_diff(time.ticks_us(), self._rx_started) <= self.response_timeout_ms * 1000:
+                return None
+            reason = decoder.stop()
+        self._bus_idle_at = self._last_rx
+        self.last_reason = reason
+        return reason
+
+    def _drain(self):
+        """ Discard the rest of a bad frame so a retry starts on an idle line """
+        uart = self.uart
+        start_time = last_rx = time.ticks_us()
+        limit_us = MAX_ADU_SIZE * self.char_us * 2
+        while time.ticks_diff(time.ticks_us(), last_rx) <= self.eof_silence_us:
+            if uart.any():
+                uart.readinto(self._rx)
+                last_rx = time.ticks_us()
+            elif time.ticks_diff(last_rx, start_time) > limit_us:
+                break
+            else:
+                yield self.t15_us
+        self._bus_idle_at = last_rx
+
+    def _transaction(self, slave_address, function_code, start_address, quantity_or_value, values=None, idempotent=True, attempts=None):
+        """ Send a request and read its response, retrying per the retry policy (attempts overrides its count).
+            Non-idempotent requests are only resent after an exception that says the slave did not act,
+            never after a lost or corrupted response. A generator that yields the microseconds to wait
+            whenever the bus is quiet (run it with _run or _run_async), returns the FRAME_* reason of the last attempt. """
+        stats = self.stats
+        stats["requests"] += 1
+        for attempt in range(attempts or self.attempts):
+            if attempt:
+                stats["retries"] += 1
+                yield (self.backoff_ms << (attempt - 1)) * 1000
+            self._send_modbus_request(slave_address, function_code, start_address, quantity_or_value, values)
+            self._expect_response(function_code, slave_address)
+            reason = self._read_modbus_response()
+            while reason is None:
+                yield self.t15_us
+                reason = self._read_modbus_response()
+            stats[reason] += 1
+            if reason == FRAME_OK:
+                return reason
+            if reason == FRAME_EXCEPTION:
+                code = self.decoder.exception_code
+                self.exception_codes[code] = self.exception_codes.get(code, 0) + 1
+                if code not in RETRYABLE_EXCEPTIONS:
+                    break
+            else:
+                if reason != FRAME_TIMEOUT:
+                    yield from self._drain()
+                if not idempotent:
+                    break
+        stats["failures"] += 1
+        return reason
+
+    def _registers(self, quantity):
+        """ Reused array('H') of exactly `quantity` registers """
+        registers = self._register_arrays.get(quantity)
+        if registers is None:
+            registers = array.array('H', bytes(quantity * 2))
+            self._register_arrays[quantity] = registers
+        return registers
+
+    def read_holding_registers(self, start_address, quantity, slave_address=None, attempts=None):
+        """ อ่าน Holding Registers (Function Code: 0x03)
+            slave_address defaults to self.slave_address, so one client can drive every slave on the bus.
+            attempts overrides the retry policy for this read.
+            Returns a reused array('H'), valid until the next read of the same size """
+        if slave_address is None:
+            slave_address = self.slave_address
+        return self._read_registers(_run(self._transaction(slave_address, 0x03, start_address, quantity, attempts=attempts)), quantity)
+
+    async def read_holding_registers_async(self, start_address, quantity, slave_address=None, attempts=None):
+        """ read_holding_registers() for asyncio tasks: the other tasks run while it waits for the slave.
+            The caller must keep every other request off the bus until it returns """
+        if slave_address is None:
+            slave_address = self.slave_address
+        return self._read_registers(await _run_async(self._transaction(slave_address, 0x03, start_address, quantity, attempts=attempts)), quantity)
+
+    def _read_registers(self, reason, quantity):
+        if reason == FRAME_OK:
+            # response format: slave_id (1 byte) + func_code (1 byte) + byte_count (1 byte) + data (N bytes) + CRC (2 bytes)
+            buf = self.decoder.buf
+            if buf[2] != quantity * 2:
+                self.last_reason = FRAME_UNEXPECTED
+                self.stats[FRAME_UNEXPECTED] += 1
+                return None
+            # แปลง data เป็น word (big endian) ลงใน array เดิม
+            registers = self._registers(quantity)
+            for i in range(quantity):
+                registers[i] = (buf[3 + 2 * i] << 8) | buf[4 + 2 * i]
+            return registers
+        return None
+
+    def write_multiple_registers(self, start_address, values, slave_address=None):
+        """ เขียน Multiple Registers (Function Code: 0x10)
+            Not resent after a lost response: the slave may already have applied it (coins!) """
+        if slave_address is None:
+            slave_address = self.slave_address
+        if _run(self._transaction(slave_address, 0x10, start_address, len(values), values, idempotent=False)) == FRAME_OK:
+            # สำหรับ Function Code 0x10, response จะเป็น slave_id + func_code + start_addr + num_regs + CRC
+            # ตรวจสอบว่า start_address และ num_regs ใน response ตรงกับที่ส่งไป
+            buf = self.decoder.buf
+            response_start_addr = (buf[2] << 8) | buf[3]
+            response_num_regs = (buf[4] << 8) | buf[5]
+            if response_start_addr == start_address and response_num_regs == len(values):
+                return True
+        return False
+
+
+def _run(steps):
+    """ Drive a bus generator (ModbusRTUClient._transaction and the like) to the end, sleeping for each
+        wait it yields. Returns the generator's return value """
+    try:
+        while True:
+            time.sleep_us(next(steps))
+    except StopIteration as e:
+        return e.value
+
+
+async def _run_async(steps):
+    """ _run() for asyncio tasks: every wait yields to the event loop instead of blocking it """
+    try:
+        while True:
+            await asyncio.sleep(next(steps) / 1000000)
+    except StopIteration as e:
+        return e.value
+
+
+def coalesce_writes(writes):
+    """ Merge consecutive (address, value, mergeable) writes that together cover a contiguous register
+        block into one FC10 write. Returns [start_address, values, mergeable, step_count] blocks in order. """
+    blocks = []
+    low = high = -1
+    for address, value, mergeable in writes:
+        if mergeable and blocks and blocks[-1][2] and (address == low - 1 or address == high + 1):
+            block = blocks[-1]
+            if address < low:
+                block[0] = low = address
+                block[1].insert(0, value)
+            else:
+                high = address
+                block[1].append(value)
+            block[3] += 1
+        else:
+            blocks.append([address, [value], mergeable, 1])
+            low = high = address
+    return blocks
@@ -0,0 +1,170 @@
+import io
+import os
+try:
+    import hashlib
+except ImportError:
+    import uhashlib as hashlib
+try:
+    import binascii
+except ImportError:
+    import ubinascii as binascii
+
+# Bytes read from the socket per step; the only buffer the download needs
+OTA_CHUNK_SIZE = 1024
+
+
+def _content_length(response):
+    headers = getattr(response, 'headers', None) or {}
+    for key in headers:
+        if key.lower() == 'content-length':
+            return int(headers[key])
+    return None
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class _CountingReader(io.IOBase):
+    """ Counts bytes pulled off the socket, before any decompression """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def readinto(self, buf):
+        n = self.raw.readinto(buf)
+        if n:
+            self.count += n
+        return n
+
+
+def _inflate(stream):
+    """ zlib-wrapped deflate stream -> decompressed stream """
+    try:
+        import deflate
+        return deflate.DeflateIO(stream, deflate.ZLIB)
+    except ImportError:
+        # MicroPython before 1.21
+        import zlib
+        return zlib.DecompIO(stream, 15)
+
+
+def file_sha256(filename, chunk_size=OTA_CHUNK_SIZE):
+    """ sha256 hex of a local file, or None if it does not exist """
+    buf = bytearray(chunk_size)
+    mv = memoryview(buf)
+    digest = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                digest.update(mv[:n])
+    except OSError:
+        return None
+    return binascii.hexlify(digest.digest()).decode()
+
+
+def stream_to_file(raw, filename, chunk_size=OTA_CHUNK_SIZE):
+    """ Copy a readable stream into filename through one reused buffer. Returns (size, sha256 hex) """
+    buf = bytearray(chunk_size)
+    mv = memoryview(buf)
+    digest = hashlib.sha256()
+    size = 0
+    with open(filename, 'wb') as f:
+        while True:
+            n = raw.readinto(buf)
+            if not n:
+                break
+            chunk = mv[:n]
+            digest.update(chunk)
+            f.write(chunk)
+            size += n
+    return size, binascii.hexlify(digest.digest()).decode()
+
+
+def download_to_file(url, filename, sha256=None, chunk_size=OTA_CHUNK_SIZE, compressed=False, stats=None):
+    """ Stream url into filename + '.tmp', hashing as it goes, and rename it over filename only when
+        the body is complete (Content-Length) and, if given, its sha256 matches.
+        compressed: the body is zlib/deflate and is inflated on the way to flash; sha256 is of the inflated file.
+        stats: optional dict, "bytes_received"/"bytes_written" are added to it.
+        Returns (ok, message); filename is untouched on failure. """
+    import requests
+    tmp = filename + '.tmp'
+    response = requests.get(url, stream=True)
+    try:
+        if response.status_code != 200:
+            return False, f"Failed to download {filename}. Status code: {response.status_code}"
+        expected_size = _content_length(response)
+        reader = _CountingReader(response.raw)
+        size, digest = stream_to_file(_inflate(reader) if compressed else reader, tmp, chunk_size)
+    except Exception as e:
+        _remove(tmp)
+        return False, f"Failed to download {filename}: {e}"
+    finally:
+        response.close()
+
+    if stats is not None:
+        stats["bytes_received"] = stats.get("bytes_received", 0) + reader.count
+        stats["bytes_written"] = stats.get("bytes_written", 0) + size
+    if expected_size is not None and reader.count != expected_size:
+        _remove(tmp)
+        return False, f"Incomplete download of {filename}: {reader.count}/{expected_size} bytes"
+    if sha256 and digest != sha256.lower():
+        _remove(tmp)
+        return False, f"Hash mismatch for {filename}"
+    os.rename(tmp, filename)
+    return True, f"Updated {filename} ({reader.count} bytes received, {size} written, sha256 {digest})"
+
+
+def update_from_manifest(manifest_url, device_type=None, chunk_size=OTA_CHUNK_SIZE):
+    """ Fetch a manifest (see tools/make_manifest.py) and download only the files whose local sha256 differs.
+        Entries with a "device_type" are only applied on that device type, and an entry's "replaces"
+        file (the .py of an .mpy module) is removed once the entry is installed.
+        Stops at the first failed file: the manifest lists libraries first and boot.py/main.py last, so
+        they are never installed on top of a half-updated set of modules.
+        Returns a summary dict: version, updated, skipped, failed, pending (not attempted), bytes_received, bytes_written. """
+    import requests
+    summary = {"version": None, "updated": [], "skipped": [], "failed": [], "pending": [], "bytes_received": 0, "bytes_written": 0}
+    response = requests.get(manifest_url)
+    try:
+        if response.status_code != 200:
+            summary["failed"].append(manifest_url)
+            return summary
+        manifest = response.json()
+    finally:
+        response.close()
+
+    summary["version"] = manifest.get("version")
+    base_url = manifest.get("base_url") or manifest_url[:manifest_url.rfind('/') + 1]
+    for entry in manifest["files"]:
+        if entry.get("device_type") not in (None, device_type):
+            continue
+        name = entry["name"]
+        if summary["failed"]:
+            summary["pending"].append(name)
+            continue
+        if file_sha256(name, chunk_size) == entry["sha256"].lower():
+            summary["skipped"].append(name)
+            if "replaces" in entry:
+                _remove(entry["replaces"])
+            continue
+        url = entry.get("url", name)
+        if '://' not in url:
+            url = base_url + url
+        print(f"Downloading {name} from {url}")
+        try:
+            ok, message = download_to_file(url, name, entry["sha256"], chunk_size, entry.get("deflate", False), summary)
+        except Exception as e:
+            ok, message = False, f"Error updating {name}: {e}"
+        print(message)
+        summary["updated" if ok else "failed"].append(name)
+        if ok and "replaces" in entry:
+            # foo.py would shadow a freshly installed foo.mpy
+            _remove(entry["replaces"])
+    return summary
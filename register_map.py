@@ -0,0 +1,273 @@
+from modbus import coalesce_writes, FRAME_TIMEOUT
+
+# Declarative register maps for every supported machine model.
+# A new model is a new dict below (plus an entry in MODELS); wash.py / dryer.py only pick one.
+#
+#   fields:   (status key, offset in the status block, enum names or None, scale or None)
+#             enum names are indexed by the raw value; scale multiplies the raw value
+#   commands: holding register written by each command helper (value 1 = trigger)
+
+RUN_STATUS = ("Power on", "Standby", "N/A", "Autorun", "Manual", "Idle") # N/A ตามเอกสาร
+ERROR_STATUS = ("normal", "error")
+WASH_DOOR_STATUS = ("normal", "opened", "closed", "locked", "error", "locking")
+DRYER_DOOR_STATUS = ("opened", "closed", "normal", "locked", "error", "locking")
+
+WASH = {
+    "device_type": "wash",
+    "app": "wash",
+    "version": "WASH_MQTT_1",
+    "status_start": 20,
+    "status_count": 40,
+    # อ่านเมื่ออ่านสถานะไม่สำเร็จ
+    "error_start": 60,
+    "error_count": 9,
+    "error_name": "Wash Error",
+    "fault_door_status": 4,
+    "offline_door_status": 4,
+    "max_program": 30,
+    "fields": (
+        ("run_status", 0, RUN_STATUS, None),
+        ("door_status", 1, WASH_DOOR_STATUS, None),
+        ("error_status", 2, ERROR_STATUS, None),
+        ("auto_time_hour", 3, None, None),
+        ("auto_time_min", 4, None, None),
+        ("auto_time_sec", 5, None, None),
+        ("current_inlet_temperature", 6, None, None),
+        ("current_outlet_temperature", 7, None, None),
+        ("currently_running_program_number", 8, None, None),
+        ("currently_running_step_number", 9, None, None),
+        ("coins_required_of_currently_selecting_program", 10, None, None),
+        ("current_coins", 11, None, None),
+        ("total_coins_recorded", 12, None, None),
+        ("coins_recorded_in_cash_box", 13, None, None),
+        ("matchine_menu", 14, None, None),
+        ("coin_inserted", 15, None, None),
+        ("must_insert_coin", 16, None, None),
+        ("coin_insert", 17, None, None),
+    ),
+    "commands": {
+        "reset_error": 0,
+        "start": 1,
+        "stop": 3,
+        "coins": 4,
+        "menu": 5,
+    },
+}
+
+DRYER = {
+    "device_type": "dryer",
+    "app": "dryer",
+    "version": "DRYER_MQTT_1",
+    "status_start": 20,
+    "status_count": 20,
+    "error_start": 60,
+    "error_count": 12,
+    "error_name": "Dryer Error",
+    "fault_door_status": 4,
+    "offline_door_status": 0,
+    "max_program": 19,
+    "fields": (
+        ("run_status", 0, RUN_STATUS, None),
+        ("door_status", 1, DRYER_DOOR_STATUS, None),
+        ("error_status", 2, ERROR_STATUS, None),
+        ("auto_time_hour", 3, None, None),
+        ("auto_time_min", 4, None, None),
+        ("auto_time_sec", 5, None, None),
+        ("current_inlet_temperature", 6, None, None),
+        ("current_outlet_temperature", 7, None, None),
+        ("currently_running_program_number", 8, None, None),
+        ("currently_running_step_number", 9, None, None),
+        ("coins_required_of_currently_selecting_program", 10, None, None),
+        ("current_coins", 11, None, None),
+        ("total_coins_recorded", 12, None, None),
+        ("coins_recorded_in_cash_box", 13, None, None),
+        ("matchine_menu", 14, None, None),
+        ("coin_inserted", 15, None, None),
+        ("must_insert_coin", 10, None, None),
+        ("coin_insert", 11, None, None),
+    ),
+    "commands": {
+        "reset_error": 0,
+        "start": 1,
+        "stop": 2,
+        "coins": 3,
+        "menu": 4,
+    },
+}
+
+MODELS = {
+    "wash": WASH,
+    "dryer": DRYER,
+}
+
+
+class StatusDecoder:
+    """ Decodes a status register block into one status dict that is reused on every poll.
+        Callers that keep a status across polls must copy it. """
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = tuple(model["fields"])
+        self.raw = [0] * model["status_count"]
+        header = {"app": model["app"], "version": model["version"], "device_type": model["device_type"]}
+
+        self.status = dict(header)
+        for key, _, _, _ in self.fields:
+            self.status[key] = 0
+        self.status.update({"raw_data": self.raw, "raw_erro": False, "message": "success", "error": False})
+
+        # Both failure shapes are fixed apart from the error registers
+        zeros = {key: 0 for key, _, _, _ in self.fields}
+        self.fault = dict(header)
+        self.fault.update(zeros)
+        self.fault.update({"run_status": "N/A", "door_status": model["fault_door_status"], "error_status": 1,
+                           "raw_data": None, "raw_erro": None, "message": "error", "error": model["error_name"]})
+        self.offline = dict(header)
+        self.offline.update(zeros)
+        self.offline.update({"run_status": "error", "door_status": model["offline_door_status"], "error_status": 1,
+                             "raw_data": None, "raw_erro": None, "message": "เชื่อมต่อเครื่องซักไม่สำเร็จ",
+                             "error": "Modbus Connect Error"})
+
+    def decode(self, registers):
+        status = self.status
+        raw = self.raw
+        for i in range(len(raw)):
+            raw[i] = registers[i]
+        for key, offset, names, scale in self.fields:
+            value = raw[offset]
+            if names is not None:
+                value = names[value] if value < len(names) else f"Unknown ({value})"
+            elif scale is not None:
+                value = value * scale
+            status[key] = value
+        return status
+
+    def decode_fault(self, error_registers):
+        if error_registers:
+            self.fault["raw_erro"] = list(error_registers)
+            return self.fault
+        return self.offline
+
+
+class Machine:
+    """ One machine on the bus: status decoding and command helpers driven by its register map.
+        Several Machines can share one ModbusRTUClient, each with its own slave address. """
+
+    def __init__(self, model, modbus_client, slave_address=None):
+        self.model = model
+        self.modbus_client = modbus_client
+        self.slave_address = slave_address if slave_address is not None else modbus_client.slave_address
+        self.decoder = StatusDecoder(model)
+        self.commands = model["commands"]
+        self.max_program = model["max_program"]
+        # Status polls in a row that got no response at all
+        self.silent_polls = 0
+
+    def _write(self, start_address, values):
+        return self.modbus_client.write_multiple_registers(start_address, values, self.slave_address)
+
+    def read_status_registers(self):
+        """ Raw status register block (reused array) or None, for the binary status format.
+            A slave that gave no answer at all last time (unpowered, unplugged) gets one attempt, not the full retry policy """
+        model = self.model
+        return self._count_silence(self.modbus_client.read_holding_registers(model["status_start"], model["status_count"], self.slave_address, 1 if self.silent_polls else None))
+
+    async def read_status_registers_async(self):
+        """ read_status_registers() that lets the other asyncio tasks run while it waits for the slave """
+        model = self.model
+        return self._count_silence(await self.modbus_client.read_holding_registers_async(model["status_start"], model["status_count"], self.slave_address, 1 if self.silent_polls else None))
+
+    def _count_silence(self, registers):
+        if registers is None and self.modbus_client.last_reason == FRAME_TIMEOUT:
+            self.silent_polls += 1
+        else:
+            self.silent_polls = 0
+        return registers
+
+    def get_machine_status(self):
+        status_data = self.read_status_registers()
+        if status_data:
+            return self.decoder.decode(status_data)
+        if self.silent_polls:
+            # Nothing answered, the error block read would only time out as well
+            return self.decoder.decode_fault(None)
+        return self.decoder.decode_fault(self.modbus_client.read_holding_registers(self.model["error_start"], self.model["error_count"], self.slave_address))
+
+    async def get_machine_status_async(self):
+        """ get_machine_status() for the status task; same reused dicts """
+        status_data = await self.read_status_registers_async()
+        if status_data:
+            return self.decoder.decode(status_data)
+        if self.silent_polls:
+            return self.decoder.decode_fault(None)
+        return self.decoder.decode_fault(await self.modbus_client.read_holding_registers_async(self.model["error_start"], self.model["error_count"], self.slave_address))
+
+    def _program_error(self):
+        return {"status": "error", "message": f"Invalid program number. Must be between 0 and {self.max_program}."}
+
+    def select_program(self, program_number):
+        if not 0 <= program_number <= self.max_program:
+            return self._program_error()
+        if self._write(self.commands["menu"], [program_number]):
+            return {"status": "success", "message": f"Selected program {program_number}."}
+        return {"status": "error", "message": "Failed to select program."}
+
+    def start_operation(self):
+        if self._write(self.commands["start"], [1]):
+            return {"status": "success", "message": "Start command sent."}
+        return {"status": "error", "message": "Failed to send start command."}
+
+    def stop_operation(self):
+        if self._write(self.commands["stop"], [1]):
+            return {"status": "success", "message": "Stop command sent."}
+        return {"status": "error", "message": "Failed to send stop command."}
+
+    def add_coins(self, amount):
+        if not -10 <= amount <= 65535: # Value runge: 0-65535
+            return {"status": "error", "message": "Invalid coin amount. Must be between 0 and 65535."}
+        if self._write(self.commands["coins"], [amount]):
+            return {"status": "success", "message": f"Added {amount} coins."}
+        return {"status": "error", "message": "Failed to add coins."}
+
+    def reset_error(self):
+        if self._write(self.commands["reset_error"], [1]):
+            return {"status": "success", "message": "Error reset command sent."}
+        return {"status": "error", "message": "Failed to send error reset command."}
+
+    def send_command(self, address, value):
+        if self._write(address, [value]):
+            return {"status": "success", "message": f"Wrote {value} to register {address}."}
+        return {"status": "error", "message": f"Failed to write register {address}."}
+
+    def run_transaction(self, steps):
+        """ Run several commands as one vend, e.g. [{"key": "menu", "value": 3}, {"key": "coins", "value": 4}, {"key": "start"}].
+            menu/coins writes to adjacent registers go out as a single FC10 frame, the rest follow back-to-back.
+            Stops at the first failed write so a vend never starts on a half-applied setup. """
+        writes = []
+        for step in steps:
+            key = step.get('key')
+            if key == 'menu':
+                value = int(step['value'])
+                if not 0 <= value <= self.max_program:
+                    return self._program_error()
+                writes.append((self.commands['menu'], value, True))
+            elif key == 'coins':
+                value = int(step['value'])
+                if not -10 <= value <= 65535:
+                    return {"status": "error", "message": "Invalid coin amount. Must be between 0 and 65535."}
+                writes.append((self.commands['coins'], value, True))
+            elif key in ('start', 'stop', 'reset_error'):
+                writes.append((self.commands[key], 1, False))
+            elif key == 'command' and 'address' in step and 'value' in step:
+                writes.append((int(step['address']), int(step['value']), False))
+            else:
+                return {"status": "error", "message": f"Unknown or incomplete transaction step: {key}"}
+
+        completed = 0
+        frames = 0
+        for start_address, values, _, step_count in coalesce_writes(writes):
+            frames += 1
+            if not self._write(start_address, values):
+                return {"status": "error", "message": f"Transaction failed at step {completed + 1}.", "completed": completed, "frames": frames}
+            completed += step_count
+        return {"status": "success", "message": f"Transaction of {completed} steps sent.", "completed": completed, "frames": frames}
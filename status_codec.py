@@ -0,0 +1,75 @@
+import struct
+
+# Compact binary status payload for STATUS_TOPIC.
+# Runs on the device (MicroPython) and on the backend (CPython) as the reference decoder.
+#
+#   B  magic 0xA5 (a JSON payload always starts with '{')
+#   B  format version
+#   B  device type (see DEVICE_TYPES)
+#   B  flags (FLAG_MODBUS_ERROR)
+#   I  timestamp, device seconds
+#   B  device id length, then the id bytes
+#   H  start address of the register block
+#   B  register count, then count x H registers
+# All fields big endian.
+
+STATUS_MAGIC = 0xA5
+STATUS_FORMAT_VERSION = 1
+
+FLAG_MODBUS_ERROR = 0x01
+
+DEVICE_TYPES = {
+    "unknown": 0,
+    "wash": 1,
+    "dryer": 2,
+}
+DEVICE_TYPE_NAMES = {code: name for name, code in DEVICE_TYPES.items()}
+
+
+def is_binary_status(payload):
+    return len(payload) > 0 and payload[0] == STATUS_MAGIC
+
+
+def encode_status(device_type, device_id, timestamp, start_address, registers, error=False):
+    """ Pack one status poll. registers may be None (Modbus failure) """
+    if isinstance(device_id, str):
+        device_id = device_id.encode()
+    count = len(registers) if registers else 0
+    id_len = len(device_id)
+    payload = bytearray(8 + 1 + id_len + 3 + count * 2)
+    flags = FLAG_MODBUS_ERROR if error or registers is None else 0
+    struct.pack_into('>BBBBIB', payload, 0, STATUS_MAGIC, STATUS_FORMAT_VERSION, DEVICE_TYPES.get(device_type, 0), flags, timestamp & 0xFFFFFFFF, id_len)
+    payload[9:9 + id_len] = device_id
+    offset = 9 + id_len
+    struct.pack_into('>HB', payload, offset, start_address, count)
+    offset += 3
+    for i in range(count):
+        struct.pack_into('>H', payload, offset, registers[i])
+        offset += 2
+    return payload
+
+
+def decode_status(payload):
+    """ Reference decoder: binary status payload -> dict """
+    magic, version, device_type, flags, timestamp, id_len = struct.unpack_from('>BBBBIB', payload, 0)
+    if magic != STATUS_MAGIC:
+        raise ValueError("Not a binary status payload")
+    if version != STATUS_FORMAT_VERSION:
+        raise ValueError("Unsupported status format version {0}".format(version))
+    offset = 9
+    device_id = bytes(payload[offset:offset + id_len]).decode()
+    offset += id_len
+    start_address, count = struct.unpack_from('>HB', payload, offset)
+    offset += 3
+    if len(payload) < offset + count * 2:
+        raise ValueError("Truncated status payload")
+    registers = list(struct.unpack_from('>' + 'H' * count, payload, offset))
+    return {
+        "version": version,
+        "device_type": DEVICE_TYPE_NAMES.get(device_type, "unknown"),
+        "error": bool(flags & FLAG_MODBUS_ERROR),
+        "timestamp": timestamp,
+        "client_id": device_id,
+        "start_address": start_address,
+        "raw_data": registers,
+    }
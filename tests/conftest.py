@@ -0,0 +1,28 @@
+"""Host tests for the firmware modules. Run from the repository root: python -m pytest -q
+
+The firmware imports MicroPython-only modules (machine, time.ticks_*, ujson); the simulators in
+tools/ provide them, so every test runs on CPython against the real modbus.py/app.py code.
+"""
+import os
+import sys
+
+import pytest
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools")
+if TOOLS not in sys.path:
+    sys.path.insert(0, TOOLS)
+
+import modbus_sim  # noqa: E402  (also puts the repository root on sys.path)
+
+# A bus with no slaves until a test adds some; modbus.py binds `machine` when first imported
+modbus_sim.install(modbus_sim.SimulatedBus())
+
+
+@pytest.fixture
+def sim(tmp_path, monkeypatch):
+    """ main.py booted in tools/main_sim.py with tmp_path as its flash; sim.main is the app module """
+    import main_sim
+    monkeypatch.chdir(tmp_path)
+    sim = main_sim.Simulation(str(tmp_path))
+    sim.boot()
+    return sim
@@ -0,0 +1,129 @@
+"""Heap use of a steady-state status poll, read_holding_registers(20, 40).
+
+On the MicroPython Unix port gc.mem_alloc() gives the bytes allocated; on CPython tracemalloc does.
+Either way the poll should not grow the heap, and its transient peak should stay well under the old
+wash.py client's, which built a fresh bytearray, bytes slices and a list of ints on every read.
+The JSON status payload built from it should peak lower than the old ujson string round trip
+(tools/bench_json.py has the CPU side and the command responses).
+"""
+import gc
+import json
+import tracemalloc
+
+import legacy_modbus
+import modbus
+import register_map
+from modbus_sim import with_crc
+
+START, QUANTITY = 20, 40
+VALUES = [0x1000 + 37 * i for i in range(QUANTITY)]
+RESPONSE = with_crc(bytes([1, 0x03, QUANTITY * 2]) + b"".join(v.to_bytes(2, "big") for v in VALUES))
+
+
+class ReplayUART:
+    """ Answers every request with the same response, read straight out of one preallocated buffer """
+
+    def __init__(self, response):
+        self.response = bytearray(response)
+        self.mv = memoryview(self.response)
+        self.pos = len(response)
+
+    def write(self, buf):
+        self.pos = 0
+        return len(buf)
+
+    def flush(self):
+        pass
+
+    def any(self):
+        return len(self.response) - self.pos
+
+    def readinto(self, buf, nbytes=None):
+        n = min(self.any(), len(buf) if nbytes is None else nbytes)
+        if n <= 0:
+            return None
+        buf[:n] = self.mv[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def read(self, nbytes=None):
+        n = self.any() if nbytes is None else min(nbytes, self.any())
+        data = bytes(self.mv[self.pos:self.pos + n])
+        self.pos += n
+        return data
+
+
+def measure(poll, polls):
+    """ (net bytes retained after `polls` polls, largest transient peak of a single poll) """
+    poll()
+    poll()
+    gc.collect()
+    if hasattr(gc, "mem_alloc"):
+        # MicroPython: no peak tracking, so the peak is the garbage one poll leaves behind
+        before = gc.mem_alloc()
+        peak = 0
+        for _ in range(polls):
+            start = gc.mem_alloc()
+            poll()
+            peak = max(peak, gc.mem_alloc() - start)
+        gc.collect()
+        return gc.mem_alloc() - before, peak
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        peak = 0
+        for _ in range(polls):
+            start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            poll()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - before, peak
+    finally:
+        tracemalloc.stop()
+
+
+def make_client():
+    client = modbus.ModbusRTUClient()
+    client.uart = ReplayUART(RESPONSE)
+    return client
+
+
+def test_poll_reuses_the_register_array():
+    client = make_client()
+    first = client.read_holding_registers(START, QUANTITY)
+    assert list(first) == VALUES
+    assert client.read_holding_registers(START, QUANTITY) is first
+
+
+def test_steady_state_poll_does_not_grow_the_heap():
+    client = make_client()
+    retained, peak = measure(lambda: client.read_holding_registers(START, QUANTITY), 100)
+    assert retained <= 256, f"{retained} bytes retained over 100 polls"
+    assert peak <= 1024, f"{peak} bytes peak per poll"
+
+
+def test_poll_peak_is_below_the_legacy_client():
+    client = make_client()
+    legacy = legacy_modbus.ModbusRTUClient()
+    legacy.uart = ReplayUART(RESPONSE)
+    assert legacy.read_holding_registers(START, QUANTITY) == VALUES
+    _, peak = measure(lambda: client.read_holding_registers(START, QUANTITY), 20)
+    # The legacy read sleeps 100 ms per request, a few polls are enough
+    _, legacy_peak = measure(lambda: legacy.read_holding_registers(START, QUANTITY), 3)
+    print(f"peak per poll: modbus.py {peak} bytes, legacy {legacy_peak} bytes")
+    assert peak * 2 < legacy_peak
+
+
+def test_status_payload_skips_the_json_round_trip():
+    # The same status block decoded by register_map, embedded the way publish_status() does it
+    machine = register_map.Machine(register_map.WASH, make_client())
+    envelope = {"version": 3.2, "app": "wash", "device_type": "wash", "error_status": False}
+    native = lambda: json.dumps(dict(envelope, status=machine.get_machine_status())).encode()
+    # The old device module returned ujson.dumps(status) and main.py parsed it back before dumping again
+    legacy = lambda: json.dumps(dict(envelope, status=json.loads(json.dumps(machine.get_machine_status())))).encode()
+    assert native() == legacy()
+    _, peak = measure(native, 20)
+    _, legacy_peak = measure(legacy, 20)
+    print(f"peak per status payload: native {peak} bytes, ujson round trip {legacy_peak} bytes")
+    assert peak < legacy_peak
@@ -0,0 +1,73 @@
+import controller
+
+
+def command(key, command_id, **fields):
+    cmd = {"key": key, "id": command_id}
+    cmd.update(fields)
+    return {"command": cmd}
+
+
+def test_duplicate_id_is_ignored():
+    queue = controller.CommandQueue()
+    assert queue.put(command("coins", "a", value=1)) is None
+    assert queue.put(command("coins", "a", value=1)) is None
+    assert len(queue) == 1
+
+
+def test_refused_command_can_be_resent():
+    queue = controller.CommandQueue(size=2)
+    queue.put(command("reboot", "a"))
+    queue.put(command("reboot", "b"))
+    assert queue.put(command("reboot", "c")) == "reboot"
+    assert "c" not in queue.recent_ids
+    queue.get()
+    assert queue.put(command("reboot", "c")) is None
+    assert len(queue) == 2
+
+
+def test_evicted_command_is_forgotten():
+    queue = controller.CommandQueue(size=2)
+    queue.put(command("reboot", "a"))
+    queue.put(command("modbus_stats", "b"))
+    # A vend command makes room by evicting the newest low-priority entry
+    assert queue.put(command("coins", "c", value=1)) == "modbus_stats"
+    assert queue.recent_ids == ["a", "c"]
+    queue.get()
+    assert queue.put(command("modbus_stats", "b")) is None
+
+
+def test_collapsed_command_is_forgotten():
+    queue = controller.CommandQueue()
+    queue.put(command("get_status", "a"))
+    assert queue.put(command("get_status", "b")) is None
+    assert len(queue) == 1
+    assert queue.recent_ids == ["b"]
+    assert queue.get()[0]["command"]["id"] == "b"
+
+
+def test_recent_ids_are_bounded():
+    queue = controller.CommandQueue(size=1000)
+    for i in range(controller.RECENT_COMMAND_IDS + 5):
+        queue.put(command("reboot", i))
+    assert queue.recent_ids == list(range(5, controller.RECENT_COMMAND_IDS + 5))
+
+
+def test_malformed_commands_are_not_queued(sim):
+    main = sim.main
+    for payload in (b'{"command": "reboot"}', b'{"command": ["x"]}', b'{"command": null}', b'["command"]', b'5'):
+        main.sub_cb(main.COMMAND_TOPIC, payload)
+    assert len(main.command_queue) == 0
+
+
+def test_worker_survives_a_failing_command(sim, monkeypatch):
+    main = sim.main
+
+    def interpret_command(data_json, queued_ms=None):
+        raise AttributeError("'list' object has no attribute 'get'")
+
+    monkeypatch.setattr(main, "interpret_command", interpret_command)
+    main.command_queue.put(command("reboot", "a"))
+    sim.run(main.command_worker(), until=lambda: len(sim.broker.published) > 1)
+    topic, payload, _, _ = sim.broker.published[-1]
+    assert topic == main.COMMAND_RESPONSE_TOPIC
+    assert b'"status": "error"' in payload
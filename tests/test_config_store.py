@@ -0,0 +1,124 @@
+import json
+import os
+import struct
+import zlib
+
+import pytest
+
+import config_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """ config_store with tmp_path as flash and an empty cache """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config_store, "_config", None)
+    return config_store
+
+
+def pack(config, magic=config_store.CONFIG_MAGIC, length=None, crc=None):
+    payload = json.dumps(config).encode()
+    if length is None:
+        length = len(payload)
+    if crc is None:
+        crc = zlib.crc32(payload)
+    return struct.pack(config_store.CONFIG_HEADER, magic, length, crc) + payload
+
+
+def write(filename, data):
+    with open(filename, "wb") as f:
+        f.write(data)
+
+
+def reload(store):
+    store._config = None
+    return store.load()
+
+
+def test_update_writes_through_tmp_and_rename(store, monkeypatch):
+    renames = []
+    rename = os.rename
+
+    def spy(src, dst):
+        assert os.path.exists(src)
+        renames.append((src, dst))
+        rename(src, dst)
+
+    monkeypatch.setattr(os, "rename", spy)
+    store.load()
+    renames.clear()
+    assert store.update({"version": 3})
+    assert renames == [("config.bin.tmp", "config.bin")]
+    assert not os.path.exists("config.bin.tmp")
+    assert reload(store) == {"version": 3}
+
+
+def test_unchanged_update_does_not_write(store):
+    store.update({"version": 3})
+    # Flash is only touched when a value changes: a rewrite would bring the file back
+    os.remove("config.bin")
+    assert not store.update({"version": 3})
+    assert not store.update(remove=("wifi",))
+    assert not os.path.exists("config.bin")
+    assert store.update(remove=("version",))
+    assert reload(store) == {}
+
+
+def test_missing_file_falls_back_to_tmp(store):
+    # Power cut after the .tmp was written but before the rename
+    write("config.bin.tmp", pack({"version": 4}))
+    assert store.load() == {"version": 4}
+    assert os.path.exists("config.bin")
+    assert not os.path.exists("config.bin.tmp")
+
+
+def test_corrupt_file_falls_back_to_tmp(store):
+    write("config.bin", pack({"version": 3})[:-2])
+    write("config.bin.tmp", pack({"version": 4}))
+    assert store.load() == {"version": 4}
+
+
+@pytest.mark.parametrize("data", [
+    pack({"version": 3}, magic=b"WCF0"),
+    pack({"version": 3}, length=100),
+    pack({"version": 3}, crc=1),
+    pack({"version": 3})[:8],
+    pack([1, 2, 3]),
+])
+def test_bad_header_or_payload_is_rejected(store, data):
+    write("config.bin", data)
+    assert store._read("config.bin") is None
+    # Nothing valid left: starts over empty instead of trusting the bad file
+    assert store.load() == {}
+    assert store._read("config.bin") == {}
+
+
+def test_legacy_files_are_migrated_and_removed(store):
+    with open("wifi.dat", "w") as f:
+        f.write("Home;secret\nShop;pa;ss;word\n\n")
+    with open("config.json", "w") as f:
+        f.write(json.dumps({"ssid": "Home", "pwd": "secret"}))
+    with open("version.json", "w") as f:
+        f.write(json.dumps({"version": 2}))
+    assert store.load() == {
+        "wifi": {"Home": "secret", "Shop": "pa;ss;word"},
+        "wifi_config": {"ssid": "Home", "pwd": "secret"},
+        "version": 2,
+    }
+    for filename, _ in store.LEGACY_FILES:
+        assert not os.path.exists(filename)
+    assert reload(store)["wifi"]["Shop"] == "pa;ss;word"
+
+
+def test_unreadable_legacy_file_is_skipped(store):
+    with open("wifi.dat", "w") as f:
+        f.write("Home;secret\n")
+    with open("version.json", "w") as f:
+        f.write("{not json")
+    assert store.load() == {"wifi": {"Home": "secret"}}
+    assert not os.path.exists("version.json")
+
+
+def test_fresh_device_writes_an_empty_config(store):
+    assert store.load() == {}
+    assert store._read("config.bin") == {}
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import controller
+import modbus_sim
+
+
+def dead_machine(sim):
+    """ wash.device with nothing on the bus at its address and a short response timeout """
+    device = sim.main.wash.device
+    device.modbus_client.set_retry_policy(timeout_ms=20)
+    return device
+
+
+def test_silent_slave_skips_the_error_block(sim):
+    device = dead_machine(sim)
+    stats = sim.bus.stats
+    assert device.get_machine_status() is device.decoder.offline
+    # The status read with its retries, no error block read after it
+    assert stats["requests"] == device.modbus_client.attempts
+    device.get_machine_status()
+    # Still silent: a single attempt
+    assert stats["requests"] == device.modbus_client.attempts + 1
+
+
+def test_silent_slave_costs_one_timeout_per_poll(sim):
+    device = dead_machine(sim)
+    device.get_machine_status()
+    started = time.monotonic()
+    device.get_machine_status()
+    assert time.monotonic() - started < 0.1
+
+
+def test_slave_that_comes_back_is_decoded_again(sim):
+    device = dead_machine(sim)
+    device.get_machine_status()
+    assert device.silent_polls == 1
+    sim.bus.add(modbus_sim.SimulatedMachine(sim.main.wash.MODEL))
+    assert device.get_machine_status() is not device.decoder.offline
+    assert device.silent_polls == 0
+
+
+def test_failed_polls_back_off(sim):
+    main = sim.main
+    rates = dict(controller.DEFAULT_POLL_RATES)
+    scheduler = controller.PollScheduler(rates, asyncio.Event())
+    active = rates["active"]
+    intervals = [scheduler.next_interval(None) for _ in range(6)]
+    assert intervals == [min(active * 2 ** i, controller.FAILED_POLL_MAX_INTERVAL) for i in range(6)]
+    assert intervals[-1] == controller.FAILED_POLL_MAX_INTERVAL
+    sim.bus.add(modbus_sim.SimulatedMachine(main.wash.MODEL))
+    registers = main.wash.device.read_status_registers()
+    assert scheduler.next_interval(registers) <= rates["idle"]
+    assert scheduler.failures == 0
+    assert scheduler.next_interval(None) == active
+
+
+def test_poll_lets_other_tasks_run_while_the_slave_is_silent(sim):
+    main = sim.main
+    dead_machine(sim)
+    slot = main.machine_slots[0]
+    polled = []
+    ticks = []
+
+    async def poll():
+        async with main.bus_lock:
+            polled.append(await main.publish_status(slot))
+
+    async def ticker():
+        while not polled:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.001)
+
+    sim.run(poll(), ticker(), until=lambda: polled)
+    assert polled == [None]
+    # Three 20 ms timeouts plus backoff: the ticker kept running the whole time
+    assert len(ticks) > 20
+
+
+def test_command_waits_for_the_poll_on_the_bus(sim, monkeypatch):
+    main = sim.main
+    dead_machine(sim)
+    slot = main.machine_slots[0]
+    order = []
+    monkeypatch.setattr(main, "interpret_command", lambda data_json, queued_ms=None: order.append("command"))
+
+    async def poll():
+        async with main.bus_lock:
+            main.command_queue.put({"command": {"key": "coins", "value": 5}})
+            await main.publish_status(slot)
+            order.append("poll")
+
+    sim.run(poll(), main.command_worker(), until=lambda: len(order) == 2)
+    assert order == ["poll", "command"]
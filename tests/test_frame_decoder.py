@@ -0,0 +1,156 @@
+import time
+
+import pytest
+
+import modbus
+from modbus_sim import with_crc
+
+REGISTERS = [0x0102, 0x0304, 0xFFFF]
+FC03_RESPONSE = with_crc(bytes([1, 0x03, 6, 0x01, 0x02, 0x03, 0x04, 0xFF, 0xFF]))
+
+
+class ScriptedUART:
+    """ Answers each write() with the next scripted response: a list of (delay_ms, chunk).
+        A chunk becomes readable delay_ms after the previous one (or after the write). """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+        self.pending = []
+
+    def write(self, buf):
+        self.sent.append(bytes(buf))
+        at = time.monotonic()
+        self.pending = []
+        for delay_ms, chunk in (self.responses.pop(0) if self.responses else []):
+            at += delay_ms / 1000
+            self.pending.append([at, bytes(chunk)])
+        return len(buf)
+
+    def flush(self):
+        pass
+
+    def any(self):
+        now = time.monotonic()
+        return sum(len(chunk) for at, chunk in self.pending if at <= now)
+
+    def readinto(self, buf, nbytes=None):
+        n = min(self.any(), len(buf), nbytes if nbytes is not None else len(buf))
+        if n <= 0:
+            return None
+        data = b""
+        while len(data) < n:
+            chunk = self.pending[0][1]
+            take = min(n - len(data), len(chunk))
+            data += chunk[:take]
+            if take == len(chunk):
+                self.pending.pop(0)
+            else:
+                self.pending[0][1] = chunk[take:]
+        buf[:n] = data
+        return n
+
+
+def make_client(*responses):
+    client = modbus.ModbusRTUClient()
+    client.uart = ScriptedUART(*responses)
+    client.set_retry_policy(attempts=1, timeout_ms=100)
+    return client
+
+
+def test_split_chunks_decode_to_one_frame():
+    client = make_client([(0, FC03_RESPONSE[:1]), (1, FC03_RESPONSE[1:4]), (1, FC03_RESPONSE[4:-1]), (1, FC03_RESPONSE[-1:])])
+    assert list(client.read_holding_registers(20, 3)) == REGISTERS
+    assert client.last_reason == modbus.FRAME_OK
+    assert client.uart.sent == [with_crc(bytes.fromhex("010300140003"))]
+
+
+def test_frame_completes_without_waiting_for_line_silence():
+    # Junk after the frame is never read: the decoder stops at the last CRC byte
+    client = make_client([(0, FC03_RESPONSE + b"\x00\x00")])
+    started = time.monotonic()
+    assert client.read_holding_registers(20, 3) is not None
+    assert (time.monotonic() - started) * 1000 < client.eof_silence_us / 1000 + 20
+
+
+def test_fc10_echo():
+    client = make_client([(0, with_crc(bytes.fromhex("011000040002")))])
+    assert client.write_multiple_registers(4, [1, 2]) is True
+    assert client.last_reason == modbus.FRAME_OK
+
+
+def test_exception_frame():
+    client = make_client([(0, with_crc(bytes([1, 0x83, 0x02])))])
+    assert client.read_holding_registers(20, 3) is None
+    assert client.last_reason == modbus.FRAME_EXCEPTION
+    assert client.decoder.exception_code == 2
+    assert client.exception_codes == {2: 1}
+
+
+def test_crc_mismatch():
+    corrupt = bytearray(FC03_RESPONSE)
+    corrupt[-1] ^= 0xFF
+    client = make_client([(0, corrupt)])
+    assert client.read_holding_registers(20, 3) is None
+    assert client.last_reason == modbus.FRAME_CRC_MISMATCH
+    assert client.stats[modbus.FRAME_CRC_MISMATCH] == 1
+
+
+def test_truncated_frame_ends_on_line_silence():
+    client = make_client([(0, FC03_RESPONSE[:5])])
+    started = time.monotonic()
+    assert client.read_holding_registers(20, 3) is None
+    assert client.last_reason == modbus.FRAME_TRUNCATED
+    # Ended by t3.5 of silence, not by the 100 ms response timeout
+    assert (time.monotonic() - started) * 1000 < 50
+
+
+def test_gap_longer_than_t35_truncates():
+    client = make_client([(0, FC03_RESPONSE[:4]), (30, FC03_RESPONSE[4:])])
+    assert client.read_holding_registers(20, 3) is None
+    assert client.last_reason == modbus.FRAME_TRUNCATED
+
+
+def test_wrong_slave_id_stops_at_first_byte():
+    client = make_client([(0, with_crc(bytes([2, 0x03, 6, 0, 1, 0, 2, 0, 3])))])
+    started = time.monotonic()
+    assert client.read_holding_registers(20, 3) is None
+    assert client.last_reason == modbus.FRAME_UNEXPECTED
+    assert (time.monotonic() - started) * 1000 < 50
+
+
+def test_wrong_function_code():
+    client = make_client([(0, with_crc(bytes([1, 0x04, 2, 0, 1])))])
+    assert client.read_holding_registers(20, 1) is None
+    assert client.last_reason == modbus.FRAME_UNEXPECTED
+
+
+def test_byte_count_beyond_buffer_is_overrun():
+    client = make_client([(0, bytes([1, 0x03, 0xFF]) + bytes(64))])
+    assert client.read_holding_registers(20, 3) is None
+    assert client.last_reason == modbus.FRAME_OVERRUN
+
+
+def test_decoder_overrun_on_small_buffer():
+    decoder = modbus.FrameDecoder(size=8)
+    decoder.reset(1, 0x03)
+    assert decoder.feed(FC03_RESPONSE) == modbus.FRAME_OVERRUN
+    # Once stopped it keeps reporting the same reason
+    assert decoder.feed(b"\x00") == modbus.FRAME_OVERRUN
+
+
+def test_no_response_is_timeout():
+    client = make_client([])
+    started = time.monotonic()
+    assert client.read_holding_registers(20, 3) is None
+    assert client.last_reason == modbus.FRAME_TIMEOUT
+    assert (time.monotonic() - started) * 1000 >= 100
+
+
+@pytest.mark.parametrize("split", range(1, len(FC03_RESPONSE)))
+def test_decoder_every_split_point(split):
+    decoder = modbus.FrameDecoder()
+    decoder.reset(1, 0x03)
+    assert decoder.feed(FC03_RESPONSE[:split]) is None
+    assert decoder.feed(FC03_RESPONSE[split:]) == modbus.FRAME_OK
+    assert bytes(decoder.payload()) == FC03_RESPONSE[3:-2]
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+
+import controller
+import main_sim
+import modbus_sim
+import status_codec
+
+
+def boot(tmp_path, monkeypatch, machines):
+    monkeypatch.chdir(tmp_path)
+    sim = main_sim.Simulation(str(tmp_path), config={"wifi": {main_sim.SSID: main_sim.PASSWORD}, "machines": machines})
+    return sim.boot()
+
+
+def test_valid_entries(tmp_path, monkeypatch):
+    main = boot(tmp_path, monkeypatch, [{"slave": 1, "type": "wash"}, {"slave": "2", "type": "dryer"}, {"slave": 3}])
+    assert [(slot.slave, slot.device_type) for slot in main.machine_slots] == [(1, "wash"), (2, "dryer"), (3, "wash")]
+    assert main.MULTI_MACHINE
+
+
+def test_bad_entries_are_skipped(tmp_path, monkeypatch, capsys):
+    main = boot(tmp_path, monkeypatch, [
+        {"slave": 1, "type": "wash"},
+        {"type": "dryer"},
+        {"slave": "two"},
+        {"slave": 0},
+        {"slave": 248},
+        {"slave": 1, "type": "dryer"},
+        {"slave": 4, "type": "boiler"},
+        "slave 5",
+        {"slave": 6, "type": "dryer"},
+    ])
+    assert [(slot.slave, slot.device_type) for slot in main.machine_slots] == [(1, "wash"), (6, "dryer")]
+    assert capsys.readouterr().out.count("Skipping machines entry") == 7
+
+
+@pytest.mark.parametrize("machines", [[{"slave": 0}, {"type": "wash"}], {"slave": 1}, "wash"])
+def test_falls_back_to_the_single_machine(tmp_path, monkeypatch, machines):
+    main = boot(tmp_path, monkeypatch, machines)
+    assert len(main.machine_slots) == 1
+    assert not main.MULTI_MACHINE
+    assert main.machine_slots[0].status_topic == main.STATUS_TOPIC
+
+
+def test_validate_machine():
+    validate = controller.validate_machine
+    assert validate({"slave": 247, "type": "dryer"}) == {"slave": 247, "type": "dryer"}
+    with pytest.raises(ValueError):
+        validate({"slave": 2}, known=[2])
+    with pytest.raises(ValueError):
+        validate(None)
+
+
+def machines_command(sim, value=None):
+    """ Run a machines command and return its decoded response """
+    main = sim.main
+    main.mqtt_ready.set()
+    cmd = {"key": "machines"}
+    if value is not None:
+        cmd["value"] = value
+    main.interpret_command({"command": cmd})
+    topic, payload, _, _ = sim.broker.published[-1]
+    assert topic == main.COMMAND_RESPONSE_TOPIC
+    return json.loads(payload)
+
+
+def test_machines_command_saves_a_valid_list(sim):
+    import config_store
+    response = machines_command(sim, [{"slave": 1, "type": "wash"}, {"slave": "2", "type": "dryer"}])
+    assert response["status"] == "success"
+    assert config_store.get("machines") == [{"slave": 1, "type": "wash"}, {"slave": 2, "type": "dryer"}]
+    assert response["running"] == [{"slave": 1, "type": "wash"}]
+    assert machines_command(sim)["machines"] == config_store.get("machines")
+    # Applied on the next boot
+    main = main_sim.Simulation(sim.workdir, config=config_store.load()).boot()
+    assert [(slot.slave, slot.device_type) for slot in main.machine_slots] == [(1, "wash"), (2, "dryer")]
+
+
+@pytest.mark.parametrize("value", [[{"slave": 1}, {"slave": 1, "type": "dryer"}], [{"slave": 1}, {"slave": 300}], {"slave": 1}, "wash"])
+def test_machines_command_rejects_bad_lists(sim, value):
+    import config_store
+    config_store.update({"machines": [{"slave": 3, "type": "wash"}]})
+    response = machines_command(sim, value)
+    assert response["status"] == "error"
+    assert config_store.get("machines") == [{"slave": 3, "type": "wash"}]
+
+
+def test_machines_command_empty_list_restores_the_single_machine(sim):
+    import config_store
+    config_store.update({"machines": [{"slave": 3, "type": "wash"}]})
+    assert machines_command(sim, [])["status"] == "success"
+    assert "machines" not in config_store.load()
+
+
+@pytest.mark.parametrize("data_json", [{"command": ["x"], "slave": 1}, {"command": "reboot", "slave": 2}, {"command": None}])
+def test_malformed_command_gets_an_error_response(tmp_path, monkeypatch, data_json):
+    monkeypatch.chdir(tmp_path)
+    sim = main_sim.Simulation(str(tmp_path), config={"wifi": {main_sim.SSID: main_sim.PASSWORD}, "machines": [{"slave": 1}, {"slave": 2, "type": "dryer"}]})
+    main = sim.boot()
+    main.interpret_command(data_json)
+    topic, payload, _, _ = sim.broker.published[-1]
+    assert topic == main.COMMAND_RESPONSE_TOPIC
+    assert json.loads(payload)["status"] == "error"
+
+
+def test_single_dryer_reports_its_device_type(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sim = main_sim.Simulation(str(tmp_path), device_type="dryer")
+    main = sim.boot()
+    slot = main.machine_slots[0]
+    assert not slot.multi
+    assert slot.device_type == "dryer"
+    # The legacy JSON status keeps its "wash" fields
+    assert (slot.app, slot.json_device_type) == ("wash", "wash")
+    main.mqtt_ready.set()
+    main.interpret_command({"command": {"key": "machines"}})
+    assert json.loads(sim.broker.published[-1][1])["running"] == [{"slave": 1, "type": "dryer"}]
+    # The binary status carries the real type
+    sim.bus.add(modbus_sim.SimulatedMachine(main.wash.MODEL))
+    main.status_format = "binary"
+    asyncio.run(main.publish_status(slot))
+    assert status_codec.decode_status(sim.broker.published[-1][1])["device_type"] == "dryer"
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import make_manifest
+import ota_server
+
+
+@pytest.fixture
+def dist(tmp_path):
+    directory = tmp_path / "dist"
+    make_manifest.build("3.3", str(directory), root=ota_server.ROOT)
+    return str(directory)
+
+
+def serve(dist, corrupt=()):
+    return ota_server.OTAServer(dist, corrupt=corrupt).start()
+
+
+def test_full_update_then_nothing_to_do(dist, tmp_path):
+    device = str(tmp_path / "device")
+    server = serve(dist)
+    try:
+        summary = ota_server.run_update(server.url + "manifest.json", device, "wash")
+        names = [name for name, _, device_type in make_manifest.FIRMWARE_FILES if device_type in (None, "wash")]
+        assert summary["updated"] == names
+        assert summary["failed"] == summary["pending"] == []
+        assert summary["version"] == "3.3"
+        # Everything the server sent apart from the manifest went to the device, compressed
+        assert summary["bytes_received"] == server.bytes_sent() - server.stats["/manifest.json"]["bytes"]
+        assert summary["bytes_written"] > summary["bytes_received"]
+        with open(os.path.join(device, "main.py"), "rb") as f, open(os.path.join(ota_server.ROOT, "main.py"), "rb") as source:
+            assert f.read() == source.read()
+
+        before = server.bytes_sent()
+        again = ota_server.run_update(server.url + "manifest.json", device, "wash")
+        assert again["updated"] == [] and again["skipped"] == names
+        assert again["bytes_received"] == 0
+        assert server.bytes_sent() - before == server.stats["/manifest.json"]["bytes"] // 2
+    finally:
+        server.shutdown()
+
+
+def test_corrupt_file_stops_before_boot_and_main(dist, tmp_path):
+    device = str(tmp_path / "device")
+    server = serve(dist, corrupt=["register_map.py.z"])
+    try:
+        summary = ota_server.run_update(server.url + "manifest.json", device, "wash")
+    finally:
+        server.shutdown()
+    assert summary["updated"] == ["modbus.py"]
+    assert summary["failed"] == ["register_map.py"]
+    assert summary["pending"][-2:] == ["boot.py", "main.py"]
+    assert sorted(os.listdir(device)) == ["modbus.py"]
+    # Nothing was requested after the failure
+    assert "/main.py.z" not in server.stats
+
+
+def test_missing_file_is_a_failure(dist, tmp_path):
+    os.remove(os.path.join(dist, "ota.py.z"))
+    server = serve(dist)
+    try:
+        summary = ota_server.run_update(server.url + "manifest.json", str(tmp_path / "device"), "dryer")
+    finally:
+        server.shutdown()
+    assert summary["failed"] == ["ota.py"]
+    assert "wash.py" in summary["pending"] and "main.py" in summary["pending"]
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import controller
+
+IDLE = 0
+RUNNING = 3 # Autorun
+
+
+class Clock:
+    """ time.ticks_ms() under test control, in seconds """
+
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        monkeypatch.setattr(time, "ticks_ms", lambda: int(self.now * 1000))
+
+
+def registers(run=IDLE, door=0, remain=(0, 0, 0), program=1, coins=0):
+    block = [0] * 12
+    block[controller.REG_RUN_STATUS] = run
+    block[controller.REG_DOOR_STATUS] = door
+    block[controller.REG_REMAIN_HOUR:controller.REG_REMAIN_SEC + 1] = remain
+    block[8] = program
+    block[11] = coins
+    return block
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    return Clock(monkeypatch)
+
+
+@pytest.fixture
+def scheduler(clock):
+    return controller.PollScheduler(dict(controller.DEFAULT_POLL_RATES), asyncio.Event())
+
+
+def test_idle_machine_polls_at_the_idle_rate(scheduler):
+    assert scheduler.next_interval(registers()) == scheduler.rates["idle"]
+    assert scheduler.next_interval(registers()) == scheduler.rates["idle"]
+
+
+def test_transition_holds_fast_then_decays_to_active(scheduler, clock):
+    rates = scheduler.rates
+    scheduler.next_interval(registers())
+    # Coins inserted, then the program starts: each is a transition
+    assert scheduler.next_interval(registers(coins=5)) == rates["fast"]
+    clock.now += 1
+    assert scheduler.next_interval(registers(RUNNING, remain=(0, 30, 0), coins=5)) == rates["fast"]
+    # The countdown alone is not a transition, fast only lasts `hold` after the last one
+    clock.now += rates["hold"] - 1
+    assert scheduler.next_interval(registers(RUNNING, remain=(0, 29, 46), coins=5)) == rates["fast"]
+    clock.now += 1
+    assert scheduler.next_interval(registers(RUNNING, remain=(0, 29, 45), coins=5)) == rates["active"]
+
+
+def test_end_of_program_decays_to_idle(scheduler, clock):
+    rates = scheduler.rates
+    scheduler.next_interval(registers(RUNNING, remain=(0, 10, 0)))
+    clock.now += rates["hold"]
+    assert scheduler.next_interval(registers(RUNNING, remain=(0, 0, rates["active"] * 2))) == rates["fast"]
+    assert scheduler.next_interval(registers(IDLE)) == rates["fast"]
+    clock.now += rates["hold"]
+    assert scheduler.next_interval(registers(IDLE)) == rates["idle"]
+
+
+def test_door_locking_polls_fast(scheduler, clock):
+    scheduler.next_interval(registers())
+    clock.now += 100
+    assert scheduler.next_interval(registers(door=controller.DOOR_LOCKING)) == scheduler.rates["fast"]
+    clock.now += 100
+    assert scheduler.next_interval(registers(door=controller.DOOR_LOCKING)) == scheduler.rates["fast"]
+
+
+def test_kick_polls_now_and_holds_fast(scheduler, clock):
+    scheduler.schedule(registers())
+    assert scheduler.due == time.ticks_ms() + scheduler.rates["idle"] * 1000
+    scheduler.kick()
+    assert scheduler.due == time.ticks_ms()
+    assert scheduler.wake.is_set()
+    assert scheduler.next_interval(registers()) == scheduler.rates["fast"]
+    clock.now += scheduler.rates["hold"]
+    assert scheduler.next_interval(registers()) == scheduler.rates["idle"]
+
+
+def test_shared_rates_apply_to_the_next_transition(scheduler, clock):
+    scheduler.next_interval(registers())
+    scheduler.rates["hold"] = 3
+    scheduler.next_interval(registers(coins=5))
+    clock.now += 3
+    assert scheduler.next_interval(registers(coins=5)) == scheduler.rates["idle"]
+
+
+@pytest.mark.parametrize("rates, message", [
+    ({"fast": 10}, "fast <= active <= idle"),
+    ({"idle": 0.1}, "at least"),
+    ({"slow": 60}, "Unknown poll rate"),
+])
+def test_validate_poll_rates_rejects(rates, message):
+    with pytest.raises(ValueError, match=message):
+        controller.validate_poll_rates(rates)
+
+
+def poll_rates_command(sim, value=None):
+    main = sim.main
+    cmd = {"key": "poll_rates"}
+    if value is not None:
+        cmd["value"] = value
+    main.interpret_command({"command": cmd})
+    return json.loads(sim.broker.published[-1][1])
+
+
+def test_poll_rates_command_sets_hold_for_every_machine(sim):
+    import config_store
+    main = sim.main
+    main.poll_wake.clear()
+    response = poll_rates_command(sim, {"hold": 3})
+    assert response["status"] == "success"
+    assert response["poll_rates"]["hold"] == 3
+    assert main.machine_slots[0].scheduler.rates["hold"] == 3
+    assert config_store.get("poll_rates")["hold"] == 3
+    assert main.poll_wake.is_set()
+    assert poll_rates_command(sim)["poll_rates"] == main.poll_rates
+
+
+def test_poll_rates_command_keeps_the_rates_on_error(sim):
+    import config_store
+    main = sim.main
+    before = dict(main.poll_rates)
+    response = poll_rates_command(sim, {"hold": "long"})
+    assert response["status"] == "error"
+    assert poll_rates_command(sim, {"fast": 60})["status"] == "error"
+    assert main.poll_rates == before
+    assert config_store.get("poll_rates") is None
@@ -0,0 +1,111 @@
+import os
+import time
+
+import pytest
+
+import main_sim
+import ota_server
+
+SERVED = {
+    "modbus.txt": b"# modbus\n",
+    "register_map.txt": b"# register_map\n",
+    "config_store.txt": b"# config_store\n",
+    "status_codec.txt": b"# status_codec\n",
+    "ota.txt": b"# ota\n",
+    "portal.bin": bytes(range(256)),
+    "wash.txt": b"# wash\n",
+    "dryer.txt": b"# dryer\n",
+    "controller.txt": b"# controller\n",
+    "app.txt": b"# app\n",
+    "boot.txt": b"# boot\n",
+    "main.txt": b"# main\n",
+}
+
+
+@pytest.fixture
+def portal(sim, tmp_path, monkeypatch):
+    served = tmp_path / "served"
+    served.mkdir()
+    for name, data in SERVED.items():
+        (served / name).write_bytes(data)
+    server = ota_server.OTAServer(str(served)).start()
+    ota_server.install_device_shims()
+    import wifi_portal
+    monkeypatch.setattr(wifi_portal, "INSTALL_URL", server.url)
+    yield wifi_portal.Portal(sim.main.WiFIManager), served
+    server.shutdown()
+
+
+def read(name):
+    with open(name, "rb") as f:
+        return f.read()
+
+
+def test_installs_every_file_for_the_device_type(portal):
+    assert portal[0].install_firmware("dryer") == (True, "Firmware installed")
+    assert read("wash.py") == SERVED["dryer.txt"]
+    assert read("main.py") == SERVED["main.txt"]
+    assert read("portal.bin") == SERVED["portal.bin"]
+    assert not [name for name in os.listdir() if name.endswith(".tmp")]
+
+
+def test_stops_at_the_first_failure(portal):
+    installer, served = portal
+    (served / "ota.txt").unlink()
+    ok, message = installer.install_firmware("wash")
+    assert not ok and "ota.py" in message
+    assert read("modbus.py") == SERVED["modbus.txt"]
+    # Nothing after the failed file, above all no new boot.py/main.py over old modules
+    for name in ("ota.py", "wash.py", "boot.py", "main.py"):
+        assert not os.path.exists(name)
+
+
+def test_failed_download_keeps_the_old_file(portal):
+    installer, served = portal
+    with open("main.py", "w") as f:
+        f.write("# running firmware\n")
+    (served / "main.txt").unlink()
+    assert not installer.install_firmware("wash")[0]
+    assert read("main.py") == b"# running firmware\n"
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = b""
+
+    def sendall(self, data):
+        self.sent += data
+
+    def close(self):
+        pass
+
+
+def configure(installer, monkeypatch):
+    """ POST the portal form for the simulated network. Returns the response sent to the browser """
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    installer.client = FakeClient()
+    installer.request = ("POST /configure HTTP/1.1\r\n\r\nssid=%s&password=%s&select=wash" % (main_sim.SSID, main_sim.PASSWORD)).encode()
+    installer.handle_configure()
+    return installer.client.sent
+
+
+def test_configure_reports_a_failed_install_and_stays_up(portal, monkeypatch):
+    installer, served = portal
+    (served / "ota.txt").unlink()
+    sent = configure(installer, monkeypatch)
+    assert sent.startswith(b"HTTP/1.1 500")
+    assert b"ota.py" in sent and b"does not reboot" in sent
+    assert "ota.py" in installer.install_error
+    # The station is connected, so web_server() returns at once instead of rebooting
+    installer.reboot = True
+    installer.web_server(0)
+
+
+def test_configure_reboots_after_a_complete_install(portal, monkeypatch):
+    installer = portal[0]
+    sent = configure(installer, monkeypatch)
+    assert sent.startswith(b"HTTP/1.1 200")
+    assert installer.install_error is None
+    installer.reboot = True
+    with pytest.raises(main_sim.DeviceReset):
+        installer.web_server(0)
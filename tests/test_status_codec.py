@@ -0,0 +1,78 @@
+import json
+import random
+
+import pytest
+
+import register_map
+import status_codec
+
+MODELS = (register_map.WASH, register_map.DRYER)
+
+
+def json_status(model, registers):
+    """ The JSON status the default format publishes, after a trip over the wire """
+    return json.loads(json.dumps(register_map.StatusDecoder(model).decode(registers)))
+
+
+@pytest.mark.parametrize("model", MODELS, ids=lambda model: model["device_type"])
+@pytest.mark.parametrize("seed", range(20))
+def test_round_trip_matches_the_json_form(model, seed):
+    rng = random.Random(seed)
+    registers = [rng.choice((0, 1, 0xFFFF, rng.getrandbits(16))) for _ in range(model["status_count"])]
+    payload = status_codec.encode_status(model["device_type"], "ABC123", 1700000000 + seed, model["status_start"], registers)
+    assert status_codec.is_binary_status(payload)
+
+    decoded = status_codec.decode_status(bytes(payload))
+    assert decoded == {
+        "version": status_codec.STATUS_FORMAT_VERSION,
+        "device_type": model["device_type"],
+        "error": False,
+        "timestamp": 1700000000 + seed,
+        "client_id": "ABC123",
+        "start_address": model["status_start"],
+        "raw_data": registers,
+    }
+    # The backend rebuilds the named fields from raw_data exactly as the device would have sent them as JSON
+    expected = json_status(model, registers)
+    assert decoded["raw_data"] == expected["raw_data"]
+    assert json_status(model, decoded["raw_data"]) == expected
+
+
+def test_registers_from_the_simulator():
+    from modbus_sim import SimulatedMachine
+    sim = SimulatedMachine(register_map.WASH)
+    start, count = register_map.WASH["status_start"], register_map.WASH["status_count"]
+    registers = sim.registers[start:start + count]
+    decoded = status_codec.decode_status(status_codec.encode_status("wash", b"SIM", 0, start, registers))
+    assert json_status(register_map.WASH, decoded["raw_data"]) == json_status(register_map.WASH, registers)
+
+
+def test_failed_poll_sets_the_error_flag():
+    decoded = status_codec.decode_status(status_codec.encode_status("dryer", "ABC123", 5, 20, None))
+    assert decoded["error"] is True
+    assert decoded["raw_data"] == []
+    assert status_codec.decode_status(status_codec.encode_status("wash", "ABC123", 5, 20, [1, 2], error=True))["error"] is True
+
+
+def test_timestamp_and_unknown_type():
+    decoded = status_codec.decode_status(status_codec.encode_status("boiler", "X", 2 ** 32 + 7, 0, [1]))
+    assert decoded["timestamp"] == 7
+    assert decoded["device_type"] == "unknown"
+
+
+def test_json_payload_is_not_binary():
+    assert not status_codec.is_binary_status(json.dumps({"version": 3.2}).encode())
+    assert not status_codec.is_binary_status(b"")
+
+
+def test_rejects_bad_payloads():
+    payload = status_codec.encode_status("wash", "ABC123", 0, 20, [1, 2, 3])
+    with pytest.raises(ValueError):
+        status_codec.decode_status(bytes(payload[:-1]))
+    bad = bytearray(payload)
+    bad[1] = status_codec.STATUS_FORMAT_VERSION + 1
+    with pytest.raises(ValueError):
+        status_codec.decode_status(bytes(bad))
+    bad[0] = ord("{")
+    with pytest.raises(ValueError):
+        status_codec.decode_status(bytes(bad))
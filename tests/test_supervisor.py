@@ -0,0 +1,110 @@
+"""Broker kill/restart against the connection supervisor in app.py (tools/main_sim.py)."""
+import asyncio
+
+import pytest
+
+import controller
+import main_sim
+
+
+def assert_backoff(sleeps):
+    """ Attempt n waits backoff_delay(n), in [2^n, 2^(n+1)) seconds """
+    for attempt, delay in enumerate(sleeps, 1):
+        assert 2 ** attempt <= delay < 2 ** (attempt + 1)
+
+
+def drop(sim):
+    sim.main.connection_lost(OSError(104, "ECONNRESET"))
+    assert not sim.main.mqtt_ready.is_set()
+
+
+def test_boot_connects_and_announces(sim):
+    assert sim.broker.connects == 1
+    assert sim.broker.topics() == [sim.main.COMMAND_RESPONSE_TOPIC]
+    assert sim.main.mqtt_ready.is_set()
+
+
+def test_publish_failures_after_reconnect_back_off(sim):
+    main = sim.main
+    main.RECONNECT_STABLE_S = 0
+    # Connect succeeds but the link dies on the first publish (announce_online) three times
+    sim.broker.fail_publishes = 3
+    drop(sim)
+    sim.run(main.supervisor_loop(), until=main.mqtt_ready.is_set)
+    assert sim.broker.connects == 1 + 4
+    assert len(sim.async_sleeps) == 3
+    assert_backoff(sim.async_sleeps)
+
+
+def test_gives_up_when_publishes_keep_failing(sim):
+    main = sim.main
+    main.RECONNECT_STABLE_S = 0
+    sim.broker.fail_publishes = 10 ** 6
+    drop(sim)
+    with pytest.raises(main_sim.DeviceReset):
+        sim.run(main.supervisor_loop(), until=main.mqtt_ready.is_set)
+    assert sim.broker.connects == 1 + main.RECONNECT_MAX_ATTEMPTS
+    assert len(sim.async_sleeps) == main.RECONNECT_MAX_ATTEMPTS - 1
+    assert_backoff(sim.async_sleeps[:7])
+    assert max(sim.async_sleeps) < controller.RECONNECT_MAX_DELAY
+
+
+def test_broker_restart_flushes_the_outbox_in_order(sim):
+    main = sim.main
+    main.RECONNECT_STABLE_S = 0
+    sim.broker.up = False
+    drop(sim)
+    for i in range(3):
+        main.send_response({"status": "success", "id": i}, vend=True)
+    assert len(main.outbox.entries) == 3
+
+    async def restart_broker():
+        while len(sim.async_sleeps) < 4:
+            await asyncio.sleep(0)
+        sim.broker.up = True
+
+    before = len(sim.broker.published)
+    sim.run(main.supervisor_loop(), restart_broker(), until=main.mqtt_ready.is_set)
+    assert sim.broker.connects == 2
+    assert_backoff(sim.async_sleeps)
+    published = sim.broker.published[before:]
+    assert b'"message": "online"' in published[0][1]
+    assert [payload for _, payload, qos, _ in published[1:]] == [('{"status": "success", "id": %d}' % i).encode() for i in range(3)]
+    assert all(qos == 1 for _, _, qos, _ in published[1:])
+    assert main.outbox.entries == []
+
+
+def test_flapping_link_keeps_backing_off(sim):
+    main = sim.main
+    finished = []
+
+    async def flap(times):
+        for _ in range(times):
+            drop(sim)
+            while not main.mqtt_ready.is_set():
+                await asyncio.sleep(0.001)
+        # A link that stays up for RECONNECT_STABLE_S starts the backoff over
+        main.RECONNECT_STABLE_S = 0
+        drop(sim)
+        while not main.mqtt_ready.is_set():
+            await asyncio.sleep(0.001)
+        finished.append(True)
+
+    sim.run(main.supervisor_loop(), flap(4), until=lambda: finished)
+    # Every reconnect succeeded at once, yet each quick drop waited longer than the one before
+    assert len(sim.async_sleeps) == 4
+    assert_backoff(sim.async_sleeps)
+    assert sim.broker.connects == 1 + 5
+
+
+def test_lost_puback_times_out_instead_of_blocking(sim):
+    main = sim.main
+    sock = main.client.sock
+    assert isinstance(sock, main.MQTTSocket)
+    # check_msg() leaves the socket "blocking", which must still mean the timeout
+    main.client.check_msg()
+    assert sock.sock.timeout == controller.MQTT_SOCKET_TIMEOUT
+    sim.broker.lose_pubacks = True
+    with pytest.raises(OSError):
+        main.send_response({"status": "success", "id": 1}, vend=True)
+    assert len(main.outbox.entries) == 1
@@ -0,0 +1,81 @@
+import pytest
+
+import modbus
+import register_map
+
+COMMANDS = register_map.WASH["commands"]
+
+
+class FakeClient:
+    """ Records every FC10 write; write number fail_at (1-based) fails """
+
+    slave_address = 1
+
+    def __init__(self, fail_at=None):
+        self.writes = []
+        self.fail_at = fail_at
+
+    def write_multiple_registers(self, start_address, values, slave_address=None):
+        self.writes.append((start_address, list(values)))
+        return len(self.writes) != self.fail_at
+
+
+def test_adjacent_writes_merge_in_either_order():
+    assert modbus.coalesce_writes([(4, 10, True), (5, 3, True)]) == [[4, [10, 3], True, 2]]
+    assert modbus.coalesce_writes([(5, 3, True), (4, 10, True)]) == [[4, [10, 3], True, 2]]
+    assert modbus.coalesce_writes([(4, 1, True), (5, 2, True), (6, 3, True), (3, 0, True)]) == [[3, [0, 1, 2, 3], True, 4]]
+
+
+def test_gaps_start_a_new_frame():
+    assert modbus.coalesce_writes([(4, 1, True), (6, 2, True), (7, 3, True)]) == [[4, [1], True, 1], [6, [2, 3], True, 2]]
+
+
+def test_overlapping_writes_stay_separate_and_in_order():
+    # Merging would have to drop one value; two frames keep the last write winning on the slave
+    assert modbus.coalesce_writes([(4, 1, True), (4, 2, True)]) == [[4, [1], True, 1], [4, [2], True, 1]]
+    assert modbus.coalesce_writes([(4, 1, True), (5, 2, True), (4, 3, True)]) == [[4, [1, 2], True, 2], [4, [3], True, 1]]
+
+
+def test_triggers_are_never_merged():
+    writes = [(COMMANDS["coins"], 5, True), (COMMANDS["menu"], 2, True), (COMMANDS["start"], 1, False), (2, 0, True)]
+    assert modbus.coalesce_writes(writes) == [[4, [5, 2], True, 2], [1, [1], False, 1], [2, [0], True, 1]]
+    assert modbus.coalesce_writes([(1, 1, False), (2, 1, False)]) == [[1, [1], False, 1], [2, [1], False, 1]]
+
+
+def test_vend_goes_out_as_two_frames():
+    client = FakeClient()
+    machine = register_map.Machine(register_map.WASH, client)
+    result = machine.run_transaction([{"key": "coins", "value": 4}, {"key": "menu", "value": 3}, {"key": "start"}])
+    assert result == {"status": "success", "message": "Transaction of 3 steps sent.", "completed": 3, "frames": 2}
+    assert client.writes == [(COMMANDS["coins"], [4, 3]), (COMMANDS["start"], [1])]
+
+
+def test_failure_stops_the_transaction():
+    client = FakeClient(fail_at=1)
+    machine = register_map.Machine(register_map.WASH, client)
+    result = machine.run_transaction([{"key": "coins", "value": 4}, {"key": "menu", "value": 3}, {"key": "start"}])
+    # Coins and program failed together, so start never goes out
+    assert result["status"] == "error"
+    assert (result["completed"], result["frames"]) == (0, 1)
+    assert client.writes == [(COMMANDS["coins"], [4, 3])]
+
+
+def test_failure_mid_transaction_reports_completed_steps():
+    client = FakeClient(fail_at=2)
+    machine = register_map.Machine(register_map.WASH, client)
+    result = machine.run_transaction([{"key": "menu", "value": 3}, {"key": "start"}, {"key": "command", "address": 30, "value": 7}])
+    assert result == {"status": "error", "message": "Transaction failed at step 2.", "completed": 1, "frames": 2}
+    assert len(client.writes) == 2
+
+
+@pytest.mark.parametrize("steps", [
+    [{"key": "menu", "value": 99}, {"key": "start"}],
+    [{"key": "coins", "value": 70000}],
+    [{"key": "start"}, {"key": "dance"}],
+    [{"key": "command", "address": 30}],
+])
+def test_invalid_step_sends_nothing(steps):
+    client = FakeClient()
+    machine = register_map.Machine(register_map.WASH, client)
+    assert machine.run_transaction(steps)["status"] == "error"
+    assert client.writes == []
@@ -0,0 +1,66 @@
+"""CRC16 benchmark: the old bit-by-bit calculate_crc16 against the table-driven one in modbus.py.
+
+Run on the host from the repository root:
+
+    python tools/bench_crc.py
+    python tools/bench_crc.py --frames 2000 --seed 1
+
+Random frames of the sizes the bus actually carries (an FC03 request, a 40-register FC03
+response, the largest RTU frame) are checked with each implementation; the incremental
+case feeds the response in UART-sized chunks through modbus.update() as the decoder does.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import modbus_sim  # noqa: E402
+
+FRAME_SIZES = (("FC03 request", 6), ("40-register response", 83), ("max frame", 254))
+CHUNK_SIZE = 16
+
+
+def random_frames(count, size, rng):
+    return [bytes(rng.getrandbits(8) for _ in range(size)) for _ in range(count)]
+
+
+def time_per_frame(fn, frames):
+    started = time.perf_counter()
+    for frame in frames:
+        fn(frame)
+    return (time.perf_counter() - started) / len(frames) * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    modbus_sim.install(modbus_sim.SimulatedBus())
+    import legacy_modbus
+    import modbus
+
+    def chunked(frame):
+        crc = modbus.CRC_INIT
+        view = memoryview(frame)
+        for i in range(0, len(frame), CHUNK_SIZE):
+            crc = modbus.update(crc, view[i:i + CHUNK_SIZE])
+        return crc
+
+    rng = random.Random(args.seed)
+    print(f"{'frame':22} {'bytes':>5} {'bitwise us':>11} {'table us':>9} {'chunked us':>11} {'speedup':>8}")
+    for name, size in FRAME_SIZES:
+        frames = random_frames(args.frames, size, rng)
+        for frame in frames:
+            assert legacy_modbus.calculate_crc16(frame) == modbus.calculate_crc16(frame) == chunked(frame).to_bytes(2, "little")
+        old = time_per_frame(legacy_modbus.calculate_crc16, frames)
+        new = time_per_frame(modbus.calculate_crc16, frames)
+        incremental = time_per_frame(chunked, frames)
+        print(f"{name:22} {size:5} {old:11.1f} {new:9.1f} {incremental:11.1f} {old / new:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
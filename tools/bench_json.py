@@ -0,0 +1,124 @@
+"""Payload benchmark: the old ujson string round trip against native dicts, per status poll and per command.
+
+Run on the host from the repository root:
+
+    python tools/bench_json.py
+    python tools/bench_json.py --iterations 5000
+
+The original wash.py / dryer.py returned ujson.dumps(result) and main.py parsed it back with
+json.loads() to embed it in its own payload, which it then dumped again: three JSON passes and a
+throwaway string + dict per poll and per command. Now the device module returns the dict and the
+payload is dumped once at the MQTT edge. Both paths build the same payload as publish_status()
+and interpret_command() from a real decoded status / command result (a simulated wash machine on
+tools/modbus_sim.py, no wire time). Reported per call:
+  - us: CPU time of building the payload bytes (the Modbus read itself is not included)
+  - heap: the most heap the call holds at once, from tracemalloc, which is what decides a
+    MemoryError on the ESP32. On the MicroPython Unix port, which has no peak tracking, it is
+    every byte the call allocates (gc.mem_alloc() growth with the collector off).
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import modbus_sim  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ENVELOPE = {"version": 3.2, "app": "wash", "device_type": "wash", "error_status": False, "ip": "192.168.1.50", "client_id": "a1b2c3d4e5f6"}
+VEND_STEPS = [{"key": "coins", "value": 5}, {"key": "menu", "value": 3}, {"key": "start"}]
+
+
+def legacy_status(status):
+    return json.dumps(dict(ENVELOPE, status=json.loads(json.dumps(status)))).encode()
+
+
+def native_status(status):
+    return json.dumps(dict(ENVELOPE, status=status)).encode()
+
+
+def legacy_response(result):
+    return json.dumps({"status": "success", "version": 3.2, "message": "Transaction sent.", "modbus_response": json.loads(json.dumps(result))}).encode()
+
+
+def native_response(result):
+    return json.dumps({"status": "success", "version": 3.2, "message": "Transaction sent.", "modbus_response": result}).encode()
+
+
+def time_per_call(fn, arg, iterations):
+    fn(arg)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.perf_counter() - started) / iterations * 1000000
+
+
+def heap_per_call(fn, arg, iterations):
+    """ Heap one call needs: the tracemalloc peak above the starting point on CPython, the bytes
+        allocated with the collector off on MicroPython (no peak tracking there) """
+    fn(arg)
+    gc.collect()
+    if tracemalloc is None:
+        gc.disable()
+        try:
+            before = gc.mem_alloc()
+            for _ in range(iterations):
+                fn(arg)
+            return (gc.mem_alloc() - before) // iterations
+        finally:
+            gc.enable()
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(iterations):
+            start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn(arg)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+        return peak
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    bus = modbus_sim.SimulatedBus()
+    modbus_sim.install(bus, realtime=False)
+    import modbus
+    import register_map
+    bus.add(modbus_sim.SimulatedMachine(register_map.WASH))
+    device = register_map.Machine(register_map.WASH, modbus.ModbusRTUClient())
+
+    status = dict(device.get_machine_status())
+    transaction = device.run_transaction(VEND_STEPS)
+    assert status["message"] == "success" and transaction["status"] == "success"
+    assert json.loads(legacy_status(status)) == json.loads(native_status(status))
+    assert json.loads(legacy_response(transaction)) == json.loads(native_response(transaction))
+
+    print(f"{'payload':18} {'bytes':>6} {'path':7} {'us':>8} {'heap B':>7}")
+    for name, arg, legacy, native in (
+        ("status poll", status, legacy_status, native_status),
+        ("command response", transaction, legacy_response, native_response),
+    ):
+        size = len(native(arg))
+        rows = []
+        for path, fn in (("ujson", legacy), ("native", native)):
+            us = time_per_call(fn, arg, args.iterations)
+            heap = heap_per_call(fn, arg, min(args.iterations, 200))
+            rows.append((us, heap))
+            print(f"{name:18} {size:6} {path:7} {us:8.1f} {heap:7}")
+        (old_us, old_heap), (new_us, new_heap) = rows
+        print(f"{'':18} {'':6} {'saved':7} {old_us - new_us:8.1f} {old_heap - new_heap:7}  ({old_us / new_us:.1f}x CPU)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""End-to-end Modbus benchmarks against the simulated bus in tools/modbus_sim.py.
+
+Run on the host from the repository root:
+
+    python tools/bench_modbus.py
+    python tools/bench_modbus.py --iterations 500 --slaves 4
+    python tools/bench_modbus.py --crc 0.02 --drop 0.01 --exception 0.01 --seed 1
+    python tools/bench_modbus.py --instant      # no wire time, host-side decoding cost only
+
+Every case reports p50/p99 latency, the share of calls that succeeded and frames per second
+(request and response frames seen on the simulated bus). With more than one slave the cases
+rotate over the slaves the way status_loop does.
+
+The last table puts the old wash.py client (tools/legacy_modbus.py: fixed sleep_ms(100) after
+every request, then a polling read loop) next to modbus.py, which returns as soon as the frame
+is complete or t3.5 of line silence ends it, on a long and a short read from slave 1.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import modbus_sim  # noqa: E402
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_case(name, bus, iterations, call):
+    """ call(i) -> truthy on success. Returns one result row """
+    latencies = []
+    ok = 0
+    frames_before = bus.stats["requests"] + bus.stats["responses"]
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        if call(i):
+            ok += 1
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    frames = bus.stats["requests"] + bus.stats["responses"] - frames_before
+    latencies.sort()
+    return {
+        "name": name,
+        "n": iterations,
+        "ok": ok / iterations * 100,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "fps": frames / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--slaves", type=int, default=1, help="simulated machines on the bus, wash/dryer alternating")
+    parser.add_argument("--exception", type=float, default=0.0, help="probability of an exception response")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability of no response")
+    parser.add_argument("--crc", type=float, default=0.0, help="probability of a corrupted CRC")
+    parser.add_argument("--truncate", type=float, default=0.0, help="probability of a cut-off response")
+    parser.add_argument("--turnaround-ms", type=float, default=5.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--instant", action="store_true", help="deliver responses without wire time")
+    parser.add_argument("--compare-iterations", type=int, default=20, help="reads per case in the sleep_ms(100) vs t3.5 table")
+    args = parser.parse_args()
+
+    faults = modbus_sim.Faults(args.exception, args.drop, args.crc, args.truncate, args.turnaround_ms, args.jitter_ms, args.seed)
+    bus = modbus_sim.SimulatedBus(faults)
+    modbus_sim.install(bus, realtime=not args.instant)
+
+    import register_map
+    from modbus import ModbusRTUClient
+
+    client = ModbusRTUClient()
+    machines = []
+    for i in range(args.slaves):
+        model = register_map.WASH if i % 2 == 0 else register_map.DRYER
+        bus.add(modbus_sim.SimulatedMachine(model, slave=1 + i))
+        machines.append(register_map.Machine(model, client, 1 + i))
+
+    def pick(i):
+        return machines[i % len(machines)]
+
+    cases = [
+        ("read_holding_registers", lambda i: pick(i).read_status_registers() is not None),
+        ("get_machine_status", lambda i: pick(i).get_machine_status()["error"] is False),
+        ("add_coins", lambda i: pick(i).add_coins(1)["status"] == "success"),
+        ("select_program", lambda i: pick(i).select_program(i % 10)["status"] == "success"),
+        ("start_operation", lambda i: pick(i).start_operation()["status"] == "success"),
+        ("stop_operation", lambda i: pick(i).stop_operation()["status"] == "success"),
+        ("run_transaction", lambda i: pick(i).run_transaction([{"key": "menu", "value": i % 10}, {"key": "coins", "value": 5}, {"key": "start"}])["status"] == "success"),
+    ]
+
+    print(f"{'case':24} {'n':>5} {'ok %':>6} {'p50 ms':>8} {'p99 ms':>8} {'frames/s':>9}")
+    for name, call in cases:
+        row = run_case(name, bus, args.iterations, call)
+        print(f"{row['name']:24} {row['n']:5} {row['ok']:6.1f} {row['p50']:8.2f} {row['p99']:8.2f} {row['fps']:9.1f}")
+    print("bus: " + ", ".join(f"{key} {value}" for key, value in bus.stats.items()))
+    print("client: " + ", ".join(f"{key} {value}" for key, value in client.stats.items()) + f", exception codes {client.exception_codes}")
+
+    import legacy_modbus
+    legacy = legacy_modbus.ModbusRTUClient()
+    print()
+    print(f"{'response wait':24} {'registers':>9} {'sleep_ms(100) p50':>18} {'t3.5 p50':>9} {'saved ms':>9}")
+    for start, quantity in ((20, 40), (20, 4)):
+        old = run_case("legacy", bus, args.compare_iterations, lambda i: legacy.read_holding_registers(start, quantity) is not None)
+        new = run_case("modbus.py", bus, args.compare_iterations, lambda i: client.read_holding_registers(start, quantity, 1) is not None)
+        print(f"{'read_holding_registers':24} {quantity:9} {old['p50']:18.2f} {new['p50']:9.2f} {old['p50'] - new['p50']:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Status traffic benchmark: MQTT bytes per hour over a recorded wash cycle, per publishing strategy.
+
+Run on the host from the repository root:
+
+    python tools/bench_status.py
+    python tools/bench_status.py --hours 4 --program 3
+
+main.py (app.py) runs in tools/main_sim.py against a simulated wash machine (tools/modbus_sim.py) on a
+virtual clock, so an hour replays in a few seconds. The recorded cycle, repeated every hour: idle
+for 10 minutes, a vend (coins, program, start), the program run with door locking and the
+countdown, then idle until the hour is over. Strategies compared:
+  - full JSON every 5 s: the original main loop, one complete status per poll
+  - delta JSON every 5 s: StatusDeltaPublisher (keyframe + changed fields) at the old fixed rate
+  - delta JSON, adaptive: the default now, publish_status() driven by PollScheduler
+  - binary, adaptive: status_format "binary", status_codec blocks only when the registers change
+Sizes are whole MQTT PUBLISH packets (fixed header, topic, payload) at QoS0.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import main_sim  # noqa: E402
+import modbus_sim  # noqa: E402
+
+modbus_sim.install_time_shims()
+
+IDLE_BEFORE_VEND_S = 10 * 60
+FIXED_POLL_S = 5
+
+
+def publish_size(topic, payload):
+    """ Bytes of an MQTT 3.1.1 QoS0 PUBLISH: fixed header with varint length, topic length + topic, payload """
+    remaining = 2 + len(topic) + len(payload)
+    length_bytes = 1
+    while remaining >= 128 ** length_bytes:
+        length_bytes += 1
+    return 1 + length_bytes + remaining
+
+
+class VirtualClock:
+    """ Drives time.ticks_ms() (app.py, controller.py) and the simulated machine from one counter in seconds """
+
+    def __init__(self):
+        self.now = 0.0
+        self.real_ticks_ms = time.ticks_ms
+
+    def __call__(self):
+        return self.now
+
+    def install(self):
+        time.ticks_ms = lambda: int(self.now * 1000)
+
+    def restore(self):
+        time.ticks_ms = self.real_ticks_ms
+
+
+def vend(slot, program):
+    device = slot.device
+    device.add_coins(5)
+    device.select_program(program)
+    device.start_operation()
+    slot.scheduler.kick()
+
+
+def replay(strategy, hours, program):
+    """ Replay the cycle `hours` times under one strategy. Returns (messages, bytes) """
+    clock = VirtualClock()
+    sim = main_sim.Simulation(tempfile.mkdtemp(prefix="bench-status-"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        main = sim.boot()
+    # The firmware modules only import once main_sim has installed its fakes
+    from controller import MIN_POLL_INTERVAL
+    sim.bus.add(modbus_sim.SimulatedMachine(main.wash.MODEL, speedup=1.0, clock=clock))
+    main.status_format = "binary" if strategy == "binary" else "json"
+    slot = main.machine_slots[0]
+    clock.install()
+    try:
+        messages = size = 0
+        start = len(sim.broker.published)
+        end = hours * 3600
+        vends = [hour * 3600 + IDLE_BEFORE_VEND_S for hour in range(hours)]
+        slot.scheduler.due = 0
+        while clock.now < end:
+            if vends and clock.now >= vends[0]:
+                vends.pop(0)
+                vend(slot, program)
+            if strategy == "full":
+                status = slot.device.get_machine_status()
+                payload = {"version": 3.2, "app": "wash", "device_type": "wash", "error_status": False,
+                           "ip": "192.168.4.1", "client_id": main.MQTT_CLIENT_ID, "status": status}
+                messages += 1
+                size += publish_size(slot.status_topic, json.dumps(payload).encode())
+                clock.now += FIXED_POLL_S
+                continue
+            registers = asyncio.run(main.publish_status(slot))
+            if strategy == "delta-fixed":
+                clock.now += FIXED_POLL_S
+                continue
+            slot.scheduler.schedule(registers)
+            due = slot.scheduler.due / 1000
+            clock.now = min(max(due, clock.now + MIN_POLL_INTERVAL), vends[0] if vends else end)
+        for topic, payload, _, _ in sim.broker.published[start:]:
+            messages += 1
+            size += publish_size(topic, payload)
+        return messages, size
+    finally:
+        clock.restore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=int, default=1)
+    parser.add_argument("--program", type=int, default=2, help="program number of each vend (run time 20 + 5 x program minutes)")
+    args = parser.parse_args()
+
+    cases = (
+        ("full JSON every 5 s", "full"),
+        ("delta JSON every 5 s", "delta-fixed"),
+        ("delta JSON, adaptive", "delta"),
+        ("binary, adaptive", "binary"),
+    )
+    print(f"{'strategy':24} {'messages/h':>10} {'bytes/h':>9} {'vs full':>8}")
+    baseline = None
+    for name, strategy in cases:
+        messages, size = replay(strategy, args.hours, args.program)
+        per_hour = size / args.hours
+        baseline = baseline or per_hour
+        print(f"{name:24} {messages / args.hours:10.0f} {per_hour:9.0f} {per_hour / baseline * 100:7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Precompile the firmware library modules to .mpy and optionally deploy them to a board.
+
+Run on the host from the repository root (needs mpy-cross matching the board's MicroPython
+version, and mpremote for --deploy):
+
+    python tools/build_mpy.py --device wash --out dist-mpy/wash
+    python tools/build_mpy.py --device dryer --out dist-mpy/dryer --deploy /dev/ttyUSB0
+
+boot.py and main.py stay as source (MicroPython only runs them as .py), so main.py is only a stub
+that imports app. MicroPython imports
+foo.py in preference to foo.mpy, so --deploy removes the .py copy of every module it installs.
+"""
+import argparse
+import os
+import subprocess
+
+# (module name on the device, source file)
+MPY_MODULES = [
+    ("modbus", "modbus.py"),
+    ("register_map", "register_map.py"),
+    ("config_store", "config_store.py"),
+    ("status_codec", "status_codec.py"),
+    ("ota", "ota.py"),
+    ("wifi_manager", "wifi_manager.py"),
+    ("wifi_portal", "wifi_portal.py"),
+    ("controller", "controller.py"),
+    ("app", "app.py"),
+]
+DEVICE_SOURCES = {"wash": "wash.py", "dryer": "dryer.py"}
+SOURCE_FILES = ["boot.py", "main.py"]
+
+
+def build(device, out_dir, mpy_cross="mpy-cross", march=None):
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = []
+    for module, source in MPY_MODULES + [("wash", DEVICE_SOURCES[device])]:
+        target = os.path.join(out_dir, module + ".mpy")
+        cmd = [mpy_cross, "-o", target, "-s", module + ".py"]
+        if march:
+            cmd.append("-march=" + march)
+        subprocess.run(cmd + [source], check=True)
+        outputs.append((module, target))
+        print(f"{source:16} -> {target} ({os.path.getsize(target)} bytes)")
+    return outputs
+
+
+def deploy(port, outputs):
+    def mpremote(*args, check=True):
+        return subprocess.run(["mpremote", "connect", port] + list(args), check=check)
+
+    for module, target in outputs:
+        mpremote("cp", target, ":" + module + ".mpy")
+        # A leftover .py would shadow the .mpy
+        mpremote("rm", ":" + module + ".py", check=False)
+    for source in SOURCE_FILES:
+        mpremote("cp", source, ":" + source)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--device", choices=sorted(DEVICE_SOURCES), default="wash")
+    parser.add_argument("--out", default="dist-mpy/wash")
+    parser.add_argument("--mpy-cross", default="mpy-cross")
+    parser.add_argument("--march", help="e.g. xtensawin for ESP32 native code")
+    parser.add_argument("--deploy", metavar="PORT", help="serial port of the board to install on")
+    args = parser.parse_args()
+    outputs = build(args.device, args.out, args.mpy_cross, args.march)
+    if args.deploy:
+        deploy(args.deploy, outputs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Pre-render the captive portal page (tools/portal/index.html) into portal.bin for the device.
+
+Run on the host from the repository root after editing the page:
+
+    python tools/build_portal.py
+    python tools/build_portal.py --check     # also inflate the result with a sample SSID list
+
+The page is split at <!--SSID_OPTIONS--> and both halves are compressed ahead of time into raw
+deflate blocks. On the device wifi_portal.handle_root() streams:
+
+    gzip header + head blocks | one stored block with the <option> list | tail blocks | gzip trailer
+
+so it never compresses anything itself. The head blocks end on a sync flush (non-final, byte
+aligned) and the tail is a separate deflate stream, so the stored block fits between them.
+The gzip trailer needs the CRC32 of the whole page: the device continues the head's CRC over
+the options and over len(tail) zero bytes, then XORs in TAIL_K = crc32(tail) ^ crc32(zeros),
+which is the tail's contribution independent of what came before it.
+
+portal.bin layout (little endian):
+    <IIIIII  head_len, tail_len, head_crc, head_size, tail_size, tail_k
+    head_len bytes   gzip header + deflated head
+    tail_len bytes   deflated tail (final block)
+"""
+import argparse
+import os
+import struct
+import zlib
+
+MARKER = b"<!--SSID_OPTIONS-->"
+HEADER = "<IIIIII"
+# gzip header: magic, deflate, no flags, mtime 0, max compression, OS unknown
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff"
+
+
+def build(template):
+    head, tail = template.split(MARKER)
+    head_deflate = zlib.compressobj(9, zlib.DEFLATED, -15, 9)
+    head_blocks = head_deflate.compress(head) + head_deflate.flush(zlib.Z_SYNC_FLUSH)
+    tail_deflate = zlib.compressobj(9, zlib.DEFLATED, -15, 9)
+    tail_blocks = tail_deflate.compress(tail) + tail_deflate.flush(zlib.Z_FINISH)
+    tail_k = zlib.crc32(tail) ^ zlib.crc32(bytes(len(tail)))
+    head_part = GZIP_HEADER + head_blocks
+    header = struct.pack(HEADER, len(head_part), len(tail_blocks), zlib.crc32(head), len(head), len(tail), tail_k)
+    return header + head_part + tail_blocks
+
+
+def render(asset, options):
+    """ What the device sends for a given <option> list, built the same way as wifi_portal.handle_root() """
+    head_len, tail_len, crc, head_size, tail_size, tail_k = struct.unpack_from(HEADER, asset)
+    offset = struct.calcsize(HEADER)
+    head_part = asset[offset:offset + head_len]
+    tail_blocks = asset[offset + head_len:offset + head_len + tail_len]
+    crc = zlib.crc32(bytes(tail_size), zlib.crc32(options, crc)) ^ tail_k
+    stored = b"\x00" + struct.pack("<HH", len(options), len(options) ^ 0xFFFF) + options
+    trailer = struct.pack("<II", crc & 0xFFFFFFFF, (head_size + len(options) + tail_size) & 0xFFFFFFFF)
+    return head_part + stored + tail_blocks + trailer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--template", default=os.path.join("tools", "portal", "index.html"))
+    parser.add_argument("--out", default="portal.bin")
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.template, "rb") as f:
+        template = f.read()
+    asset = build(template)
+    with open(args.out, "wb") as f:
+        f.write(asset)
+    print(f"{args.template}: {len(template)} bytes -> {args.out}: {len(asset)} bytes")
+
+    if args.check:
+        import gzip
+        options = b'<option value="HomeWiFi">&nbsp;HomeWiFi</option>\n<option value="Shop">&nbsp;Shop</option>\n'
+        page = gzip.decompress(render(asset, options))
+        assert page == template.replace(MARKER, options), "rendered page does not match the template"
+        print("check ok: page inflates to the template with the options inserted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""The Modbus RTU client as it was in wash.py/dryer.py before modbus.py, kept verbatim as a reference.
+
+Used by the host tests and benchmarks to compare against the old behaviour: bit-by-bit CRC,
+fixed sleep_ms(100) after each request and a read loop that re-checks the whole buffer.
+Needs a `machine` module with a UART before import (see modbus_sim.install()).
+"""
+import machine
+import time
+
+RS485_TX_PIN = 17
+RS485_RX_PIN = 16
+
+# การตั้งค่า Modbus RTU (ตามเอกสาร)
+MODBUS_BAUDRATE = 9600
+MODBUS_DATA_BITS = 8
+MODBUS_STOP_BITS = 1
+MODBUS_PARITY = None # None Parity check
+MODBUS_SLAVE_ADDRESS = 1 # Station number: 1-247, สมมติเป็น 1
+
+# ฟังก์ชันสำหรับ CRC16 (ตามมาตรฐาน Modbus RTU)
+def calculate_crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x0001:
+                crc >>= 1
+                crc ^= 0xA001
+            else:
+                crc >>= 1
+    return crc.to_bytes(2, 'little')
+
+class ModbusRTUClient:
+    def __init__(self, uart_id=MODBUS_SLAVE_ADDRESS, tx_pin=RS485_TX_PIN, rx_pin=RS485_RX_PIN):
+        self.uart = machine.UART(uart_id,baudrate=MODBUS_BAUDRATE, tx=tx_pin, rx=rx_pin,bits=MODBUS_DATA_BITS, stop=MODBUS_STOP_BITS,parity=MODBUS_PARITY)
+        self.slave_address = MODBUS_SLAVE_ADDRESS
+        time.sleep_ms(100) # รอให้ UART พร้อม
+
+    def _send_modbus_request(self, slave_address, function_code, start_address, quantity_or_value):
+        # สร้าง PDU (Protocol Data Unit)
+        pdu = bytearray([function_code])
+        pdu.extend(start_address.to_bytes(2, 'big'))
+        if function_code == 0x03: # Read Holding Registers
+            pdu.extend(quantity_or_value.to_bytes(2, 'big'))
+        elif function_code == 0x10: # Write Multiple Registers (quantity_or_value คือจำนวน registers)
+            num_registers = quantity_or_value
+            pdu.extend(num_registers.to_bytes(2, 'big'))
+            # ส่วนของ byte_count และ actual data จะถูกเพิ่มในฟังก์ชัน write_multiple_registers
+        else:
+            raise ValueError("Unsupported function code for _send_modbus_request")
+
+        # สร้าง ADU (Application Data Unit)
+        adu = bytearray([slave_address])
+        adu.extend(pdu)
+        adu.extend(calculate_crc16(adu))
+
+        self.uart.write(adu)
+        time.sleep_ms(100) # รอการตอบกลับ
+
+    def _read_modbus_response(self):
+        response = bytearray()
+        start_time = time.ticks_ms()
+        while (time.ticks_ms() - start_time) < 500:
+            if self.uart.any():
+                response.extend(self.uart.read())
+            if len(response) >= 5: # ตรวจสอบความยาวขั้นต่ำ (slave_id + func_code + byte_count/addr + CRC)
+                # สำหรับ Function Code 0x03, response[2] คือจำนวน byte ของข้อมูล
+                # สำหรับ Function Code 0x10, response จะมี fixed length 8 bytes (slave_id + func_code + start_addr + num_regs + CRC)
+                if len(response) >= 3 and response[1] == 0x03 and len(response) >= response[2] + 5:
+                    received_crc = int.from_bytes(response[-2:], 'little')
+                    calculated_crc = int.from_bytes(calculate_crc16(response[:-2]), 'little')
+                    if received_crc == calculated_crc:
+                        return response
+                elif len(response) == 8 and response[1] == 0x10:
+                    received_crc = int.from_bytes(response[-2:], 'little')
+                    calculated_crc = int.from_bytes(calculate_crc16(response[:-2]), 'little')
+                    if received_crc == calculated_crc:
+                        return response
+                elif len(response) > 2 and (response[1] & 0x80): # Check for Modbus Exception Response
+                    # Exception response: Slave ID (1) + Func Code with error bit (1) + Exception Code (1) + CRC (2) = 5 bytes
+                    if len(response) == 5:
+                        received_crc = int.from_bytes(response[-2:], 'little')
+                        calculated_crc = int.from_bytes(calculate_crc16(response[:-2]), 'little')
+                        if received_crc == calculated_crc:
+                            #print(f"Modbus Exception: Code {response[2]}")
+                            return None # Return None for exception responses
+                else:
+                    # Not enough data yet or unknown response type, keep reading or timeout
+                    pass
+        #print("No response or timeout.")
+        return None
+
+    def read_holding_registers(self, start_address, quantity):
+        """ อ่าน Holding Registers (Function Code: 0x03) """
+        self._send_modbus_request(self.slave_address, 0x03, start_address, quantity)
+        response = self._read_modbus_response()
+        if response and response[1] == 0x03: # ตรวจสอบว่าเป็น response สำหรับ 0x03
+            # response format: slave_id (1 byte) + func_code (1 byte) + byte_count (1 byte) + data (N bytes) + CRC (2 bytes)
+            # ข้อมูลเริ่มต้นที่ byte ที่ 3 (index 3)
+            data_bytes = response[3:-2]
+            # แปลง data_bytes เป็น list ของ integers (word)
+            registers = []
+            for i in range(0, len(data_bytes), 2):
+                registers.append(int.from_bytes(data_bytes[i:i+2], 'big'))
+            return registers
+        return None
+
+    def write_multiple_registers(self, start_address, values):
+        """ เขียน Multiple Registers (Function Code: 0x10) """
+        byte_count = len(values) * 2
+        pdu = bytearray([0x10]) # Function Code: 0x10
+        pdu.extend(start_address.to_bytes(2, 'big'))
+        pdu.extend(len(values).to_bytes(2, 'big')) # จำนวน Registers
+        pdu.extend(byte_count.to_bytes(1, 'big')) # จำนวน Bytes
+        for value in values:
+            pdu.extend(value.to_bytes(2, 'big'))
+
+        # สร้าง ADU (Application Data Unit)
+        adu = bytearray([self.slave_address])
+        adu.extend(pdu)
+        adu.extend(calculate_crc16(adu))
+
+        self.uart.write(adu)
+        response = self._read_modbus_response()
+        if response and response[1] == 0x10: # ตรวจสอบว่าเป็น response สำหรับ 0x10
+            # สำหรับ Function Code 0x10, response จะเป็น slave_id + func_code + start_addr + num_regs + CRC
+            if len(response) == 8:
+                # ตรวจสอบว่า start_address และ num_regs ใน response ตรงกับที่ส่งไป
+                response_start_addr = int.from_bytes(response[2:4], 'big')
+                response_num_regs = int.from_bytes(response[4:6], 'big')
+                if response_start_addr == start_address and response_num_regs == len(values):
+                    #print("Write successful.")
+                    return True
+        #print("Write failed or no proper response.")
+        return False
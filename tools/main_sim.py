@@ -0,0 +1,306 @@
+"""Run main.py on the host against a simulated WiFi network, MQTT broker and Modbus bus.
+
+Used by the host tests and tools/bench_boot.py; there is no command line:
+
+    sim = main_sim.Simulation(workdir)     # config.bin with one saved network
+    sim.bus.add(modbus_sim.SimulatedMachine(register_map.WASH))
+    main = sim.boot()                      # runs main.py up to asyncio.run(run()), returns app.py
+    sim.broker.up = False                  # kill the broker, True restarts it
+    sim.run(main.supervisor_loop(), until=lambda: main.mqtt_ready.is_set())
+
+Fakes installed before main.py is executed:
+  - `machine` from modbus_sim.install() (UART on sim.bus), with reset() raising DeviceReset
+  - `network` with portal_sim.FakeWLAN; SSID in sim.networks
+  - `umqtt.simple.MQTTClient` talking to sim.broker (FakeBroker): connect/publish/ping raise OSError
+    while the broker is down or a fault is armed, every publish is recorded; with lose_pubacks a
+    QoS1 publish reads its socket like umqtt does and a socket without a timeout never returns
+  - `ubinascii` whose strings concatenate with bytes the way MicroPython's do
+The firmware's time.sleep() and asyncio.sleep() are recorded in sim.sleeps / sim.async_sleeps and
+scaled by sleep_scale (0 = no waiting), everything else runs on real time.
+"""
+import asyncio as real_asyncio
+import binascii
+import importlib.util
+import os
+import sys
+import time as real_time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import modbus_sim  # noqa: E402  (ROOT on sys.path, MicroPython time shims)
+import portal_sim  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Firmware modules re-imported fresh for every Simulation
+FIRMWARE_MODULES = ("main", "app", "controller", "wash", "modbus", "register_map", "config_store", "status_codec", "ota", "wifi_manager", "wifi_portal")
+SSID = "HomeWiFi"
+PASSWORD = "secret123"
+
+
+class DeviceReset(BaseException):
+    """ Raised by the fake machine.reset() """
+
+
+class MainLoopReached(BaseException):
+    """ Raised by the fake asyncio.run() to stop main.py where its event loop would start """
+
+
+class SocketBlockedForever(BaseException):
+    """ Raised by FakeSocket for a blocking read without a timeout that no data will ever end """
+
+
+class FakeSocket:
+    """ MicroPython socket semantics for the reads umqtt makes while it waits for an ack:
+        non-blocking returns None, with a timeout it raises ETIMEDOUT, fully blocking never returns """
+
+    def __init__(self):
+        self.timeout = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def setblocking(self, flag):
+        self.timeout = None if flag else 0
+
+    def read(self, n):
+        if self.timeout == 0:
+            return None
+        if self.timeout is None:
+            raise SocketBlockedForever()
+        raise OSError(110, "ETIMEDOUT")
+
+    def write(self, data, length=None):
+        return len(data) if length is None else length
+
+    def close(self):
+        pass
+
+
+class FakeBroker:
+    """ One MQTT broker. up=False refuses connects and drops every open client on its next call;
+        fail_publishes=n makes the next n publishes raise OSError (a half-dead link after connect). """
+
+    def __init__(self):
+        self.up = True
+        self.fail_publishes = 0
+        # QoS1 publishes get no PUBACK (a half-open link): the client waits on its socket
+        self.lose_pubacks = False
+        self.connects = 0
+        self.published = [] # (topic, payload, qos, ticks_ms)
+        self.subscriptions = []
+        self.inbox = [] # (topic, payload) delivered on the next check_msg()
+
+    def publish_to_device(self, topic, payload):
+        self.inbox.append((topic, payload))
+
+    def topics(self, suffix=b""):
+        return [topic for topic, _, _, _ in self.published if topic.endswith(suffix)]
+
+
+class FakeMQTTClient:
+    """ The parts of umqtt.simple.MQTTClient that main.py uses """
+
+    broker = None
+
+    def __init__(self, client_id, server, port=0, keepalive=0, **kwargs):
+        self.client_id = client_id
+        self.server = server
+        self.callback = None
+        self.connected = False
+        self.sock = None
+
+    def _check(self):
+        if not self.connected or not self.broker.up:
+            self.connected = False
+            raise OSError(104, "ECONNRESET")
+
+    def set_callback(self, callback):
+        self.callback = callback
+
+    def connect(self, clean_session=True):
+        if not self.broker.up:
+            raise OSError(113, "EHOSTUNREACH")
+        self.broker.connects += 1
+        self.connected = True
+        self.sock = FakeSocket()
+        return 0
+
+    def disconnect(self):
+        self.connected = False
+
+    def subscribe(self, topic, qos=0):
+        self._check()
+        self.broker.subscriptions.append(topic)
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self._check()
+        if self.broker.fail_publishes:
+            self.broker.fail_publishes -= 1
+            self.connected = False
+            raise OSError(110, "ETIMEDOUT")
+        if qos and self.broker.lose_pubacks:
+            # umqtt's wait_msg() for the PUBACK
+            self.sock.read(1)
+        self.broker.published.append((bytes(topic), bytes(msg), qos, real_time.ticks_ms()))
+
+    def ping(self):
+        self._check()
+
+    def check_msg(self):
+        self._check()
+        # umqtt polls non-blocking, then wait_msg() switches back to blocking
+        self.sock.setblocking(False)
+        self.sock.read(1)
+        self.sock.setblocking(True)
+        if self.broker.inbox:
+            topic, payload = self.broker.inbox.pop(0)
+            self.callback(topic, payload)
+
+
+class _MicroPythonStr(str):
+    """ str that concatenates with bytes, as MicroPython allows (b"topic/" + client_id) """
+
+    def __radd__(self, other):
+        if isinstance(other, (bytes, bytearray)):
+            return other + self.encode()
+        return _MicroPythonStr(str(other) + str(self))
+
+    def upper(self):
+        return _MicroPythonStr(str.upper(self))
+
+
+class _HexBytes(bytes):
+    def decode(self, *args):
+        return _MicroPythonStr(bytes.decode(self, *args))
+
+
+class _Proxy(types.ModuleType):
+    """ A module that forwards everything to `target` apart from the attributes set on it """
+
+    def __init__(self, name, target):
+        super().__init__(name)
+        self._target = target
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class Simulation:
+    def __init__(self, workdir, config=None, bus=None, broker=None, realtime_bus=False, sleep_scale=0.0, device_type="wash"):
+        self.workdir = workdir
+        # "dryer" boots with dryer.py installed as wash.py, as on a dryer controller
+        self.device_type = device_type
+        self.config = {"wifi": {SSID: PASSWORD}} if config is None else config
+        self.bus = bus or modbus_sim.SimulatedBus()
+        self.broker = broker or FakeBroker()
+        self.realtime_bus = realtime_bus
+        self.sleep_scale = sleep_scale
+        self.networks = {SSID: PASSWORD}
+        self.sleeps = []
+        self.async_sleeps = []
+        self.main = None
+
+    def _install(self):
+        for name in FIRMWARE_MODULES:
+            sys.modules.pop(name, None)
+        machine = modbus_sim.install(self.bus, realtime=self.realtime_bus)
+
+        def reset():
+            raise DeviceReset()
+
+        machine.reset = reset
+
+        portal_sim.FakeWLAN.networks = self.networks
+        portal_sim.FakeWLAN.scan_seconds = 0.0
+        network = types.ModuleType("network")
+        network.STA_IF = 0
+        network.AP_IF = 1
+        network.WLAN = portal_sim.FakeWLAN
+        sys.modules["network"] = network
+
+        ubinascii = types.ModuleType("ubinascii")
+        ubinascii.hexlify = lambda data: _HexBytes(binascii.hexlify(data))
+        ubinascii.unhexlify = binascii.unhexlify
+        sys.modules["ubinascii"] = ubinascii
+
+        FakeMQTTClient.broker = self.broker
+        umqtt = types.ModuleType("umqtt")
+        simple = types.ModuleType("umqtt.simple")
+        simple.MQTTClient = FakeMQTTClient
+        umqtt.simple = simple
+        sys.modules["umqtt"] = umqtt
+        sys.modules["umqtt.simple"] = simple
+
+        time_proxy = _Proxy("time", real_time)
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            if self.sleep_scale:
+                real_time.sleep(seconds * self.sleep_scale)
+
+        time_proxy.sleep = sleep
+        # MicroPython's time.time() is whole seconds
+        time_proxy.time = lambda: int(real_time.time())
+
+        asyncio_proxy = _Proxy("asyncio", real_asyncio)
+
+        async def async_sleep(seconds):
+            self.async_sleeps.append(seconds)
+            await real_asyncio.sleep(seconds * self.sleep_scale)
+
+        def run(coro):
+            coro.close()
+            raise MainLoopReached()
+
+        asyncio_proxy.sleep = async_sleep
+        asyncio_proxy.run = run
+        return time_proxy, asyncio_proxy
+
+    def boot(self):
+        """ Execute main.py from workdir up to its event loop. Returns the app module it runs """
+        time_proxy, asyncio_proxy = self._install()
+        os.makedirs(self.workdir, exist_ok=True)
+        os.chdir(self.workdir)
+        import config_store
+        config_store._write(self.config)
+        main = types.ModuleType("main")
+        main.__file__ = os.path.join(ROOT, "main.py")
+        sys.modules["main"] = main
+        with open(main.__file__) as f:
+            code = compile(f.read(), main.__file__, "exec")
+        saved = sys.modules["time"], sys.modules.get("asyncio")
+        # main.py and the modules it imports see the proxies; only app.py sleeps through them
+        sys.modules["time"], sys.modules["asyncio"] = time_proxy, asyncio_proxy
+        try:
+            if self.device_type != "wash":
+                spec = importlib.util.spec_from_file_location("wash", os.path.join(ROOT, self.device_type + ".py"))
+                sys.modules["wash"] = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(sys.modules["wash"])
+            exec(code, main.__dict__)
+        except MainLoopReached:
+            pass
+        finally:
+            sys.modules["time"], sys.modules["asyncio"] = saved
+        self.main = sys.modules["app"]
+        return self.main
+
+    def run(self, *coros, until, timeout=10.0):
+        """ Run coroutines (e.g. main.run() or main.supervisor_loop()) until until() is true.
+            Exceptions from the coroutines, DeviceReset included, propagate. """
+        async def driver():
+            tasks = [real_asyncio.ensure_future(coro) for coro in coros]
+            deadline = real_time.monotonic() + timeout
+            try:
+                while not until():
+                    for task in tasks:
+                        if task.done():
+                            task.result()
+                    if real_time.monotonic() > deadline:
+                        raise TimeoutError("simulation did not reach its goal")
+                    await real_asyncio.sleep(0.001)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await real_asyncio.gather(*tasks, return_exceptions=True)
+
+        real_asyncio.run(driver())
@@ -0,0 +1,93 @@
+"""Build the OTA manifest used by the 'update_version' command (ota.update_from_manifest).
+
+Run on the host from the repository root:
+
+    python tools/make_manifest.py --version 3.3 --out dist
+    python tools/make_manifest.py --version 3.3 --out dist --mpy dist-mpy
+
+Writes dist/manifest.json plus one zlib-compressed copy of every firmware file (<name>.z).
+Upload the whole directory next to the manifest URL configured in main.py (OTA_MANIFEST_URL).
+With --mpy, library modules are shipped as the .mpy files built by tools/build_mpy.py
+(build each device type with --out <dir>/wash and --out <dir>/dryer) and the device drops the old .py.
+"""
+import argparse
+import hashlib
+import json
+import os
+import zlib
+
+# (device file name, source file, device type or None for all devices), in install order:
+# libraries first, main.py last so a partial update never boots a main.py newer than its modules.
+FIRMWARE_FILES = [
+    ("modbus.py", "modbus.py", None),
+    ("register_map.py", "register_map.py", None),
+    ("config_store.py", "config_store.py", None),
+    ("status_codec.py", "status_codec.py", None),
+    ("ota.py", "ota.py", None),
+    ("wifi_manager.py", "wifi_manager.py", None),
+    ("wifi_portal.py", "wifi_portal.py", None),
+    ("portal.bin", "portal.bin", None),
+    ("wash.py", "wash.py", "wash"),
+    ("wash.py", "dryer.py", "dryer"),
+    ("controller.py", "controller.py", None),
+    ("app.py", "app.py", None),
+    ("boot.py", "boot.py", None),
+    ("main.py", "main.py", None),
+]
+
+
+# boot.py and main.py always ship as source, portal.bin (tools/build_portal.py) is not a module
+SOURCE_ONLY = ("boot.py", "main.py", "portal.bin")
+
+
+def build(version, out_dir, root=".", mpy_dir=None):
+    os.makedirs(out_dir, exist_ok=True)
+    files = []
+    raw_total = compressed_total = 0
+    for name, source, device_type in FIRMWARE_FILES:
+        replaces = None
+        if mpy_dir and name not in SOURCE_ONLY:
+            # Shared modules are identical in every device build, take them from the wash one
+            replaces = name
+            name = name[:-3] + ".mpy"
+            source = os.path.join(mpy_dir, device_type or "wash", name)
+            url = (device_type + "-" if device_type else "") + name + ".z"
+        else:
+            url = source + ".z"
+            source = os.path.join(root, source)
+        with open(source, "rb") as f:
+            data = f.read()
+        compressed = zlib.compress(data, 9)
+        with open(os.path.join(out_dir, url), "wb") as f:
+            f.write(compressed)
+        entry = {
+            "name": name,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "size": len(data),
+            "url": url,
+            "deflate": True,
+        }
+        if device_type:
+            entry["device_type"] = device_type
+        if replaces:
+            entry["replaces"] = replaces
+        files.append(entry)
+        raw_total += len(data)
+        compressed_total += len(compressed)
+        print(f"{os.path.basename(source):18} -> {name:16} {len(data):7} -> {len(compressed):6} bytes")
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump({"version": version, "files": files}, f, indent=1)
+    print(f"total {raw_total} -> {compressed_total} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--version", required=True)
+    parser.add_argument("--out", default="dist")
+    parser.add_argument("--mpy", metavar="DIR", help="ship library modules as .mpy from DIR/<device>/")
+    args = parser.parse_args()
+    build(args.version, args.out, mpy_dir=args.mpy)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""Host-side Modbus RTU slave simulator behind a fake machine.UART.
+
+Lets modbus.py, register_map.py and wash.py/dryer.py run unchanged on CPython:
+
+    import modbus_sim
+    bus = modbus_sim.SimulatedBus()
+    bus.add(modbus_sim.SimulatedMachine(register_map.WASH, slave=1))
+    modbus_sim.install(bus)          # fake `machine`, MicroPython time.ticks_*/sleep_*, ujson
+    import modbus                    # ModbusRTUClient() now talks to the simulated bus
+
+Each SimulatedMachine emulates the holding registers of a wash or dryer controller from its
+register_map model: program selection, coin counts, program runs with remaining time and
+steps, door locking, and the error block. Faults (exception frames, dropped and corrupted
+frames, slow turnaround) are injected per bus with Faults. Bytes arrive at the configured
+baud rate so the client's t1.5/t3.5 timing and chunked decoding run as on the device.
+"""
+import json
+import os
+import random
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+REGISTER_SPACE = 128
+# Modbus exception codes
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+SLAVE_DEVICE_BUSY = 6
+
+RUN_STANDBY = 1
+RUN_AUTORUN = 3
+# Simulated program length, seconds of machine time per program number
+PROGRAM_BASE_SECONDS = 20 * 60
+PROGRAM_STEP_SECONDS = 5 * 60
+LOCKING_SECONDS = 2
+
+
+class Faults:
+    """ Probabilities (0..1) of each fault per request, plus slave turnaround time """
+
+    def __init__(self, exception=0.0, drop=0.0, crc=0.0, truncate=0.0, turnaround_ms=5.0, jitter_ms=0.0, seed=None):
+        self.exception = exception
+        self.drop = drop
+        self.crc = crc
+        self.truncate = truncate
+        self.turnaround_ms = turnaround_ms
+        self.jitter_ms = jitter_ms
+        self.random = random.Random(seed)
+
+    def hit(self, rate):
+        return rate and self.random.random() < rate
+
+
+class SimulatedMachine:
+    """ Holding registers of one wash/dryer controller, driven by its register_map model """
+
+    def __init__(self, model, slave=1, speedup=60.0, clock=time.monotonic):
+        self.model = model
+        self.slave = slave
+        # seconds of machine time per wall-clock second, so a program run fits in a benchmark
+        self.speedup = speedup
+        # seconds, monotonic; pass a virtual clock to replay a cycle faster than real time
+        self.clock = clock
+        self.registers = [0] * REGISTER_SPACE
+        self.base = model["status_start"]
+        self.offsets = {field[0]: field[1] for field in model["fields"]}
+        self.door_names = dict((field[0], field[2]) for field in model["fields"])["door_status"]
+        self.commands = model["commands"]
+        self.remaining = 0.0
+        self.locking = 0.0
+        self.last_tick = clock()
+        self._set("run_status", RUN_STANDBY)
+        self._set("door_status", self._door("closed"))
+        self._set("coins_required_of_currently_selecting_program", 1)
+
+    def _door(self, name):
+        return self.door_names.index(name)
+
+    def _set(self, key, value):
+        self.registers[self.base + self.offsets[key]] = value & 0xFFFF
+
+    def _get(self, key):
+        return self.registers[self.base + self.offsets[key]]
+
+    def set_error(self, code):
+        """ Put the machine into an error state (status reads keep working, error block is filled) """
+        self._set("error_status", 1 if code else 0)
+        error_start = self.model["error_start"]
+        for i in range(self.model["error_count"]):
+            self.registers[error_start + i] = code if i == 0 else 0
+
+    def tick(self):
+        now = self.clock()
+        elapsed = (now - self.last_tick) * self.speedup
+        self.last_tick = now
+        if self._get("run_status") != RUN_AUTORUN:
+            return
+        if self.locking > 0:
+            self.locking -= elapsed
+            if self.locking <= 0:
+                self._set("door_status", self._door("locked"))
+        self.remaining = max(0.0, self.remaining - elapsed)
+        seconds = int(self.remaining)
+        self._set("auto_time_hour", seconds // 3600)
+        self._set("auto_time_min", seconds // 60 % 60)
+        self._set("auto_time_sec", seconds % 60)
+        program = self._get("currently_running_program_number")
+        total = PROGRAM_BASE_SECONDS + program * PROGRAM_STEP_SECONDS
+        self._set("currently_running_step_number", 1 + int((total - self.remaining) // PROGRAM_STEP_SECONDS))
+        if not seconds:
+            self._set("run_status", RUN_STANDBY)
+            self._set("door_status", self._door("closed"))
+            self._set("currently_running_step_number", 0)
+
+    def write(self, address, value):
+        """ Apply one register write the way the controller reacts to it """
+        self.registers[address] = value
+        if address == self.commands["menu"]:
+            self._set("matchine_menu", value)
+            self._set("coins_required_of_currently_selecting_program", 1 + value % 5)
+        elif address == self.commands["coins"]:
+            for key in ("current_coins", "total_coins_recorded", "coins_recorded_in_cash_box"):
+                self._set(key, self._get(key) + value)
+            self._set("coin_inserted", 1)
+        elif address == self.commands["start"] and value:
+            if self._get("run_status") != RUN_AUTORUN and self._get("current_coins") >= self._get("coins_required_of_currently_selecting_program"):
+                program = self._get("matchine_menu")
+                self.remaining = float(PROGRAM_BASE_SECONDS + program * PROGRAM_STEP_SECONDS)
+                self.locking = LOCKING_SECONDS
+                self._set("run_status", RUN_AUTORUN)
+                self._set("door_status", self._door("locking"))
+                self._set("currently_running_program_number", program)
+                self._set("current_coins", 0)
+                self._set("coin_inserted", 0)
+        elif address == self.commands["stop"] and value:
+            self.remaining = 0.0
+            self._set("run_status", RUN_STANDBY)
+            self._set("door_status", self._door("closed"))
+        elif address == self.commands["reset_error"] and value:
+            self.set_error(0)
+
+    def handle(self, request):
+        """ Request PDU (bytes after the slave id, CRC stripped) -> response PDU """
+        self.tick()
+        function_code = request[0]
+        if function_code == 0x03 and len(request) == 5:
+            start = (request[1] << 8) | request[2]
+            quantity = (request[3] << 8) | request[4]
+            if not 1 <= quantity <= 125:
+                return exception_pdu(function_code, ILLEGAL_DATA_VALUE)
+            if start + quantity > REGISTER_SPACE:
+                return exception_pdu(function_code, ILLEGAL_DATA_ADDRESS)
+            pdu = bytearray([0x03, quantity * 2])
+            for value in self.registers[start:start + quantity]:
+                pdu.append(value >> 8)
+                pdu.append(value & 0xFF)
+            return bytes(pdu)
+        if function_code == 0x10 and len(request) >= 6:
+            start = (request[1] << 8) | request[2]
+            quantity = (request[3] << 8) | request[4]
+            if request[5] != quantity * 2 or len(request) != 6 + quantity * 2:
+                return exception_pdu(function_code, ILLEGAL_DATA_VALUE)
+            if start + quantity > REGISTER_SPACE:
+                return exception_pdu(function_code, ILLEGAL_DATA_ADDRESS)
+            for i in range(quantity):
+                self.write(start + i, (request[6 + 2 * i] << 8) | request[7 + 2 * i])
+            return bytes(request[:5])
+        return exception_pdu(function_code, ILLEGAL_FUNCTION)
+
+
+def crc16(data):
+    """ Bitwise Modbus CRC, independent of the table-driven one in modbus.py """
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def exception_pdu(function_code, code):
+    return bytes([function_code | 0x80, code])
+
+
+def with_crc(adu):
+    crc = crc16(adu)
+    return bytes(adu) + bytes([crc & 0xFF, crc >> 8])
+
+
+class SimulatedBus:
+    """ RS-485 bus with any number of simulated slaves and optional fault injection """
+
+    def __init__(self, faults=None):
+        self.machines = {}
+        self.faults = faults or Faults()
+        self.stats = {"requests": 0, "responses": 0, "exceptions": 0, "dropped": 0, "crc_errors": 0, "truncated": 0}
+
+    def add(self, machine):
+        self.machines[machine.slave] = machine
+        return machine
+
+    def respond(self, adu):
+        """ Request ADU -> response ADU, or None when the slave stays silent """
+        self.stats["requests"] += 1
+        if len(adu) < 4 or crc16(adu[:-2]) != (adu[-2] | adu[-1] << 8):
+            return None
+        machine = self.machines.get(adu[0])
+        if machine is None:
+            return None
+        faults = self.faults
+        if faults.hit(faults.drop):
+            self.stats["dropped"] += 1
+            return None
+        if faults.hit(faults.exception):
+            pdu = exception_pdu(adu[1], SLAVE_DEVICE_BUSY)
+        else:
+            pdu = machine.handle(adu[1:-2])
+        if pdu[0] & 0x80:
+            self.stats["exceptions"] += 1
+        response = bytearray(with_crc(bytes([adu[0]]) + pdu))
+        if faults.hit(faults.crc):
+            self.stats["crc_errors"] += 1
+            response[-1] ^= 0xFF
+        if faults.hit(faults.truncate):
+            self.stats["truncated"] += 1
+            response = response[:max(1, len(response) // 2)]
+        self.stats["responses"] += 1
+        return bytes(response)
+
+
+class FakeUART:
+    """ The subset of machine.UART that modbus.ModbusRTUClient uses, wired to a SimulatedBus.
+        Response bytes become readable one character time apart after the slave's turnaround. """
+
+    def __init__(self, bus, baudrate=9600, bits=8, parity=None, stop=1, realtime=True):
+        self.bus = bus
+        # start + data + parity + stop bits per character
+        self.char_s = (1 + bits + (1 if parity is not None else 0) + stop) / baudrate if realtime else 0.0
+        self.realtime = realtime
+        self.tx_done_at = 0.0
+        self.pending = b""
+        self.pending_at = 0.0
+        self.read_pos = 0
+
+    def write(self, buf):
+        data = bytes(buf)
+        now = time.monotonic()
+        self.tx_done_at = now + len(data) * self.char_s
+        response = self.bus.respond(data)
+        self.read_pos = 0
+        if response is None:
+            self.pending = b""
+            return len(data)
+        faults = self.bus.faults
+        turnaround = faults.turnaround_ms + (faults.random.random() * faults.jitter_ms if faults.jitter_ms else 0.0)
+        self.pending = response
+        self.pending_at = self.tx_done_at + (turnaround / 1000 if self.realtime else 0.0)
+        return len(data)
+
+    def flush(self):
+        wait = self.tx_done_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _arrived(self):
+        if not self.pending:
+            return 0
+        elapsed = time.monotonic() - self.pending_at
+        if elapsed < 0:
+            return 0
+        if not self.char_s:
+            return len(self.pending)
+        return min(len(self.pending), int(elapsed / self.char_s) + 1)
+
+    def any(self):
+        return self._arrived() - self.read_pos
+
+    def readinto(self, buf, nbytes=None):
+        available = self.any()
+        if nbytes is not None:
+            available = min(available, nbytes)
+        available = min(available, len(buf))
+        if available <= 0:
+            return None
+        buf[:available] = self.pending[self.read_pos:self.read_pos + available]
+        self.read_pos += available
+        return available
+
+    def read(self, nbytes=None):
+        buf = bytearray(self.any() if nbytes is None else nbytes)
+        n = self.readinto(buf)
+        return bytes(buf[:n]) if n else None
+
+
+def install_time_shims():
+    """ MicroPython's time.ticks_* and sleep_* on top of CPython's time module """
+    if hasattr(time, "ticks_us"):
+        return
+    time.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time.ticks_us = lambda: int(time.monotonic() * 1000000)
+    time.ticks_add = lambda ticks, delta: ticks + delta
+    time.ticks_diff = lambda new, old: new - old
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+
+def install(bus, realtime=True):
+    """ Register a fake `machine` module whose UART talks to bus. Call before importing modbus clients.
+        realtime=False delivers responses instantly, to measure host-side decoding overhead only. """
+    install_time_shims()
+    sys.modules.setdefault("ujson", json)
+    fake = types.ModuleType("machine")
+
+    def make_uart(uart_id, baudrate=9600, bits=8, parity=None, stop=1, **kwargs):
+        return FakeUART(bus, baudrate, bits, parity, stop, realtime)
+
+    class Pin:
+        OUT = 1
+        IN = 0
+
+        def __init__(self, pin, mode=None, value=0):
+            self._value = value
+
+        def value(self, value=None):
+            if value is None:
+                return self._value
+            self._value = value
+
+    fake.UART = make_uart
+    fake.Pin = Pin
+    fake.unique_id = lambda: b"\x00SIMBUS"
+    sys.modules["machine"] = fake
+    return fake
@@ -0,0 +1,206 @@
+"""Local OTA server for testing the 'update_version' command (ota.update_from_manifest) end to end.
+
+Run on the host from the repository root:
+
+    python tools/ota_server.py --version 3.3                    # build into a temp dir, serve on :8000
+    python tools/ota_server.py --dir dist --port 8080
+    python tools/ota_server.py --version 3.3 --corrupt modbus.py.z
+    python tools/ota_server.py --version 3.3 --run /tmp/device  # update a fake device dir, print transfer
+
+Point a device at it with {"key": "update_version", "manifest": "http://<host>:8000/manifest.json"}.
+Every response is counted per path (requests, bytes sent) and printed on Ctrl-C. --corrupt flips
+one byte in the named file as it is served, so the device must refuse it on the sha256 check.
+--run installs a MicroPython-style `requests` and `deflate` on CPython (install_device_shims())
+and runs ota.update_from_manifest against the server from inside the given directory.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import types
+import urllib.error
+import urllib.request
+import zlib
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TOOLS)
+
+
+class OTAServer(ThreadingHTTPServer):
+    """ Serves `directory` and counts what it sends; corrupt: file names served with one byte flipped """
+
+    def __init__(self, directory, port=0, corrupt=()):
+        self.directory = directory
+        self.corrupt = set(corrupt)
+        self.stats = {}
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", port), OTARequestHandler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def count(self, path, sent):
+        with self.lock:
+            entry = self.stats.setdefault(path, {"requests": 0, "bytes": 0})
+            entry["requests"] += 1
+            entry["bytes"] += sent
+
+    def bytes_sent(self):
+        return sum(entry["bytes"] for entry in self.stats.values())
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+class OTARequestHandler(SimpleHTTPRequestHandler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=args[2].directory, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        name = self.path.lstrip("/").split("?")[0]
+        filename = os.path.join(self.server.directory, name)
+        try:
+            with open(filename, "rb") as f:
+                data = bytearray(f.read())
+        except OSError:
+            self.send_error(404)
+            self.server.count(self.path, 0)
+            return
+        if name in self.server.corrupt and data:
+            data[len(data) // 2] ^= 0xFF
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json" if name.endswith(".json") else "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        # Counted before the write so a client that has read the body always sees it counted
+        self.server.count(self.path, len(data))
+        self.wfile.write(data)
+
+
+class _Response:
+    """ The parts of MicroPython's requests.Response that the firmware uses """
+
+    def __init__(self, url, stream):
+        try:
+            self.raw = urllib.request.urlopen(url, timeout=10)
+            self.status_code = self.raw.status
+        except urllib.error.HTTPError as e:
+            self.raw = e
+            self.status_code = e.code
+        self.headers = dict(self.raw.headers)
+        self._content = None if stream else self.raw.read()
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.raw.read()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        self.raw.close()
+
+
+class _DeflateIO(io.RawIOBase):
+    """ deflate.DeflateIO(stream, deflate.ZLIB) on top of zlib """
+
+    def __init__(self, stream, format=None):
+        self.stream = stream
+        self.inflater = zlib.decompressobj()
+        self.pending = b""
+        self.buf = bytearray(256)
+
+    def readinto(self, buf):
+        while not self.pending and not self.inflater.eof:
+            n = self.stream.readinto(self.buf)
+            if not n:
+                self.pending = self.inflater.flush()
+                if not self.inflater.eof:
+                    raise OSError("truncated deflate stream")
+                break
+            self.pending = self.inflater.decompress(bytes(self.buf[:n]))
+        n = min(len(buf), len(self.pending))
+        buf[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+def install_device_shims():
+    """ Register MicroPython-style `requests` and `deflate` modules so ota.py runs on CPython """
+    requests = types.ModuleType("requests")
+    requests.get = lambda url, stream=False, **kwargs: _Response(url, stream)
+    deflate = types.ModuleType("deflate")
+    deflate.ZLIB = 2
+    deflate.DeflateIO = _DeflateIO
+    sys.modules["requests"] = requests
+    sys.modules["deflate"] = deflate
+
+
+def run_update(manifest_url, device_dir, device_type="wash"):
+    """ ota.update_from_manifest as the device would run it, with device_dir as its flash """
+    install_device_shims()
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import ota
+    cwd = os.getcwd()
+    os.makedirs(device_dir, exist_ok=True)
+    os.chdir(device_dir)
+    try:
+        return ota.update_from_manifest(manifest_url, device_type)
+    finally:
+        os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", help="directory with manifest.json (default: build one into a temp dir)")
+    parser.add_argument("--version", default="0.0-dev", help="version for the manifest built when --dir is not given")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--corrupt", action="append", default=[], metavar="FILE", help="serve FILE with one byte flipped")
+    parser.add_argument("--run", metavar="DEVICE_DIR", help="run one update into DEVICE_DIR and exit")
+    parser.add_argument("--device-type", default="wash")
+    args = parser.parse_args()
+
+    directory = args.dir
+    if directory is None:
+        sys.path.insert(0, TOOLS)
+        import make_manifest
+        directory = tempfile.mkdtemp(prefix="ota-")
+        make_manifest.build(args.version, directory, root=ROOT)
+
+    server = OTAServer(directory, 0 if args.run else args.port, args.corrupt).start()
+    if args.run:
+        summary = run_update(server.url + "manifest.json", args.run, args.device_type)
+        server.shutdown()
+        for key in ("updated", "skipped", "failed", "pending"):
+            print(f"{key:9} {', '.join(summary[key]) or '-'}")
+        print(f"device: {summary['bytes_received']} bytes received, {summary['bytes_written']} written")
+    else:
+        print(f"Serving {directory} at {server.url}manifest.json (Ctrl-C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    for path, entry in sorted(server.stats.items()):
+        print(f"{path:28} {entry['requests']:4} requests {entry['bytes']:8} bytes")
+    print(f"server: {server.bytes_sent()} bytes sent")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Run the captive portal (wifi_portal.py) on Linux against a fake `network` module and load test it.
+
+Run on the host from the repository root:
+
+    python tools/portal_sim.py
+    python tools/portal_sim.py --clients 20 --requests 10 --port 8080 --timeout 5
+
+Starts WifiManager.web_server() on a local port with fake WLAN interfaces and a fake
+machine.reset(), then in parallel:
+  - --clients phones each GET the portal page --requests times (gzipped pages are inflated and checked)
+  - one client that connects and never sends anything
+  - one client that sends half a request and stalls
+  - one client that sends garbage
+and reports page latency (p50/p99), failures, and how close to --timeout the portal rebooted.
+"""
+import argparse
+import gzip
+import os
+import socket
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import modbus_sim  # noqa: E402  (ROOT on sys.path, MicroPython time shims)
+from bench_modbus import percentile  # noqa: E402
+
+SCAN_RESULTS = [
+    (b"HomeWiFi", b"\x00\x11\x22\x33\x44\x55", 6, -48, 3, False),
+    (b"Shop-2.4G", b"\x00\x11\x22\x33\x44\x66", 1, -67, 3, False),
+    (b"HomeWiFi", b"\x00\x11\x22\x33\x44\x77", 11, -80, 3, False),
+]
+
+
+class PortalReset(BaseException):
+    """ Raised by the fake machine.reset() to end the portal thread """
+
+
+class FakeWLAN:
+    """ network.WLAN with a canned scan list; connect() only succeeds for an entry in FakeWLAN.networks """
+
+    networks = {}
+
+    def __init__(self, interface):
+        self.interface = interface
+        self._active = False
+        self._connected = False
+        self.scans = 0
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = value
+
+    def config(self, *args, **kwargs):
+        return None
+
+    def ifconfig(self):
+        return ("192.168.4.1", "255.255.255.0", "192.168.4.1", "8.8.8.8")
+
+    def isconnected(self):
+        return self._connected
+
+    def scan(self):
+        self.scans += 1
+        time.sleep(FakeWLAN.scan_seconds)
+        return list(SCAN_RESULTS)
+
+    def connect(self, ssid, password=None, **kwargs):
+        self._connected = FakeWLAN.networks.get(ssid) == password
+
+    def disconnect(self):
+        self._connected = False
+
+    def status(self, *args):
+        return 1010 if self._connected else 1000
+
+
+def install_fakes(scan_seconds):
+    modbus_sim.install_time_shims()
+    FakeWLAN.scan_seconds = scan_seconds
+    network = types.ModuleType("network")
+    network.STA_IF = 0
+    network.AP_IF = 1
+    network.WLAN = FakeWLAN
+    sys.modules["network"] = network
+    machine = types.ModuleType("machine")
+
+    class Pin:
+        OUT = 1
+        IN = 0
+
+        def __init__(self, pin, mode=None, value=0):
+            self._value = value
+
+        def value(self, value=None):
+            if value is None:
+                return self._value
+            self._value = value
+
+    def reset():
+        raise PortalReset()
+
+    machine.Pin = Pin
+    machine.reset = reset
+    machine.unique_id = lambda: b"\x00PORTAL"
+    sys.modules["machine"] = machine
+
+
+def get_page(port, path="/"):
+    started = time.perf_counter()
+    with socket.create_connection(("127.0.0.1", port), timeout=15) as sock:
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: 192.168.4.1\r\n\r\n".encode())
+        body = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            body += chunk
+    return (time.perf_counter() - started) * 1000, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--timeout", type=int, default=10, help="portal timeout in seconds")
+    parser.add_argument("--scan-seconds", type=float, default=0.0, help="how long a fake WiFi scan blocks")
+    args = parser.parse_args()
+
+    install_fakes(args.scan_seconds)
+    import wifi_portal
+    from wifi_manager import WifiManager
+
+    wifi_portal.PORTAL_TIMEOUT_S = args.timeout
+    manager = WifiManager(reboot=False)
+    result = {}
+
+    def serve():
+        started = time.monotonic()
+        try:
+            manager.web_server(port=args.port)
+        except PortalReset:
+            result["reset_after"] = time.monotonic() - started
+        except Exception as error:
+            result["error"] = repr(error)
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+    time.sleep(0.5)
+
+    def idle_client():
+        with socket.create_connection(("127.0.0.1", args.port)):
+            time.sleep(args.timeout)
+
+    def stalled_client():
+        with socket.create_connection(("127.0.0.1", args.port)) as sock:
+            sock.sendall(b"GET / HTTP/1.1\r\nHost: 19")
+            time.sleep(args.timeout)
+
+    def garbage_client():
+        try:
+            with socket.create_connection(("127.0.0.1", args.port), timeout=10) as sock:
+                sock.sendall(b"\x16\x03\x01 not http at all\r\n\r\n")
+                result["garbage_reply"] = sock.recv(64).split(b"\r\n", 1)[0].decode(errors="replace")
+        except OSError as error:
+            result["garbage_reply"] = repr(error)
+
+    latencies = []
+    failures = []
+    sizes = []
+
+    def phone():
+        for _ in range(args.requests):
+            try:
+                ms, body = get_page(args.port)
+                head, separator, payload = body.partition(b"\r\n\r\n")
+                if separator and b"content-encoding: gzip" in head.lower():
+                    sizes.append(len(payload))
+                    body = gzip.decompress(payload)
+                if b"</html>" not in body or b'value="HomeWiFi"' not in body:
+                    failures.append("incomplete page")
+                latencies.append(ms)
+            except (OSError, EOFError) as error:
+                failures.append(repr(error))
+
+    threads = [threading.Thread(target=fn, daemon=True) for fn in (idle_client, stalled_client, garbage_client)]
+    threads += [threading.Thread(target=phone) for _ in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads[3:]:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    try:
+        _, body = get_page(args.port, "/nope")
+        result["after_load"] = body.split(b"\r\n", 1)[0].decode()
+    except OSError as error:
+        result["after_load"] = repr(error)
+
+    server.join(args.timeout + 5)
+    latencies.sort()
+    print(f"pages {len(latencies)} in {elapsed:.2f} s, p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms, failures {len(failures)}")
+    for failure in sorted(set(failures)):
+        print(f"  failure: {failure}")
+    if sizes:
+        print(f"page sent gzipped: {max(sizes)} bytes on the wire")
+    print(f"garbage request answered with: {result.get('garbage_reply')}")
+    print(f"portal still serving after load: {result.get('after_load')}")
+    print(f"wifi scans: {manager.wlan_sta.scans}")
+    if "reset_after" in result:
+        print(f"portal rebooted after {result['reset_after']:.2f} s (timeout {args.timeout} s)")
+    else:
+        print(f"portal did not reboot: {result.get('error', 'still running')}")
+
+
+if __name__ == "__main__":
+    main()
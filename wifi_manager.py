@@ -4,11 +4,9 @@
 # Description: WiFi Manager for ESP8266 and ESP32 using MicroPython.
 import machine
 import network
-import socket
-import re
-import os
 import time
-import json
+import binascii
+import config_store
 
 def get_device_serial_number():
     try:
@@ -18,6 +16,19 @@ def get_device_serial_number():
         return "UNKNOWN_SERIAL"
 
 led = machine.Pin(2, machine.Pin.OUT,value=0)
+
+# A scan blocks the radio for seconds, so connect() and the portal share results this fresh
+SCAN_TTL_MS = 30000
+# config_store key of the last network that gave us an IP: {"ssid", "bssid" (hex), "channel"},
+# tried first on the next boot without a scan
+LAST_NETWORK_KEY = 'last_network'
+CONNECT_TIMEOUT_MS = 10000
+# The direct connect only pays off when the AP is still there, so give up on it early
+FAST_CONNECT_TIMEOUT_MS = 4000
+CONNECT_POLL_MS = 50
+# Statuses after which waiting longer cannot help (not every port defines them)
+CONNECT_FAILED = tuple(getattr(network, name) for name in ('STAT_WRONG_PASSWORD', 'STAT_NO_AP_FOUND', 'STAT_CONNECT_FAIL') if hasattr(network, name))
+
 class WifiManager:
 
     def __init__(self, ssid = "WASH-"+str(get_device_serial_number()) , password = "12345678", reboot = True, debug = False):
@@ -38,9 +49,9 @@ class WifiManager:
         # Set the access point authentication mode to WPA2-PSK.
         self.ap_authmode = 3
         
-        # The file were the credentials will be stored.
+        # The config_store key were the credentials will be stored ({ssid: password}).
         # There is no encryption, it's just a plain text archive. Be aware of this security problem!
-        self.wifi_credentials = 'wifi.dat'
+        self.wifi_credentials = 'wifi'
         
         # Prevents the device from automatically trying to connect to the last saved network without first going through the steps defined in the code.
         self.wlan_sta.disconnect()
@@ -51,21 +62,90 @@ class WifiManager:
         
         self.debug = debug
 
+        # [(ssid, rssi, bssid, channel), ...] from the last scan, see scan_networks()
+        self.scan_cache = None
+        self.scan_time = 0
+
+        # How the last connect() got online ('direct', 'scan' or 'portal') and how long it took to get an IP
+        self.connect_path = None
+        self.time_to_ip_ms = None
+
+
+    def refresh_scan(self):
+        """ Scan now and cache one entry per SSID (its strongest BSSID), strongest first """
+        best = {}
+        for ssid, bssid, channel, rssi, *_ in self.wlan_sta.scan():
+            try:
+                ssid = ssid.decode("utf-8")
+            except UnicodeError:
+                continue
+            if not ssid:
+                continue # hidden network
+            if ssid not in best or rssi > best[ssid][1]:
+                best[ssid] = (ssid, rssi, bssid, channel)
+        self.scan_cache = sorted(best.values(), key=lambda network: network[1], reverse=True)
+        self.scan_time = time.ticks_ms()
+        return self.scan_cache
+
+    def scan_age_ms(self):
+        if self.scan_cache is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self.scan_time)
+
+    def scan_networks(self, max_age_ms=SCAN_TTL_MS):
+        """ Cached scan results, rescanning only if they are older than max_age_ms.
+            max_age_ms=None takes any cached list, so the caller never waits on the radio after the first scan. """
+        age = self.scan_age_ms()
+        if age is None or (max_age_ms is not None and age >= max_age_ms):
+            return self.refresh_scan()
+        return self.scan_cache
 
     def connect(self):
         if self.wlan_sta.isconnected():
             return
+        started = time.ticks_ms()
+        if not self.join_saved():
+            print('Could not connect to any WiFi network. Starting the configuration portal...')
+            self.web_server()
+            self.connect_path = 'portal'
+        if self.wlan_sta.isconnected():
+            self.time_to_ip_ms = time.ticks_diff(time.ticks_ms(), started)
+            print('Time to IP: {0} ms ({1})'.format(self.time_to_ip_ms, self.connect_path))
+
+
+    def join_saved(self, max_age_ms=SCAN_TTL_MS):
+        """ The last known good network directly (no scan), then every saved profile in ranked order.
+            Returns True once connected, never resets. """
         profiles = self.read_credentials()
-        for ssid, *_ in self.wlan_sta.scan():
-            ssid = ssid.decode("utf-8")
+        if not profiles:
+            return False
+        last = self.read_last_network()
+        if last and last['ssid'] in profiles:
+            bssid = binascii.unhexlify(last['bssid']) if last.get('bssid') else None
+            if self.wifi_connect(last['ssid'], profiles[last['ssid']], bssid, FAST_CONNECT_TIMEOUT_MS):
+                self.connect_path = 'direct'
+                return True
+        for ssid, bssid in self.ranked_profiles(profiles, max_age_ms):
+            if self.wifi_connect(ssid, profiles[ssid], bssid):
+                self.connect_path = 'scan'
+                return True
+        return False
+
+
+    def ranked_profiles(self, profiles, max_age_ms=SCAN_TTL_MS):
+        """ [(ssid, bssid or None), ...]: saved networks in range strongest first, then the ones the scan
+            did not see (hidden or out of range) in case they show up """
+        ranked = []
+        for ssid, rssi, bssid, channel in self.scan_networks(max_age_ms):
             if ssid in profiles:
-                password = profiles[ssid]
-                if self.wifi_connect(ssid, password):
-                    return
-        print('Could not connect to any WiFi network. Starting the configuration portal...')
-        self.web_server()
-        
-    
+                ranked.append((ssid, bssid))
+        seen = [ssid for ssid, _ in ranked]
+        for ssid in profiles:
+            if ssid not in seen:
+                ranked.append((ssid, None))
+        return ranked
+
+
     def disconnect(self):
         if self.wlan_sta.isconnected():
             self.wlan_sta.disconnect()
@@ -80,316 +160,73 @@ class WifiManager:
 
 
     def write_credentials(self, profiles):
-        lines = []
-        for ssid, password in profiles.items():
-            lines.append('{0};{1}\n'.format(ssid, password))
-        with open(self.wifi_credentials, 'w') as file:
-            file.write(''.join(lines))
+        config_store.update({self.wifi_credentials: dict(profiles)})
 
     def write_config(self, data):
-        f = open('config.json','w') 
-        f.write(data) 
-        f.close()
+        config_store.update({"wifi_config": data})
         
     def read_credentials(self):
-        lines = []
-        try:
-            with open(self.wifi_credentials) as file:
-                lines = file.readlines()
-        except Exception as error:
-            if self.debug:
-                print(error)
-            pass
-        profiles = {}
-        for line in lines:
-            ssid, password = line.strip().split(';')
-            profiles[ssid] = password
-        return profiles
-
-
-    def wifi_connect(self, ssid, password):
+        # A copy, so callers can edit it and hand it back to write_credentials()
+        return dict(config_store.get(self.wifi_credentials) or {})
+
+
+    def reconnect(self):
+        """ Retry the saved networks without starting the portal or resetting. Returns True once connected """
+        if self.wlan_sta.isconnected():
+            return True
+        # The network just dropped, so don't trust the cached list
+        return self.join_saved(0)
+
+
+    def wifi_connect(self, ssid, password, bssid=None, timeout_ms=CONNECT_TIMEOUT_MS, reset_on_failure=False):
         print('Trying to connect to:', ssid)
-        self.wlan_sta.connect(ssid, password)
-        time.sleep(1)
-        for _ in range(100):
+        if bssid:
+            self.wlan_sta.connect(ssid, password, bssid=bssid)
+        else:
+            self.wlan_sta.connect(ssid, password)
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while time.ticks_diff(deadline, time.ticks_ms()) > 0:
             if self.wlan_sta.isconnected():
                 print('\nConnected! Network information:', self.wlan_sta.ifconfig())
                 led.value(1)
+                self.remember_network(ssid, bssid)
                 return True
-            else:
-                if led.value() == 0 :
-                    led.value(1)
-                else :
-                    led.value(0)
-                print('.', end='')
-                time.sleep_ms(100)
-                
+            if self.wlan_sta.status() in CONNECT_FAILED:
+                break
+            led.value(1 - led.value())
+            print('.', end='')
+            time.sleep_ms(CONNECT_POLL_MS)
+
         print('\nConnection failed!')
         led.value(0)
         self.wlan_sta.disconnect()
-        time.sleep(5)
-        machine.reset()
-        return False
-
-    
-    def web_server(self):
-        self.wlan_ap.active(True)
-        self.wlan_ap.config(essid = self.ap_ssid, password = self.ap_password, authmode = self.ap_authmode)
-        server_socket = socket.socket()
-        server_socket.close()
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind(('', 80))
-        server_socket.listen(10) 
-        print('Connect to', self.ap_ssid, 'with the password', self.ap_password, 'and access the captive portal at', self.wlan_ap.ifconfig()[0])
-        # เพิ่มตัวแปรสำหรับจับเวลาเริ่มต้น
-        start_time = time.time()
-        while True:
-            # ตรวจสอบว่าผ่านไป 3 นาทีแล้วหรือยัง
-            if (time.time() - start_time) > 60: # 180 วินาที = 3 นาที
-                print("3 นาทีผ่านไป, กำลังรีสตาร์ทอุปกรณ์...")
-                machine.reset()
-            
-            if self.wlan_sta.isconnected():
-                self.wlan_ap.active(False)
-                if self.reboot:
-                    print('The device will reboot in 5 seconds.')
-                    time.sleep(5)
-                    machine.reset()
-
-            self.client, addr = server_socket.accept()
-            try:
-                self.client.settimeout(5.0)
-                self.request = b''
-                try:
-                    while True:
-                        if '\r\n\r\n' in self.request:
-                            # Fix for Safari browser
-                            self.request += self.client.recv(512) 
-                            break
-                        self.request += self.client.recv(128)
-                except Exception as error:
-                    # It's normal to receive timeout errors in this stage, we can safely ignore them.
-                    if self.debug:
-                        print(error)
-                    pass
-                if self.request:
-                    if self.debug:
-                        print(self.url_decode(self.request))
-                    url = re.search('(?:GET|POST) /(.*?)(?:\\?.*?)? HTTP', self.request).group(1).decode('utf-8').rstrip('/')
-                    if url == '':
-                        self.handle_root()
-                    elif url == 'configure':
-                        self.handle_configure()
-                    else:
-                        self.handle_not_found()
-            except Exception as error:
-                if self.debug:
-                    print(error)
-                print("disconnect_reboot")
-                time.sleep(5)
-                machine.reset()
-                return
-            finally:
-                self.client.close()
-
-
-    def send_header(self, status_code = 200):
-        self.client.send("""HTTP/1.1 {0} OK\r\n""".format(status_code))
-        self.client.send("""Content-Type: text/html\r\n""")
-        self.client.send("""Connection: close\r\n""")
-
-
-    def send_response(self, payload, status_code = 200):
-        self.send_header(status_code)
-        self.client.sendall("""
-            <!DOCTYPE html>
-            <html lang="en">
-                <head>
-                    <title>WiFi Manager</title>
-                    <meta charset="UTF-8">
-                    <meta name="viewport" content="width=device-width, initial-scale=1">
-                    <link rel="icon" href="data:,">
-                </head>
-                <body>
-                    {0}
-                </body>
-            </html>
-        """.format(payload))
-        self.client.close()
-
-
-    def handle_root(self):
-        self.send_header()
-        self.client.sendall("""
-            <!DOCTYPE html>
-            <html lang="en" style="font-family: Arial, Helvetica, sans-serif;display: inline-block;text-align: center;">
-                <head>
-                    <title>WiFi Manager</title>
-                    <meta charset="UTF-8">
-                    <meta name="viewport" content="width=device-width, initial-scale=1">
-                    <link rel="icon" href="data:,">
-                </head>
-                <body style="font-size:1.4rem">
-                <form action="/configure" method="POST" accept-charset="utf-8">
-                    <div class="topnav">
-                    <h1 style="background-color: #0A1128;font-size: 1.6rem;color: white;padding: 2px;margin: 0px;">เชื่อมต่อ WiFi</h1>
-                    </div>
-                    <div class="content">
-                    <div class="card-grid" style="max-width: 800px;margin: 0 auto;display: grid;grid-gap: 2rem;grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));">
-                    <div class="card" style="background-color: white;box-shadow: 2px 2px 12px 1px rgba(140, 140, 140, .5);">
-                    <div class="row" style="display: flex;height: 60px;">
-                            <div class="col-30" style="display: inline-block;width: 30%;align-self: center;">
-                            <label for="ssid">WiFi</label>
-                            </div>
-                            <div class="col-70" style="display: inline-block;width: 70%;align-self: center;">
-                            <select id="ssid" name="ssid" style="font-size: 1rem;width: 90%;padding: 12px 20px;margin: 18px;display: inline-block;border: 1px solid #ccc;border-radius: 4px;box-sizing: border-box;">
-        """.format(self.ap_ssid))
-        for ssid, *_ in self.wlan_sta.scan():
-            ssid = ssid.decode("utf-8")
-            self.client.sendall("""
-                    <option  value="{0}">&nbsp;{0}</option>
-            """.format(ssid))
-        self.client.sendall("""
-                            </select>
-                            </div>
-                            </div>
-                                <div class="row" style="display: flex;height: 60px;">
-                                    <div class="col-30" style="display: inline-block;width: 30%;align-self: center;">
-                                        <label for="password">รหัสผ่าน</label>
-                                    </div>
-                                    <div class="col-70" style="display: inline-block;width: 70%;align-self: center;">
-                                        <input type="text" placeholder="รหัสผ่าน Wifi"  id="password" name="password" style="width: 90%;padding: 12px 20px;margin: 18px;display: inline-block;border: 1px solid #ccc;border-radius: 4px;box-sizing: border-box;font-size: 1rem;">
-                                    </div>
-                                </div>
-                                
-                                <div class="row" style="display: flex;height: 60px;">
-                                    <div class="col-30" style="display: inline-block;width: 30%;align-self: center;">
-                                        <label for="select">ประเภท</label>
-                                    </div>
-                                    <div class="col-70" style="display: inline-block;width: 70%;align-self: center;">
-                                        <select id="select" name="select" style="width: 90%;padding: 12px 20px;margin: 18px;display: inline-block;border: 1px solid #ccc;border-radius: 4px;box-sizing: border-box;font-size: 1rem;">
-                                        <option value="wash">เครื่อง ซักผ้า</option>
-                                        <option value="dryer">เครื่อง อบผ้า</option>
-                                        </select>
-                                    </div>
-                                </div>
-                                
-                                <div class="">
-                                    <input type ="submit" style="border: none;color: #FEFCFB;background-color: #034078;padding: 15px 15px;text-align: center;text-decoration: none;display: inline-block;font-size: 16px;width: 100px;margin-right: 10px;margin-bottom: 20px;border-radius: 4px;transition-duration: 0.4s;font-size: 1rem;" value="Connect" class="btn">
-                                </div>
-                    </div>
-                    </div>
-                    </div>
-                    </form>
-                </body>
-            </html>
-        """)
-        self.client.close()
-
-    def handle_configure(self):
-        match = re.search('ssid=([^&]*)&password=(.*)&select=(.*)', self.url_decode(self.request))
-        if match:
-            ssid = match.group(1).decode('utf-8')
-            password = match.group(2).decode('utf-8')
-            select = match.group(3).decode('utf-8')
-            if len(ssid) == 0:
-                self.send_response("""
-                    <p>SSID must be providaded!</p>
-                    <p>Go back and try again!</p>
-                """, 400)
-            elif self.wifi_connect(ssid, password):
-                self.send_response("""
-                    <p>Successfully connected to</p>
-                    <h1>{0}</h1>
-                    <p>IP address: {1}</p>
-                """.format(ssid, self.wlan_sta.ifconfig()[0]))
-                profiles = self.read_credentials()
-                profiles[ssid] = password
-                self.write_credentials(profiles)
-                data = {"ssid":ssid,"pwd":password}
-                self.write_config(json.dumps(data))
-                
-                import requests
-
-                boot_update = requests.get('http://34.124.162.209/espV3/boot.txt')
-                if boot_update.status_code == 200:
-                    with open('boot.py','w') as f:
-                        f.write(boot_update.text)
-
-                main_update = requests.get('http://34.124.162.209/espV3/main.txt')
-                if main_update.status_code == 200:
-                    with open('main.py','w') as f:
-                        f.write(main_update.text)
-
-                if select == 'wash' :
-                    wash_update = requests.get('http://34.124.162.209/espV3/wash.txt')
-                    if wash_update.status_code == 200:
-                        with open('wash.py','w') as f:
-                            f.write(wash_update.text)
-                            
-                if select == 'dryer' :
-                    dryer_update = requests.get('http://34.124.162.209/espV3/dryer.txt')
-                    if dryer_update.status_code == 200:
-                        with open('wash.py','w') as f:
-                            f.write(dryer_update.text)
-                            
-                print(select)
-                time.sleep(5)
-            else:
-                self.send_response("""
-                    <p>Could not connect to</p>
-                    <h1>{0}</h1>
-                    <p>Go back and try again!</p>
-                """.format(ssid))
-                time.sleep(5)
-        else:
-            self.send_response("""
-                <p>Parameters not found!</p>
-            """, 400)
+        if reset_on_failure:
             time.sleep(5)
+            machine.reset()
+        return False
 
-    def resetPass(self):
-        self.send_response("""
-            <p>Page not found!</p>
-        """, 404)
-
-
-    def handle_not_found(self):
-        self.send_response("""
-            <p>Page not found!</p>
-        """, 404)
-
-
-    def url_decode(self, url_string):
-
-        if not url_string:
-            return b''
 
-        if isinstance(url_string, str):
-            url_string = url_string.encode('utf-8')
+    def read_last_network(self):
+        return config_store.get(LAST_NETWORK_KEY)
 
-        bits = url_string.split(b'%')
 
-        if len(bits) == 1:
-            return url_string
+    def remember_network(self, ssid, bssid=None):
+        """ Persist the network we just joined for the next boot's direct connect. Only writes flash when it changed """
+        channel = None
+        for cached_ssid, rssi, cached_bssid, cached_channel in self.scan_cache or ():
+            if cached_ssid == ssid:
+                bssid = bssid or cached_bssid
+                channel = cached_channel
+                break
+        last = self.read_last_network() or {}
+        if last.get('ssid') == ssid:
+            if bssid is None:
+                return
+            channel = channel if channel is not None else last.get('channel')
+        config_store.update({LAST_NETWORK_KEY: {"ssid": ssid, "bssid": binascii.hexlify(bssid).decode() if bssid else None, "channel": channel}})
 
-        res = [bits[0]]
-        appnd = res.append
-        hextobyte_cache = {}
 
-        for item in bits[1:]:
-            try:
-                code = item[:2]
-                char = hextobyte_cache.get(code)
-                if char is None:
-                    char = hextobyte_cache[code] = bytes([int(code, 16)])
-                appnd(char)
-                appnd(item[2:])
-            except Exception as error:
-                if self.debug:
-                    print(error)
-                appnd(b'%')
-                appnd(item)
-
-        return b''.join(res)
+    def web_server(self, port=None):
+        # The captive portal (sockets, regex, HTML) is only imported when it is actually needed
+        from wifi_portal import Portal, PORTAL_PORT
+        Portal(self).web_server(port or PORTAL_PORT)
@@ -0,0 +1,408 @@
+# Captive portal for WifiManager, split out so its HTML and socket code are only loaded
+# when the device cannot join a saved network.
+import machine
+import socket
+import re
+import time
+import struct
+import binascii
+from wifi_manager import SCAN_TTL_MS
+try:
+    import select
+except ImportError:
+    import uselect as select
+
+PORTAL_PORT = 80
+# Reboot when nobody configured WiFi within this time
+PORTAL_TIMEOUT_S = 60
+# Longest wait in poll(), i.e. how late the timeout and connection checks can run
+PORTAL_POLL_MS = 200
+PORTAL_MAX_CLIENTS = 8
+# A client has this long to send its whole request
+REQUEST_TIMEOUT_MS = 5000
+MAX_REQUEST_SIZE = 2048
+# Pre-compressed portal page built by tools/build_portal.py from tools/portal/index.html
+PORTAL_PAGE_FILE = 'portal.bin'
+PAGE_HEADER = '<IIIIII'
+PAGE_HEADER_SIZE = 24
+SEND_BUFFER_SIZE = 512
+# Firmware fetched after the first WiFi setup, as (file on INSTALL_URL, file on the device).
+# Libraries first, boot.py and main.py last, so a failed download never leaves a new main.py on old modules.
+# None stands for the device driver picked in the form (INSTALL_DEVICE_FILES), installed as wash.py.
+INSTALL_URL = 'http://34.124.162.209/espV3/'
+INSTALL_FILES = (
+    ('modbus.txt', 'modbus.py'),
+    ('register_map.txt', 'register_map.py'),
+    ('config_store.txt', 'config_store.py'),
+    ('status_codec.txt', 'status_codec.py'),
+    ('ota.txt', 'ota.py'),
+    ('portal.bin', PORTAL_PAGE_FILE),
+    (None, 'wash.py'),
+    ('controller.txt', 'controller.py'),
+    ('app.txt', 'app.py'),
+    ('boot.txt', 'boot.py'),
+    ('main.txt', 'main.py'),
+)
+INSTALL_DEVICE_FILES = {'wash': 'wash.txt', 'dryer': 'dryer.txt'}
+
+
+def request_complete(request):
+    """ True once the headers and the whole body (Content-Length) have arrived """
+    end = request.find(b'\r\n\r\n')
+    if end < 0:
+        return False
+    headers = request[:end].lower()
+    i = headers.find(b'content-length:')
+    length = 0
+    if i >= 0:
+        value = headers[i + 15:].split(b'\r\n', 1)[0].strip()
+        length = int(value) if value.isdigit() else 0
+    return len(request) >= end + 4 + length
+
+
+class Portal:
+
+    def __init__(self, manager):
+        self.manager = manager
+        # Set by handle_configure when the firmware download failed: stay on the code in memory, no reboot
+        self.install_error = None
+
+    def __getattr__(self, name):
+        # Everything not portal specific (wlan_sta, wlan_ap, ap_ssid, credentials helpers...) lives on the manager
+        return getattr(self.manager, name)
+
+    def web_server(self, port=PORTAL_PORT):
+        """ Serve the portal until the station connects or PORTAL_TIMEOUT_S passes (then reboot).
+            One poll loop multiplexes the listening socket and every client, so the timeout and
+            the connection check run on schedule and one slow or broken client cannot stall the rest. """
+        self.wlan_ap.active(True)
+        self.wlan_ap.config(essid = self.ap_ssid, password = self.ap_password, authmode = self.ap_authmode)
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind(('', port))
+        server_socket.listen(PORTAL_MAX_CLIENTS)
+        server_socket.setblocking(False)
+        self.server_socket = server_socket
+        # connect() normally scanned moments ago; otherwise warm the cache before serving
+        self.scan_networks()
+        print('Connect to', self.ap_ssid, 'with the password', self.ap_password, 'and access the captive portal at', self.wlan_ap.ifconfig()[0])
+        poller = select.poll()
+        poller.register(server_socket, select.POLLIN)
+        # client socket -> [request bytes so far, ticks_ms deadline]
+        clients = {}
+        # CPython's poll() reports file descriptors, MicroPython's reports the socket objects
+        by_fd = {server_socket.fileno(): server_socket} if hasattr(server_socket, 'fileno') else {}
+        deadline = time.ticks_add(time.ticks_ms(), PORTAL_TIMEOUT_S * 1000)
+        try:
+            while True:
+                now = time.ticks_ms()
+                if time.ticks_diff(now, deadline) >= 0:
+                    print(f"No WiFi configured within {PORTAL_TIMEOUT_S} s, rebooting...")
+                    machine.reset()
+
+                if self.wlan_sta.isconnected():
+                    self.wlan_ap.active(False)
+                    if self.install_error:
+                        print(f"Firmware install failed ({self.install_error}), not rebooting into a partial file set")
+                    elif self.reboot:
+                        print('The device will reboot in 5 seconds.')
+                        time.sleep(5)
+                        machine.reset()
+                    return
+
+                if not clients and (self.scan_age_ms() or 0) >= SCAN_TTL_MS:
+                    # Refresh the network list in idle time so a page load never waits on the radio
+                    self.refresh_scan()
+
+                for sock, event in poller.poll(PORTAL_POLL_MS):
+                    sock = by_fd.get(sock, sock)
+                    if sock is server_socket:
+                        self._accept(server_socket, poller, clients, by_fd)
+                    elif sock in clients:
+                        self._receive(sock, event, poller, clients, by_fd)
+
+                now = time.ticks_ms()
+                for sock in [sock for sock, state in clients.items() if time.ticks_diff(now, state[1]) >= 0]:
+                    if self.debug:
+                        print('Request timed out')
+                    self._close(sock, poller, clients, by_fd)
+        finally:
+            for sock in list(clients):
+                self._close(sock, poller, clients, by_fd)
+            server_socket.close()
+
+    def _accept(self, server_socket, poller, clients, by_fd):
+        try:
+            client, addr = server_socket.accept()
+        except OSError:
+            return
+        client.setblocking(False)
+        poller.register(client, select.POLLIN)
+        if hasattr(client, 'fileno'):
+            by_fd[client.fileno()] = client
+        clients[client] = [b'', time.ticks_add(time.ticks_ms(), REQUEST_TIMEOUT_MS)]
+        if len(clients) >= PORTAL_MAX_CLIENTS:
+            # Full: leave further phones waiting in the listen backlog until a slot frees up
+            poller.modify(server_socket, 0)
+
+    def _detach(self, sock, poller, clients, by_fd):
+        """ Stop polling a client socket (before it is closed, the fd must still be valid) """
+        try:
+            poller.unregister(sock)
+        except (OSError, ValueError, KeyError):
+            pass
+        if hasattr(sock, 'fileno'):
+            by_fd.pop(sock.fileno(), None)
+        clients.pop(sock, None)
+        if len(clients) == PORTAL_MAX_CLIENTS - 1:
+            poller.modify(self.server_socket, select.POLLIN)
+
+    def _close(self, sock, poller, clients, by_fd):
+        self._detach(sock, poller, clients, by_fd)
+        sock.close()
+
+    def _receive(self, sock, event, poller, clients, by_fd):
+        state = clients[sock]
+        try:
+            data = sock.recv(512) if event & select.POLLIN else b''
+        except OSError:
+            data = b''
+        if not data:
+            self._close(sock, poller, clients, by_fd)
+            return
+        state[0] += data
+        request = state[0]
+        if len(request) > MAX_REQUEST_SIZE:
+            request = None
+        elif not request_complete(request):
+            return
+        self._detach(sock, poller, clients, by_fd)
+        self._dispatch(sock, request)
+        sock.close()
+
+    def _dispatch(self, sock, request):
+        """ Run the page handler for one complete request. A bad request only costs that client its connection """
+        self.client = sock
+        self.request = request
+        try:
+            # Handlers write whole pages with sendall()
+            sock.setblocking(True)
+            sock.settimeout(5.0)
+            if request is None:
+                self.send_response("""
+                    <p>Request too large!</p>
+                """, 413)
+                return
+            if self.debug:
+                print(self.url_decode(request))
+            match = re.search(b'(?:GET|POST) /(.*?)(?:\\?.*?)? HTTP', request)
+            if match is None:
+                self.send_response("""
+                    <p>Bad request!</p>
+                """, 400)
+                return
+            url = match.group(1).decode('utf-8').rstrip('/')
+            if url == '':
+                self.handle_root()
+            elif url == 'configure':
+                self.handle_configure()
+            else:
+                self.handle_not_found()
+        except Exception as error:
+            print(f"Portal request failed: {error}")
+
+    def _send(self, text):
+        self.client.sendall(text.encode('utf-8') if isinstance(text, str) else text)
+
+    def send_header(self, status_code = 200):
+        self._send("""HTTP/1.1 {0} OK\r\n""".format(status_code))
+        self._send("""Content-Type: text/html\r\n""")
+        self._send("""Connection: close\r\n""")
+
+
+    def send_response(self, payload, status_code = 200):
+        self.send_header(status_code)
+        self._send("""
+            <!DOCTYPE html>
+            <html lang="en">
+                <head>
+                    <title>WiFi Manager</title>
+                    <meta charset="UTF-8">
+                    <meta name="viewport" content="width=device-width, initial-scale=1">
+                    <link rel="icon" href="data:,">
+                </head>
+                <body>
+                    {0}
+                </body>
+            </html>
+        """.format(payload))
+        self.client.close()
+
+
+    def ssid_options(self):
+        """ The only dynamic part of the portal page: one <option> per scanned network """
+        options = []
+        for ssid, *_ in self.scan_networks(None):
+            ssid = ssid.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+            options.append('<option value="{0}">&nbsp;{0}</option>\n'.format(ssid))
+        return ''.join(options).encode('utf-8')
+
+    def handle_root(self):
+        """ Stream the pre-compressed page from PORTAL_PAGE_FILE (see tools/build_portal.py).
+            The SSID list goes out as one stored deflate block between the pre-built head and
+            tail, so the device never renders or compresses the page itself. """
+        options = self.ssid_options()
+        try:
+            page = open(PORTAL_PAGE_FILE, 'rb')
+        except OSError:
+            self.send_response("""
+                <form action="/configure" method="POST" accept-charset="utf-8">
+                    <select name="ssid">{0}</select>
+                    <input type="text" name="password">
+                    <select name="select"><option value="wash">wash</option><option value="dryer">dryer</option></select>
+                    <input type="submit" value="Connect">
+                </form>
+            """.format(options.decode('utf-8')))
+            return
+        try:
+            head_len, tail_len, crc, head_size, tail_size, tail_k = struct.unpack(PAGE_HEADER, page.read(PAGE_HEADER_SIZE))
+            buffer = bytearray(SEND_BUFFER_SIZE)
+            view = memoryview(buffer)
+            # gzip CRC32 of head + options + tail without reading the tail: continue over zeros, then add its constant
+            crc = binascii.crc32(options, crc)
+            remaining = tail_size
+            while remaining:
+                n = min(remaining, SEND_BUFFER_SIZE)
+                crc = binascii.crc32(view[:n], crc)
+                remaining -= n
+            crc = (crc ^ tail_k) & 0xFFFFFFFF
+            self._send("HTTP/1.1 200 OK\r\n")
+            self._send("Content-Type: text/html; charset=utf-8\r\n")
+            self._send("Content-Encoding: gzip\r\n")
+            self._send("Content-Length: {0}\r\n".format(head_len + 5 + len(options) + tail_len + 8))
+            self._send("Connection: close\r\n\r\n")
+            self._stream(page, head_len, view)
+            self._send(struct.pack('<BHH', 0, len(options), len(options) ^ 0xFFFF))
+            self._send(options)
+            self._stream(page, tail_len, view)
+            self._send(struct.pack('<II', crc, (head_size + len(options) + tail_size) & 0xFFFFFFFF))
+        finally:
+            page.close()
+            self.client.close()
+
+    def _stream(self, page, length, view):
+        while length:
+            n = page.readinto(view[:min(length, SEND_BUFFER_SIZE)])
+            if not n:
+                raise OSError('{0} is truncated'.format(PORTAL_PAGE_FILE))
+            self.client.sendall(view[:n])
+            length -= n
+
+    def handle_configure(self):
+        match = re.search(b'ssid=([^&]*)&password=(.*)&select=(.*)', self.url_decode(self.request))
+        if match:
+            ssid = match.group(1).decode('utf-8')
+            password = match.group(2).decode('utf-8')
+            select = match.group(3).decode('utf-8')
+            if len(ssid) == 0:
+                self.send_response("""
+                    <p>SSID must be providaded!</p>
+                    <p>Go back and try again!</p>
+                """, 400)
+            elif self.wifi_connect(ssid, password, reset_on_failure=False):
+                profiles = self.read_credentials()
+                profiles[ssid] = password
+                self.write_credentials(profiles)
+                data = {"ssid":ssid,"pwd":password}
+                self.write_config(data)
+
+                ok, message = self.install_firmware(select)
+                if ok:
+                    self.send_response("""
+                        <p>Successfully connected to</p>
+                        <h1>{0}</h1>
+                        <p>IP address: {1}</p>
+                    """.format(ssid, self.wlan_sta.ifconfig()[0]))
+                    time.sleep(5)
+                else:
+                    self.install_error = message
+                    self.send_response("""
+                        <p>Connected to</p>
+                        <h1>{0}</h1>
+                        <p>but the {1} firmware could not be installed:</p>
+                        <p>{2}</p>
+                        <p>The device keeps its current firmware and does not reboot.</p>
+                    """.format(ssid, select, message), 500)
+            else:
+                self.send_response("""
+                    <p>Could not connect to</p>
+                    <h1>{0}</h1>
+                    <p>Go back and try again!</p>
+                """.format(ssid))
+        else:
+            self.send_response("""
+                <p>Parameters not found!</p>
+            """, 400)
+
+    def install_firmware(self, device_type):
+        """ Download INSTALL_FILES with ota.download_to_file(), which only replaces a file once it arrived
+            complete, and stop at the first failure. Returns (ok, message) """
+        import ota
+        for source, filename in INSTALL_FILES:
+            if source is None:
+                source = INSTALL_DEVICE_FILES.get(device_type)
+                if source is None:
+                    continue
+            try:
+                ok, message = ota.download_to_file(INSTALL_URL + source, filename)
+            except Exception as e:
+                ok, message = False, f"Error installing {filename}: {e}"
+            print(message)
+            if not ok:
+                return False, message
+        return True, "Firmware installed"
+
+    def resetPass(self):
+        self.send_response("""
+            <p>Page not found!</p>
+        """, 404)
+
+
+    def handle_not_found(self):
+        self.send_response("""
+            <p>Page not found!</p>
+        """, 404)
+
+
+    def url_decode(self, url_string):
+
+        if not url_string:
+            return b''
+
+        if isinstance(url_string, str):
+            url_string = url_string.encode('utf-8')
+
+        bits = url_string.split(b'%')
+
+        if len(bits) == 1:
+            return url_string
+
+        res = [bits[0]]
+        appnd = res.append
+        hextobyte_cache = {}
+
+        for item in bits[1:]:
+            try:
+                code = item[:2]
+                char = hextobyte_cache.get(code)
+                if char is None:
+                    char = hextobyte_cache[code] = bytes([int(code, 16)])
+                appnd(char)
+                appnd(item[2:])
+            except Exception as error:
+                if self.debug:
+                    print(error)
+                appnd(b'%')
+                appnd(item)
+
+        return b''.join(res)